@@ -2,7 +2,12 @@
 import os
 import sys
 import re
-from pymol import cmd
+import subprocess
+
+import clash_engine
+import instrument
+import metrics_store
+import tuple_archive
 
 # -------------------------
 # Config
@@ -20,8 +25,6 @@ BP_PDB_SUFFIX = "_bp.pdb"
 BP_TXT_SUFFIX = "_clashscore_local_bp.txt"
 GLOBAL_TXT_SUFFIX = "_clashscore_global.txt"
 
-OUT_SUMMARY = "classification_files/clashscore_summary.txt"
-
 # -------------------------
 # Helpers
 # -------------------------
@@ -38,18 +41,25 @@ def get_purine_info(chain1, nt_type1, nt1, chain2, nt_type2, nt2):
 def locate_tuple_dir(pdbid, chain_purine, nt_purine):
     """
     Return the first tuple directory matching any ROOT_GLOBS:
-      <root>/{pdbid}_{chain_purine}_{nt_purine}
+      <root>/{pdbid}_{chain_purine}_{nt_purine}, unpacked or archived
     """
     for root in ROOT_GLOBS:
         tup = os.path.join(root, f"{pdbid}_{chain_purine}_{nt_purine}")
-        if os.path.isdir(tup):
+        if tuple_archive.isdir(tup):
             return tup
     return None
 
+def locate_reference_pdb(pdbid, tup_dir):
+    """The deposited model of the structure: <pdbid>_final.pdb in the cwd, else the copy in WC/."""
+    for path in (f"{pdbid}_final.pdb", os.path.join(tup_dir, "WC", f"{pdbid}_final.pdb")):
+        if os.path.exists(path):
+            return path
+    return None
+
 def extract_clashscore(txt_path):
     """Extract numeric clashscore from phenix.clashscore output file."""
     try:
-        with open(txt_path, "r") as f:
+        with tuple_archive.open_file(txt_path) as f:
             for line in f:
                 if "clashscore" in line:
                     m = re.search(r"clashscore\s*[:=]\s*([0-9.]+)", line, flags=re.I)
@@ -68,7 +78,11 @@ def run_clashscore(pdb_path, txt_out, force=False):
         return False
     if os.path.exists(txt_out) and not force:
         return True
-    rc = os.system(f"phenix.clashscore {pdb_path} > {txt_out} 2>&1")
+    try:
+        with open(txt_out, "w") as out:
+            rc = instrument.run(["phenix.clashscore", pdb_path], stdout=out, stderr=subprocess.STDOUT).returncode
+    except OSError:
+        return False
     return rc == 0
 
 def clamp_resi(n):
@@ -88,12 +102,23 @@ def sel_bp(chain1, nt1, chain2, nt2):
         f"(chain {chain2} and resi {int(nt2)})"
     )
 
-def ensure_locals_for_state(tup_dir, state, pdb_name, name_id, chain_purine, nt_purine, chain_pyrimidine, nt_pyrimidine):
+def residues_neighbours(chain, nt):
+    """The residues of sel_neighbours() as [(chain, resseq)]."""
+    n = clamp_resi(nt)
+    return [(chain, n - 1), (chain, n), (chain, n + 1)]
+
+def residues_bp(chain1, nt1, chain2, nt2):
+    """The residues of sel_bp() as [(chain, resseq)]."""
+    return [(chain1, int(nt1)), (chain2, int(nt2))]
+
+def ensure_locals_for_state(tup_dir, state, pdb_name, name_id, chain_purine, nt_purine, chain_pyrimidine, nt_pyrimidine,
+                            use_phenix=True):
     """
     For given state dir (HG/WC):
-      - load PDB
-      - save two PDBs (neighbours & bp)
-      - run clashscore on each → txts
+      - save the neighbours and the bp selections with PyMOL and run
+        phenix.clashscore on each, or (not use_phenix) score them with
+        clash_engine.py on the model with Reduce hydrogens added
+      - write the scores → txts
     Return (neigh_txt_path, bp_txt_path), each may be None on failure.
     """
     state_dir = os.path.join(tup_dir, state)
@@ -106,6 +131,11 @@ def ensure_locals_for_state(tup_dir, state, pdb_name, name_id, chain_purine, nt_
         print(f" Missing PDB: {pdb_path}")
         return None, None
 
+    if not use_phenix:
+        return ensure_locals_native(state_dir, pdb_path, name_id, chain_purine, nt_purine,
+                                    chain_pyrimidine, nt_pyrimidine)
+
+    from pymol import cmd
     try:
         cmd.reinitialize()
         cmd.load(pdb_path, name_id)
@@ -130,10 +160,38 @@ def ensure_locals_for_state(tup_dir, state, pdb_name, name_id, chain_purine, nt_
         print(f" PyMOL error [{state}] {name_id}: {e}")
         return None, None
 
-def ensure_global_for_state(tup_dir, state, pdb_name, name_id):
+def ensure_locals_native(state_dir, pdb_path, name_id, chain_purine, nt_purine, chain_pyrimidine, nt_pyrimidine):
+    """
+    ensure_locals_for_state() with the in-process clash engine: hydrogens are
+    added to the model once (one Reduce run), both selections are scored on
+    that copy.  Same output files, no selection PDBs.
+    """
+    out_neigh_txt = os.path.join(state_dir, f"{name_id}{NEIGH_TXT_SUFFIX}")
+    out_bp_txt = os.path.join(state_dir, f"{name_id}{BP_TXT_SUFFIX}")
+    selections = {}
+    if not os.path.exists(out_neigh_txt):
+        selections[out_neigh_txt] = residues_neighbours(chain_purine, nt_purine)
+    if not os.path.exists(out_bp_txt):
+        selections[out_bp_txt] = residues_bp(chain_purine, nt_purine, chain_pyrimidine, nt_pyrimidine)
+    if selections:
+        hydrogen_pdb = clash_engine.add_hydrogens(pdb_path)
+        if hydrogen_pdb is None:
+            return None, None
+        try:
+            scores = clash_engine.local_clashscores(hydrogen_pdb, selections)
+        except (OSError, ValueError) as e:
+            print(f" Clash engine error {name_id}: {e}")
+            return None, None
+        for txt, score in scores.items():
+            clash_engine.write_clashscore(txt, score, os.path.basename(hydrogen_pdb))
+    return out_neigh_txt, out_bp_txt
+
+def ensure_global_for_state(tup_dir, state, pdb_name, name_id, reference_pdb=None, use_phenix=True):
     """
     For given state dir (HG/WC):
-      - run clashscore on the full model PDB
+      - run phenix.clashscore on the full model PDB, or (not use_phenix, with
+        a reference) score it with clash_engine.py against the contact baseline
+        of reference_pdb (the deposited structure), both with Reduce hydrogens
       - write *_clashscore_global.txt
     Return txt path or None on failure.
     """
@@ -146,15 +204,30 @@ def ensure_global_for_state(tup_dir, state, pdb_name, name_id):
         print(f" Missing PDB: {pdb_path}")
         return None
     out_txt = os.path.join(state_dir, f"{name_id}{GLOBAL_TXT_SUFFIX}")
-    run_clashscore(pdb_path, out_txt)
+    if use_phenix or reference_pdb is None:
+        run_clashscore(pdb_path, out_txt)
+    elif not os.path.exists(out_txt):
+        try:
+            score, searched = clash_engine.global_clashscore(pdb_path, reference_pdb)
+            clash_engine.write_clashscore(out_txt, score, f"{pdb_name}: {searched} atoms searched again")
+        except (OSError, ValueError) as e:
+            print(f" Clash engine error {name_id}: {e}")
     return out_txt if os.path.exists(out_txt) else None
 
 # -------------------------
 # Main
 # -------------------------
 if __name__ == "__main__":
+    # --engine-local: score the bp/neighbour selections with clash_engine.py on the
+    # Reduce-protonated model instead of PyMOL + phenix.clashscore (pipeline.py --clash-engine)
+    # --engine-global: score the full models with clash_engine.py against the contact
+    # baseline of the deposited model, both Reduce-protonated, instead of phenix.clashscore
+    use_phenix = "--engine-local" not in sys.argv
+    use_phenix_global = "--engine-global" not in sys.argv
+    sys.argv = [a for a in sys.argv if a not in ("--phenix-local", "--engine-local", "--phenix-global", "--engine-global")]
     if len(sys.argv) != 8:
-        print("Usage: python3 script.py pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2", file=sys.stderr)
+        print("Usage: python3 script.py pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 "
+              "[--engine-local] [--engine-global]", file=sys.stderr)
         sys.exit(1)
 
     pdbid = sys.argv[1]
@@ -179,39 +252,36 @@ if __name__ == "__main__":
     tup_dir = locate_tuple_dir(pdbid, chain_purine, nt_purine)
     if not tup_dir:
         print(f" Missing tuple dir for {pdbid}_{chain_purine}_{nt_purine}", file=sys.stderr)
-        # Write None values and exit
-        os.makedirs("classification_files", exist_ok=True)
-        if not os.path.exists(OUT_SUMMARY):
-            with open(OUT_SUMMARY, "w") as f:
-                f.write("pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 "
-                        "WC_clashscore_global HG_clashscore_global "
-                        "WC_clashscore_bp HG_clashscore_bp "
-                        "WC_clashscore_neighbour HG_clashscore_neighbour\n")
-        with open(OUT_SUMMARY, "a") as f:
-            f.write(f"{pdbid} {chain1} {nt_type1} {nt1} {chain2} {nt_type2} {nt2} "
-                    f"None None None None None None\n")
+        # Record None values and exit
+        metrics_store.record_result("clashscore", [pdbid, chain1, nt_type1, nt1, chain2, nt_type2, nt2] + [None] * 6)
         sys.exit(1)
 
 
-    # Process HG
-    ensure_locals_for_state(
-        tup_dir, "HG",
-        HG_PDB_NAME.format(pdbid=pdbid),
-        name_id, chain_purine, nt_purine, chain_pyrimidine, nt_pyrimidine,
-    )
-    ensure_global_for_state(
-        tup_dir, "HG", HG_PDB_NAME.format(pdbid=pdbid), name_id
-    )
+    # Deposited model whose contacts the global clashscores are rescored against
+    # (shared by all pairs of a structure when batch_run.py links it in)
+    reference_pdb = locate_reference_pdb(pdbid, tup_dir)
 
-    # Process WC
-    ensure_locals_for_state(
-        tup_dir, "WC",
-        WC_PDB_NAME.format(pdbid=pdbid),
-        name_id, chain_purine, nt_purine, chain_pyrimidine, nt_pyrimidine,
-    )
-    ensure_global_for_state(
-        tup_dir, "WC", WC_PDB_NAME.format(pdbid=pdbid), name_id
-    )
+    # An archived tuple (tuple_archive.py) is finished: its scores are only read back
+    if os.path.isdir(tup_dir):
+        # Process HG
+        ensure_locals_for_state(
+            tup_dir, "HG",
+            HG_PDB_NAME.format(pdbid=pdbid),
+            name_id, chain_purine, nt_purine, chain_pyrimidine, nt_pyrimidine, use_phenix,
+        )
+        ensure_global_for_state(
+            tup_dir, "HG", HG_PDB_NAME.format(pdbid=pdbid), name_id, reference_pdb, use_phenix_global
+        )
+
+        # Process WC
+        ensure_locals_for_state(
+            tup_dir, "WC",
+            WC_PDB_NAME.format(pdbid=pdbid),
+            name_id, chain_purine, nt_purine, chain_pyrimidine, nt_pyrimidine, use_phenix,
+        )
+        ensure_global_for_state(
+            tup_dir, "WC", WC_PDB_NAME.format(pdbid=pdbid), name_id, reference_pdb, use_phenix_global
+        )
 
     # Collect scores
     hg_global_txt = os.path.join(tup_dir, "HG", f"{name_id}{GLOBAL_TXT_SUFFIX}")
@@ -221,23 +291,13 @@ if __name__ == "__main__":
     hg_neigh_txt = os.path.join(tup_dir, "HG", f"{name_id}{NEIGH_TXT_SUFFIX}")
     wc_neigh_txt = os.path.join(tup_dir, "WC", f"{name_id}{NEIGH_TXT_SUFFIX}")
 
-    wc_global = extract_clashscore(wc_global_txt) if os.path.exists(wc_global_txt) else None
-    hg_global = extract_clashscore(hg_global_txt) if os.path.exists(hg_global_txt) else None
-    wc_bp = extract_clashscore(wc_bp_txt) if os.path.exists(wc_bp_txt) else None
-    hg_bp = extract_clashscore(hg_bp_txt) if os.path.exists(hg_bp_txt) else None
-    wc_neigh = extract_clashscore(wc_neigh_txt) if os.path.exists(wc_neigh_txt) else None
-    hg_neigh = extract_clashscore(hg_neigh_txt) if os.path.exists(hg_neigh_txt) else None
-
-    # Create output directory and write header if needed
-    os.makedirs("classification_files", exist_ok=True)
-    if not os.path.exists(OUT_SUMMARY):
-        with open(OUT_SUMMARY, "w") as f:
-            f.write("pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 "
-                    "WC_clashscore_global HG_clashscore_global "
-                    "WC_clashscore_bp HG_clashscore_bp "
-                    "WC_clashscore_neighbour HG_clashscore_neighbour\n")
-
-    # Write to summary file
-    with open(OUT_SUMMARY, "a") as f:
-        f.write(f"{pdbid} {chain1} {nt_type1} {nt1} {chain2} {nt_type2} {nt2} "
-                f"{wc_global} {hg_global} {wc_bp} {hg_bp} {wc_neigh} {hg_neigh}\n")
\ No newline at end of file
+    wc_global = extract_clashscore(wc_global_txt) if tuple_archive.exists(wc_global_txt) else None
+    hg_global = extract_clashscore(hg_global_txt) if tuple_archive.exists(hg_global_txt) else None
+    wc_bp = extract_clashscore(wc_bp_txt) if tuple_archive.exists(wc_bp_txt) else None
+    hg_bp = extract_clashscore(hg_bp_txt) if tuple_archive.exists(hg_bp_txt) else None
+    wc_neigh = extract_clashscore(wc_neigh_txt) if tuple_archive.exists(wc_neigh_txt) else None
+    hg_neigh = extract_clashscore(hg_neigh_txt) if tuple_archive.exists(hg_neigh_txt) else None
+
+    # Record the row (and its line in the summary file)
+    metrics_store.record_result("clashscore", [pdbid, chain1, nt_type1, nt1, chain2, nt_type2, nt2,
+                                               wc_global, hg_global, wc_bp, hg_bp, wc_neigh, hg_neigh])
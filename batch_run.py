@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Parallel replacement for the serial loop in batch_run.sh.
+
+Every CSV row runs in its own task directory under WORK_ROOT, which holds
+private copies of the files that the pipeline writes relative to its cwd
+(<pdb>_final.pdb/mtz, delete.txt, out.txt, classification_files/*,
+PDB_without_nt/*, reports/*, journal/*).  Finished tasks are
+merged back into the run directory in CSV order, so the outputs are the same
+as those of a serial run.
+
+Rows are grouped by (pdb_code, assembly): the PDB and MTZ of a structure are
+staged once under WORK_ROOT/staging, together with the omit models of all its
+purines (written in one pass; with --flip-engine the flipped models too),
+linked into each of its task directories, and removed after the structure's
+last pair has finished.
+
+Each pair runs through pipeline.py, which journals its stages.  Rows whose
+journal in the run directory is complete are skipped, and the task directory
+of a row that was interrupted is reused, so rerunning after a crash resumes
+where it stopped.  Use --fresh to ignore the journals.
+
+Usage:
+    python3 batch_run.py [csv_file] [-j WORKERS] [--pdb-path DIR] [--keep-work] [--fresh] [--preflight]
+                        [--flip-engine] [--clash-engine] [--rscc-engine]
+"""
+import os
+import sys
+import csv
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import journal
+import pipeline
+import instrument
+import mtz_cache
+import flip_engine
+import omit_models
+import preflight
+import metrics_store
+import tuple_archive
+
+# -------------------------
+# Config
+# -------------------------
+PDB_PATH = "/mnt/hdd_04/ec3867/NAFinder/NAFinder_20260108/X-ray/pdb_dssr/"
+MTZ_URL = "https://pdb-redo.eu/db"
+CSV_FILE = "PairTable_X_ray.csv"
+WORK_ROOT = "work"
+STAGING_DIR = "staging"
+OMIT_DIR = "omit"              # per-structure omit models, under each staging directory
+FLIP_DIR = "flip"              # per-structure flipped (HG) models, under each staging directory
+
+# CSV columns (same order as the `read` in batch_run.sh)
+PAIR_COLUMNS = [
+    'pdb_code', 'assembly', 'reso', 'chi_1', 'chi_2',
+    'chain_1', 'nt_type_1', 'nt_number_1', 'chain_2', 'nt_type_2', 'nt_number_2', 'xxxx',
+]
+
+# Text outputs appended to by the pipeline; merged line by line (header kept once)
+MERGED_TABLES = [
+    "classification_files/R_values_summary.txt",
+    "classification_files/RSCC_summary.txt",
+    "classification_files/EDIA_summary.txt",
+    "classification_files/clashscore_summary.txt",
+    "classification_files/Bfactor_summary.txt",
+    "classification_files/combined_metrics.txt",
+    "classification_files/classification_results.txt",
+]
+MERGED_LOGS = ["out.txt", "out_error.txt", "delete.txt", instrument.TIMINGS_LOG]
+MERGED_DIRS = ["PDB_without_nt", "reports", journal.JOURNAL_DIR]
+
+# -------------------------
+# Helpers
+# -------------------------
+def read_pair_table(csv_file):
+    """Yield one dict per CSV row, skipping blank lines and the header row."""
+    with open(csv_file, newline="") as f:
+        for fields in csv.reader(f):
+            if not fields or not fields[0].strip():
+                continue
+            if fields[0] == "pdb_code":
+                continue
+            # like `read`, the last variable swallows any extra fields
+            head = fields[:len(PAIR_COLUMNS) - 1]
+            tail = ",".join(fields[len(PAIR_COLUMNS) - 1:])
+            head += [""] * (len(PAIR_COLUMNS) - 1 - len(head))
+            yield dict(zip(PAIR_COLUMNS, head + [tail]))
+
+def pair_label(row):
+    return (f"{row['pdb_code']}_{row['chain_1']}_{row['nt_number_1']}_"
+            f"{row['chain_2']}_{row['nt_number_2']}")
+
+def make_task_dir(task_dir, resume=False):
+    """
+    Create an isolated working directory for one pair.
+    With resume, a directory left by an interrupted run is kept as it is.
+    """
+    if os.path.isdir(task_dir) and not (resume and os.path.isdir(os.path.join(task_dir, journal.JOURNAL_DIR))):
+        shutil.rmtree(task_dir)
+    os.makedirs(os.path.join(task_dir, "classification_files"), exist_ok=True)
+    os.makedirs(os.path.join(task_dir, "PDB_without_nt"), exist_ok=True)
+
+def plan_structures(rows, skip=()):
+    """
+    Group row indices (except those in skip) by (pdb_code, assembly), in order of first appearance.
+    Return {(pdb_code, assembly): [row_index, ...]}.
+    """
+    groups = {}
+    for i, row in enumerate(rows):
+        if i not in skip:
+            groups.setdefault((row['pdb_code'], row['assembly']), []).append(i)
+    return groups
+
+def omit_model_path(stage_dir, chain, nt):
+    return os.path.join(stage_dir, OMIT_DIR, f"{chain}_{nt}.pdb")
+
+def flip_model_path(stage_dir, chain, nt):
+    return os.path.join(stage_dir, FLIP_DIR, f"{chain}_{nt}.pdb")
+
+def plan_omit_models(rows, groups, run_dir):
+    """{(pdb_code, assembly): {(chain, nt) of each purine of its rows}}."""
+    purines = {}
+    for key, indices in groups.items():
+        pairs = [pipeline.Pair(rows[i], run_dir) for i in indices]
+        purines[key] = {(p.chain_purine, p.nt_purine) for p in pairs if p.chain_purine is not None}
+    return purines
+
+def stage_structure(pdb_code, assembly, stage_dir, pdb_path, log, cache_opts, purines=(), flip=False):
+    """
+    Copy the PDB of one structure into stage_dir, write the omit models of
+    its purines (chain, nt) in one pass (see omit_models.py), and with flip
+    their flipped models too (see flip_engine.py), and fetch its PDB-REDO MTZ
+    through the local MTZ cache (see mtz_cache.py).
+    """
+    os.makedirs(stage_dir, exist_ok=True)
+    src = os.path.join(pdb_path, f"{pdb_code}.pdb{assembly}")
+    pdb_file = os.path.join(stage_dir, f"{pdb_code}_final.pdb")
+    shutil.copyfile(src, pdb_file)
+    if purines:
+        try:
+            omit_models.write_omit_models(pdb_file, {p: [omit_model_path(stage_dir, *p)] for p in purines})
+        except (OSError, ValueError) as e:
+            # Not fatal: pipeline.py writes the omit model of its pair itself
+            log.write(f" Error writing omit models of {pdb_code}: {e}\n")
+    if purines and flip:
+        # Not fatal either: pipeline.py flips the purine of its pair itself
+        errors = {}
+        try:
+            flip_engine.write_flipped_models(pdb_file, {p: [flip_model_path(stage_dir, *p)] for p in purines}, errors)
+        except OSError as e:
+            log.write(f" Error writing flipped models of {pdb_code}: {e}\n")
+        for message in errors.values():
+            log.write(f" {message}\n")
+    dest = os.path.join(stage_dir, f"{pdb_code}_final.mtz")
+    if not mtz_cache.fetch_mtz(pdb_code, dest, base_url=MTZ_URL, **cache_opts):
+        log.write(f"Failed to download {mtz_cache.mtz_url(pdb_code, MTZ_URL)}\n")
+
+class StructureStager:
+    """
+    Stage each structure's inputs once, on first use, and free them after
+    the last of its pairs has called release().
+    """
+    def __init__(self, groups, staging_root, pdb_path, cache_opts=None, purines=None, flip=False):
+        self.staging_root = staging_root
+        self.pdb_path = pdb_path
+        self.cache_opts = cache_opts or {}
+        self.purines = purines or {}
+        self.flip = flip
+        self.remaining = {key: len(indices) for key, indices in groups.items()}
+        self.key_locks = {key: threading.Lock() for key in groups}
+        self.staged = {}
+        self.lock = threading.Lock()
+
+    def stage_dir(self, key):
+        return os.path.join(self.staging_root, f"{key[0]}_{key[1]}")
+
+    def acquire(self, key, log):
+        """Return the staging directory for key, staging it if this is the first pair."""
+        with self.key_locks[key]:
+            if key not in self.staged:
+                try:
+                    stage_structure(key[0], key[1], self.stage_dir(key), self.pdb_path, log, self.cache_opts,
+                                    self.purines.get(key, ()), self.flip)
+                    self.staged[key] = None
+                except OSError as e:
+                    self.staged[key] = e
+            err = self.staged[key]
+        if err is not None:
+            raise OSError(f"staging {key[0]}.pdb{key[1]} failed: {err}")
+        return self.stage_dir(key)
+
+    def release(self, key):
+        with self.lock:
+            self.remaining[key] -= 1
+            last = self.remaining[key] == 0
+        if last:
+            shutil.rmtree(self.stage_dir(key), ignore_errors=True)
+
+def link_inputs(stage_dir, task_dir, row):
+    """
+    Link the staged <pdb>_final.pdb/mtz into task_dir (the scripts only read
+    them) and hard-link the pair's staged omit and flipped models into its
+    tuple directory (a copy where hard links are not possible), unless they
+    are already there.
+    """
+    pdb_code = row['pdb_code']
+    for name in (f"{pdb_code}_final.pdb", f"{pdb_code}_final.mtz"):
+        src = os.path.join(stage_dir, name)
+        dst = os.path.join(task_dir, name)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if os.path.exists(src):
+            os.symlink(src, dst)
+
+    pair = pipeline.Pair(row, task_dir)
+    if pair.chain_purine is None:
+        return
+    for src, dst in [(omit_model_path(stage_dir, pair.chain_purine, pair.nt_purine), pair.abspath("omit.pdb")),
+                     (flip_model_path(stage_dir, pair.chain_purine, pair.nt_purine),
+                      pair.abspath("HG", f"{pdb_code}_final_flipped.pdb"))]:
+        if os.path.exists(src) and not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copyfile(src, dst)
+
+def run_pair(row, task_dir, stager, defer_reports=False, resume=True, nproc=1, crop_padding=pipeline.CROP_PADDING,
+             engines=()):
+    """
+    Run the full per-pair pipeline (pipeline.py) inside task_dir with nproc
+    cores, using the structure inputs staged by stager.  With defer_reports
+    the pair is classified but its PDF is left to render_reports.py.
+    The maps are cropped with crop_padding when the pair is packed (see pipeline.stage_archive),
+    and the in-process engines (see pipeline.ENGINES) are used in place of the tools they replace.
+    Return True if the refinement stages succeeded.
+    """
+    make_task_dir(task_dir, resume)
+    key = (row['pdb_code'], row['assembly'])
+    try:
+        return run_pair_staged(row, task_dir, stager, key, defer_reports, nproc, crop_padding, engines)
+    finally:
+        stager.release(key)
+
+def run_pair_staged(row, task_dir, stager, key, defer_reports=False, nproc=1, crop_padding=pipeline.CROP_PADDING,
+                    engines=()):
+    with open(os.path.join(task_dir, "run.log"), "a") as log:
+        try:
+            # the structure is staged by its first pair, whose "staging" record carries the cost
+            with instrument.stage(pipeline.Pair(row).label, "staging", task_dir):
+                stage_dir = stager.acquire(key, log)
+            link_inputs(stage_dir, task_dir, row)
+        except OSError as e:
+            log.write(f" Error staging inputs: {e}\n")
+            return False
+        return pipeline.run_pair(row, task_dir, log, no_pdf=defer_reports, nproc=nproc,
+                                 crop_padding=crop_padding, engines=engines)
+
+def pair_complete(row, run_dir):
+    """True if the journal in run_dir shows the pair as fully processed."""
+    pair = pipeline.Pair(row, run_dir)
+    jr = journal.Journal(pair.label, pair.key, root=run_dir)
+    try:
+        return jr.complete()
+    finally:
+        jr.close()
+
+def append_table(src, dst):
+    """Append the data lines of src to dst, writing src's header if dst is new."""
+    with open(src) as f:
+        lines = f.readlines()
+    if not lines:
+        return
+    if os.path.exists(dst):
+        lines = lines[1:]
+    with open(dst, "a") as f:
+        f.writelines(lines)
+
+def append_log(src, dst):
+    with open(src) as f, open(dst, "a") as out:
+        shutil.copyfileobj(f, out)
+
+def merge_tree(src, dst):
+    """
+    Move every entry of src into dst, merging into directories that already
+    exist and into tuple archives that already exist (pairs sharing a purine).
+    """
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(src):
+        s, d = os.path.join(src, name), os.path.join(dst, name)
+        if os.path.isdir(s) and os.path.isdir(d):
+            shutil.copytree(s, d, dirs_exist_ok=True)
+            shutil.rmtree(s)
+        elif name.endswith(tuple_archive.ARCHIVE_SUFFIX) and os.path.isfile(s) and os.path.isfile(d):
+            tuple_archive.merge(s, d)
+        else:
+            if os.path.isdir(d):
+                shutil.rmtree(d)
+            shutil.move(s, d)
+
+def merge_task(task_dir, run_dir):
+    """Merge the outputs of one finished task into run_dir."""
+    for rel in MERGED_DIRS:
+        src = os.path.join(task_dir, rel)
+        if os.path.isdir(src):
+            merge_tree(src, os.path.join(run_dir, rel))
+    os.makedirs(os.path.join(run_dir, "classification_files"), exist_ok=True)
+    for rel in MERGED_TABLES:
+        src = os.path.join(task_dir, rel)
+        if os.path.exists(src):
+            append_table(src, os.path.join(run_dir, rel))
+    src_store = os.path.join(task_dir, metrics_store.STORE_PATH)
+    if os.path.exists(src_store):
+        metrics_store.merge_combined(src_store, os.path.join(run_dir, metrics_store.STORE_PATH))
+        metrics_store.merge_results(src_store, os.path.join(run_dir, metrics_store.STORE_PATH))
+    for rel in MERGED_LOGS + ["run.log"]:
+        src = os.path.join(task_dir, rel)
+        if os.path.exists(src):
+            append_log(src, os.path.join(run_dir, "batch_run.log" if rel == "run.log" else rel))
+
+def run_batch(csv_file, workers, pdb_path=PDB_PATH, work_root=WORK_ROOT, keep_work=False, cache_opts=None,
+              defer_reports=False, fresh=False, screen=False, crop_padding=pipeline.CROP_PADDING,
+              engines=()):
+    """
+    Run every row of csv_file on a pool of `workers` concurrent tasks.
+    Outputs are merged into the cwd in CSV order as soon as all earlier rows are done.
+    Unless fresh, rows already complete according to their journal are skipped.
+    With screen, rows rejected by the pre-flight checks (preflight.py) are
+    skipped too and listed in preflight.REJECTED_FILE.
+    """
+    run_dir = os.getcwd()
+    rows = list(read_pair_table(csv_file))
+    work_root = os.path.abspath(work_root)
+    os.makedirs(work_root, exist_ok=True)
+
+    done = set() if fresh else {i for i, row in enumerate(rows) if pair_complete(row, run_dir)}
+    if done:
+        print(f"Skipping {len(done)} pairs already complete in {journal.JOURNAL_DIR}/")
+    if screen:
+        todo = [i for i in range(len(rows)) if i not in done]
+        found = preflight.screen([rows[i] for i in todo], pdb_path, workers)
+        rejected = {todo[j]: result for j, result in found.items()}
+        preflight.write_rejected(preflight.REJECTED_FILE, rows, rejected)
+        print(f"Pre-flight rejected {len(rejected)} pairs; see {preflight.REJECTED_FILE}")
+        done |= set(rejected)
+    groups = plan_structures(rows, done)
+    stager = StructureStager(groups, os.path.join(work_root, STAGING_DIR), pdb_path, cache_opts,
+                             plan_omit_models(rows, groups, run_dir), "flip" in engines)
+    print(f"Planned {len(rows) - len(done)} pairs over {len(groups)} structures")
+    # cores left to each pair's refinements when `workers` pairs run at once
+    nproc = max(1, (os.cpu_count() or 1) // workers)
+
+    pending = {}
+    next_index = 0
+    n_ok = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        # Submit structure by structure so that few staged copies are alive at once
+        for indices in groups.values():
+            for i in indices:
+                task_dir = os.path.join(work_root, f"{i:06d}_{pair_label(rows[i])}")
+                futures[pool.submit(run_pair, rows[i], task_dir, stager, defer_reports, not fresh, nproc,
+                                     crop_padding, engines)] = (i, task_dir)
+
+        for fut in as_completed(futures):
+            i, task_dir = futures[fut]
+            try:
+                ok = fut.result()
+            except Exception as e:
+                print(f" Error in {pair_label(rows[i])}: {e}", file=sys.stderr)
+                ok = False
+            print(f"{'OK' if ok else 'ERROR'}: {pair_label(rows[i])}")
+            pending[i] = (ok, task_dir)
+
+            # Merge in CSV order so that appended tables match a serial run
+            while next_index in pending or next_index in done:
+                if next_index in pending:
+                    ok, task_dir = pending.pop(next_index)
+                    n_ok += ok
+                    if os.path.isdir(task_dir):
+                        merge_task(task_dir, run_dir)
+                        if not keep_work:
+                            shutil.rmtree(task_dir, ignore_errors=True)
+                next_index += 1
+
+    n_run = len(rows) - len(done)
+    print(f"Finished {n_run} pairs: {n_ok} OK, {n_run - n_ok} with errors")
+    return n_ok
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Hoogsteen pipeline on many base pairs in parallel.")
+    parser.add_argument("csv_file", nargs="?", default=CSV_FILE)
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of pairs processed concurrently (default: all cores)")
+    parser.add_argument("--pdb-path", default=PDB_PATH, help="directory with <pdb>.pdb<assembly> files")
+    parser.add_argument("--work-dir", default=WORK_ROOT, help="root for per-task working directories")
+    parser.add_argument("--keep-work", action="store_true", help="keep task directories after merging")
+    parser.add_argument("--mtz-cache", default=mtz_cache.CACHE_DIR, help="persistent MTZ cache directory")
+    parser.add_argument("--cache-bytes", type=int, default=mtz_cache.MAX_BYTES, help="MTZ cache size budget")
+    parser.add_argument("--offline", action="store_true", help="only use MTZ files already in the cache")
+    parser.add_argument("--defer-reports", action="store_true",
+                        help="classify only; render the PDFs afterwards with render_reports.py")
+    parser.add_argument("--fresh", action="store_true",
+                        help="ignore the stage journals and rerun every pair from scratch")
+    parser.add_argument("--preflight", action="store_true",
+                        help="skip pairs that fail the pre-flight checks of preflight.py")
+    parser.add_argument("--crop-padding", type=float, default=pipeline.CROP_PADDING,
+                        help=f"crop the packed maps to each base pair and its neighbours plus this margin (A); "
+                             f"0 keeps the whole maps (default: {pipeline.CROP_PADDING})")
+    for name, text in pipeline.ENGINES.items():
+        parser.add_argument(f"--{name}-engine", action="store_true", help=f"{text} (not yet calibrated)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.csv_file):
+        print(f" Error: CSV file not found: {args.csv_file}", file=sys.stderr)
+        sys.exit(1)
+
+    cache_opts = {'cache_dir': args.mtz_cache, 'max_bytes': args.cache_bytes, 'offline': args.offline}
+    run_batch(args.csv_file, max(1, args.workers), args.pdb_path, args.work_dir, args.keep_work, cache_opts,
+              args.defer_reports, args.fresh, args.preflight, args.crop_padding,
+              [name for name in pipeline.ENGINES if getattr(args, f"{name}_engine")])
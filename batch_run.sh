@@ -20,7 +20,8 @@ download_mtz() {
   local url="${MTZ_URL}/${pdbid}/${pdbid}_final.mtz"
   local out="${pdbid}_final.mtz"
   #echo "Downloading MTZ: ${url} -> ${out}"
-  wget -q -c -O "${out}" "${url}" || echo "Failed to download ${url}"
+  # served from the local MTZ cache (mtz_cache.py), downloaded on a miss
+  python3 mtz_cache.py "${pdbid}" "${out}" --url "${MTZ_URL}" || echo "Failed to download ${url}"
 }
 
 # CSV columns:
@@ -36,43 +37,10 @@ while IFS=, read -r pdb_code assembly reso chi_1 chi_2 chain_1 nt_type_1 nt_numb
   mv "${pdb_code}.pdb${assembly}" "${pdb_code}_final.pdb" 
   download_mtz "${pdb_code}"
 
-  pair="${nt_type_1}${nt_type_2}"
-  script=""
-  case "${pair}" in
-    AT|TA|TG|GT|AC|CA|AU|UA|GU|UG)
-      script="./read_PDB_MTZ_NT_AT_GT_AC.sh"
-      ;;
-    GC|CG)
-      script="./read_PDB_MTZ_NT_GC.sh"
-      ;;
-    *)
-      echo "Other bp: ${pair} — no script mapped"
-      ;;
-  esac
-
-  if [[ -n "${script}" ]]; then
-    cmd="${script} ${pdb_code} ${pdb_code} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2} ${xxxx}"
-    echo "Running: ${cmd}"
-    if ${cmd}; then
-      echo "OK: ${cmd}" >> out.txt
-    else
-      echo "ERROR: ${cmd}" >> out_error.txt
-    fi
-  fi
-  echo "Rval"
-  ./get_rval.sh ${pdb_code} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2}
-  echo "RSCC"
-  ./get_rscc.sh ${pdb_code} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2}
-  echo "EDIA"
-  ./get_EDIA.sh ${pdb_code} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2}
-  echo "Clashscore"
-  python3 Clashes.py ${pdb_code} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2}
-  echo "B-facor"
-  python3 Bfactor.py ${pdb_code} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2}
-  echo "Combine metrics"
-  python3 combine_metrics.py ${pdb_code} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2}
-  echo "Make report"
-  python3 make_report.py ${pdb_code} ${reso} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2} ${chi_1} ${chi_2} 
+  # Refinement and metric stages are journaled under journal/ (see pipeline.py):
+  # when the run is restarted, stages that already finished are skipped
+  echo "Running pipeline: ${pdb_code} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2}"
+  python3 pipeline.py ${pdb_code} ${assembly} ${reso} ${chi_1} ${chi_2} ${chain_1} ${nt_type_1} ${nt_number_1} ${chain_2} ${nt_type_2} ${nt_number_2} ${xxxx} --pdb-path "${PDB_PATH}" || true
   rm "${pdb_code}_final.pdb"
   rm "${pdb_code}_final.mtz"
 
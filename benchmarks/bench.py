@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks of the pipeline, with the external tools replaced by the
+stand-ins of stubs/ (see stubs/stublib.py for their delays and failure
+injection) and inputs made by synth.py.
+
+  scripts   The metric and report scripts against results tables of 100 to
+            100k rows: Bfactor.py, Clashes.py, combine_metrics.py and
+            make_report.py --no-pdf once per sampled pair (--calls), and the
+            whole-table passes (combine_metrics.py rebuild and --export,
+            make_report.py --classify-all) once per size.
+  batch     batch_run.py on synthetic structures: wall time per pair, and the
+            stage time not spent in the stand-in tools (orchestration and the
+            in-process metrics), read back from the run's timings.jsonl.
+  compare   Compare two result files and exit 1 if a benchmark got slower
+            than --threshold.
+  env       Print the exports that put the stand-ins on PATH, to run the
+            pipeline by hand.
+
+Each command appends one JSON line per benchmark to --out.  Calls are timed
+with instrument.run(), so wall and CPU time and peak RSS are measured as in a
+pipeline run.
+
+Usage:
+    python3 bench.py scripts [--rows 100,1000,10000,100000] [--calls 5] [--bp 48] [--out bench.jsonl]
+    python3 bench.py batch [--structures 2] [--pairs 2] [--bp 48] [-j 2] [--delay TOOL=BASE[,PER_1000_ATOMS]] [--engine NAME] [--out bench.jsonl]
+    python3 bench.py compare <old.jsonl> <new.jsonl> [--threshold 0.2]
+    python3 bench.py env
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [REPO_DIR, BENCH_DIR, os.path.join(BENCH_DIR, "stubs")]
+
+import synth  # noqa: E402
+import stublib  # noqa: E402
+import instrument  # noqa: E402
+import mtz_cache  # noqa: E402
+import flip_engine  # noqa: E402
+import metrics_store  # noqa: E402
+import pipeline  # noqa: E402
+
+# -------------------------
+# Config
+# -------------------------
+STUB_BIN = os.path.join(BENCH_DIR, "stubs", "bin")
+STUB_PYTHON = os.path.join(BENCH_DIR, "stubs", "python")
+STUB_TOOLS = ["phenix.refine", "phenix.ready_set", "phenix.mtz2map", "phenix.real_space_correlation",
+              "phenix.clashscore", "phenix.reduce", "ediascorer", "pymol"]
+
+WORK_DIR = "bench_work"
+RESULTS_FILE = "bench.jsonl"
+ROWS = [100, 1000, 10000, 100000]
+CALLS = 5
+BASE_PAIRS = 48    # per synthetic model: about 2k atoms, a typical DNA crystal structure
+THRESHOLD = 0.2     # compare: slower by more than this fraction is a regression
+
+WC_MODEL = "{pdb}_final_refine_001.pdb"
+HG_MODEL = "{pdb}_final_flipped_refine_001_refine_001.pdb"
+
+# -------------------------
+# Helpers
+# -------------------------
+def stub_env(delays=()):
+    """Environment with the stand-ins first on PATH and PYTHONPATH; delays are TOOL=BASE[,PER_1000_ATOMS]."""
+    env = dict(os.environ)
+    env['PATH'] = STUB_BIN + os.pathsep + env.get('PATH', "")
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (STUB_PYTHON, env.get('PYTHONPATH')) if p)
+    env['EDIA_BIN'] = os.path.join(STUB_BIN, "ediascorer")
+    env['MPLBACKEND'] = "Agg"
+    for spec in delays:
+        tool, _, value = spec.partition("=")
+        key = "HG_STUB_DELAY" if tool in ("", "all") else f"HG_STUB_DELAY_{stublib.env_name(tool)}"
+        env[key] = value
+    return env
+
+def fresh_dir(path):
+    """Empty directory at path (a previous benchmark directory there is removed)."""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    return path
+
+def percentile(values, q):
+    values = [v for v in values if v is not None]
+    return round(float(np.percentile(values, q)), 4) if values else None
+
+def summary(records):
+    """Wall/CPU percentiles, peak RSS and failures of call records."""
+    return {
+        'n': len(records),
+        'failed': sum(1 for r in records if r.get('exit') not in (0, None)),
+        'wall_p50': percentile([r['wall'] for r in records], 50),
+        'wall_p95': percentile([r['wall'] for r in records], 95),
+        'cpu_p50': percentile([r.get('cpu') for r in records], 50),
+        'rss_p95_mb': None if not records else
+        round((percentile([r.get('max_rss_kb') for r in records], 95) or 0) / 1024, 1),
+    }
+
+def append_results(path, results):
+    with open(path, "a") as f:
+        for result in results:
+            f.write(json.dumps({**result, 'time': time.strftime('%F %T')}) + "\n")
+
+def print_results(results, keys):
+    for r in results:
+        label = " ".join(f"{k}={r[k]}" for k in keys if k in r)
+        print(f"{label:<50} n={r['n']:<4} wall p50 {r['wall_p50']:.3f}s p95 {r['wall_p95']:.3f}s"
+              + (f"  ({r['failed']} failed)" if r['failed'] else ""))
+
+# -------------------------
+# Scripts
+# -------------------------
+def populate_results(root, rows, seed=0):
+    """Fill the results tables and their text files under root with random metrics for rows."""
+    rng = np.random.default_rng(seed)
+    n = len(rows)
+    keys = [[r[0], r[5], r[6], int(r[7]), r[8], r[9], int(r[10])] for r in rows]
+    r_work = rng.uniform(0.17, 0.25, (n, 2))
+    r_free = r_work + rng.uniform(0.02, 0.05, (n, 2))
+    values = {
+        'rvalues': np.column_stack([r_work[:, 0] + 0.002, r_work[:, 0], r_free[:, 0],
+                                    r_work[:, 1] + 0.002, r_work[:, 1], r_free[:, 1]]).round(4),
+        'rscc': rng.uniform(0.75, 0.95, (n, 2)).round(4),
+        'edia': rng.uniform(0.6, 1.0, (n, 2)).round(2),
+        'clashscore': rng.uniform(0.0, 12.0, (n, 6)).round(2),
+        'bfactor': rng.uniform(20.0, 60.0, (n, 2)).round(1),
+    }
+    conn = metrics_store.connect(os.path.join(root, metrics_store.STORE_PATH))
+    try:
+        for source, table in values.items():
+            metrics_store.replace_results(conn, source, [key + v for key, v in zip(keys, table.tolist())])
+            metrics_store.export_results(conn, source, os.path.join(root, metrics_store.RESULTS[source]['path']))
+    finally:
+        conn.close()
+
+def build_tuple(root, code, seed, n_bp, duplex_bp, position):
+    """
+    Tuple directory of one pair for the metric scripts: refined WC and HG
+    models (the HG one flipped with flip_engine) and the deposited model.
+    Return the pair-table row of the pair at position in the first duplex and the WC model.
+    """
+    tmp = os.path.join(root, "models", f"{code}.pdb")
+    pairs, _ = synth.write_pdb(tmp, n_bp, duplex_bp, seed=seed)
+    pair = pairs[position % len(pairs)]
+    row = synth.table_rows({code: [pair]})[0]
+    chain_1, nt_1, n_1, chain_2, nt_2, n_2 = pair
+    chain_purine, nt_purine = (chain_1, n_1) if nt_1 in "AG" else (chain_2, n_2)
+    tup = os.path.join(root, "PDB_without_nt", f"{code}_{chain_purine}_{nt_purine}")
+    os.makedirs(os.path.join(tup, "WC"), exist_ok=True)
+    os.makedirs(os.path.join(tup, "HG"), exist_ok=True)
+    wc = os.path.join(tup, "WC", WC_MODEL.format(pdb=code))
+    shutil.copyfile(tmp, wc)
+    shutil.copyfile(tmp, os.path.join(tup, "WC", f"{code}_final.pdb"))
+    flip_engine.write_flipped_models(wc, {(chain_purine, nt_purine): [os.path.join(tup, "HG", HG_MODEL.format(pdb=code))]})
+    os.remove(tmp)
+    return row, wc
+
+def time_call(root, label, cmd, env, atoms=None):
+    """Run cmd in root under instrument.stage(label) so the call lands in root's timings log."""
+    with instrument.stage(label, label, root, {'atoms': atoms} if atoms else None) as timing:
+        proc = instrument.run(cmd, cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env)
+        timing['exit'] = proc.returncode
+    if proc.returncode:
+        print(f" Warning: {label} exited {proc.returncode}: {proc.stderr.strip().splitlines()[-1:]}", file=sys.stderr)
+
+def bench_scripts(args):
+    results = []
+    env = stub_env(args.delay)
+    duplex_bp = synth.DUPLEX_BP
+    n_bp = max(1, -(-args.bp // duplex_bp)) * duplex_bp    # whole duplexes, so the first one is duplex_bp long
+    for n_rows in args.rows:
+        root = fresh_dir(os.path.join(args.work, f"scripts-{n_rows}"))
+        rows = synth.synthetic_table(n_rows, duplex_bp)
+        calls = min(args.calls, n_rows)
+        sampled = sorted(set(np.linspace(0, n_rows - 1, calls).astype(int).tolist()))
+        for i in sampled:
+            rows[i], wc_model = build_tuple(root, rows[i][0], i, n_bp, duplex_bp, i % duplex_bp)
+        atoms = instrument.atom_count(wc_model)
+        synth.write_table(os.path.join(root, "PairTable_X_ray.csv"), rows)
+        populate_results(root, rows)
+        print(f"Scripts: {n_rows} rows, {len(sampled)} calls on models of {atoms} atoms in {root}")
+
+        def script(name, *script_args):
+            return ["python3", os.path.join(REPO_DIR, name), *script_args]
+
+        time_call(root, "combine_metrics.py (rebuild)", script("combine_metrics.py"), env)
+        time_call(root, "make_report.py --classify-all", script("make_report.py", "--classify-all"), env)
+        for i in sampled:
+            r = rows[i]
+            ids = [r[0], r[5], r[6], r[7], r[8], r[9], r[10]]
+            time_call(root, "Bfactor.py", script("Bfactor.py", *ids), env, atoms)
+            time_call(root, "Clashes.py", script("Clashes.py", *ids), env, atoms)
+            time_call(root, "combine_metrics.py", script("combine_metrics.py", *ids), env)
+            time_call(root, "make_report.py --no-pdf",
+                      script("make_report.py", r[0], r[2], *ids[1:], r[3], r[4], "--no-pdf"), env)
+        time_call(root, "combine_metrics.py --export", script("combine_metrics.py", "--export"), env)
+
+        records = [r for r in instrument.read_records(os.path.join(root, instrument.TIMINGS_LOG))
+                   if r.get('kind') == "call"]
+        for name in dict.fromkeys(r['stage'] for r in records):
+            group = [r for r in records if r['stage'] == name]
+            results.append({'bench': "scripts", 'script': name, 'rows': n_rows,
+                            'atoms': atoms if name in ("Bfactor.py", "Clashes.py") else None, **summary(group)})
+    print_results(results, ['script', 'rows'])
+    return results
+
+# -------------------------
+# Batch
+# -------------------------
+def bench_batch(args):
+    root = fresh_dir(os.path.join(args.work, f"batch-{args.structures}x{args.pairs}-j{args.workers}"))
+    data = os.path.join(root, "data")
+    rows = synth.write_structures(data, args.structures, args.bp)
+    picked = []
+    for code in dict.fromkeys(r[0] for r in rows):
+        picked += [r for r in rows if r[0] == code][:args.pairs]
+    run_dir = os.path.join(root, "run")
+    os.makedirs(run_dir)
+    synth.write_table(os.path.join(run_dir, "PairTable_X_ray.csv"), picked)
+
+    cache = os.path.join(root, "mtz_cache")
+    for code in dict.fromkeys(r[0] for r in picked):
+        dest = os.path.join(root, f"{code}.mtz")
+        if not mtz_cache.fetch_mtz(code, dest, cache_dir=cache, base_url=f"file://{os.path.join(data, 'redo')}"):
+            print(f" Error: could not seed the MTZ cache with {code}", file=sys.stderr)
+            return []
+        os.remove(dest)
+
+    env = stub_env(args.delay)
+    env['HG_EDIA_SLOTS'] = os.path.join(root, "edia_slots")
+    cmd = ["python3", os.path.join(REPO_DIR, "batch_run.py"), "PairTable_X_ray.csv", "-j", str(args.workers),
+           "--pdb-path", os.path.join(data, "pdb"), "--offline", "--mtz-cache", cache]
+    cmd += [f"--{name}-engine" for name in args.engine]
+    atoms = instrument.atom_count(os.path.join(data, "pdb", f"{picked[0][0]}.pdb1"))
+    print(f"Batch: {len(picked)} pairs over {args.structures} structures of {atoms} atoms, -j {args.workers}, in {run_dir}")
+    start = time.monotonic()
+    with open(os.path.join(root, "batch_run.log"), "w") as log:
+        rc = subprocess.run(cmd, cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    wall = time.monotonic() - start
+    if rc:
+        print(f" Warning: batch_run.py exited {rc}, see {os.path.join(root, 'batch_run.log')}", file=sys.stderr)
+
+    records = instrument.read_records(os.path.join(run_dir, instrument.TIMINGS_LOG))
+    stages = [r for r in records if r.get('kind') == "stage"]
+    tools = [r for r in records if r.get('kind') == "call" and r.get('tool') in STUB_TOOLS]
+    stage_wall = sum(r['wall'] for r in stages)
+    tool_wall = sum(r['wall'] for r in tools)
+    print(instrument.format_table(instrument.summarise(records, by="stage")))
+    result = {
+        'bench': "batch", 'pairs': len(picked), 'structures': args.structures, 'atoms': atoms,
+        'workers': args.workers, 'delays': sorted(args.delay), 'exit': rc,
+        'n': 1, 'failed': sum(1 for r in stages if r.get('exit') not in (0, None)),
+        'wall_p50': round(wall, 3), 'wall_p95': round(wall, 3),
+        'wall_per_pair': round(wall / len(picked), 3),
+        'stage_seconds': round(stage_wall, 3), 'tool_seconds': round(tool_wall, 3),
+        'own_per_pair': round((stage_wall - tool_wall) / len(picked), 3),
+    }
+    if args.engine:
+        result['engines'] = sorted(args.engine)
+    print(f"Batch: {wall:.1f}s wall, {result['wall_per_pair']:.2f}s per pair; "
+          f"{stage_wall:.1f} stage-seconds of which {tool_wall:.1f} in the stand-in tools "
+          f"({result['own_per_pair']:.2f}s per pair in the pipeline's own code)")
+    return [result]
+
+# -------------------------
+# Compare
+# -------------------------
+RESULT_KEYS = ['bench', 'script', 'rows', 'atoms', 'pairs', 'structures', 'workers', 'delays', 'engines']
+
+def result_key(result):
+    return tuple((k, json.dumps(result.get(k))) for k in RESULT_KEYS if k in result)
+
+def load_results(path):
+    """{result key: last result with that key} of a results file."""
+    out = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            out[result_key(result)] = result
+    return out
+
+def compare(old_path, new_path, threshold=THRESHOLD, metric="wall_p50"):
+    """Print old and new metric of the benchmarks in both files; return the keys that regressed."""
+    old, new = load_results(old_path), load_results(new_path)
+    regressed = []
+    for key in new:
+        if key not in old or not old[key].get(metric) or new[key].get(metric) is None:
+            continue
+        a, b = old[key][metric], new[key][metric]
+        ratio = b / a
+        flag = "REGRESSION" if ratio > 1 + threshold else ("faster" if ratio < 1 - threshold else "")
+        label = " ".join(f"{k}={json.loads(v)}" for k, v in key if json.loads(v) is not None)
+        print(f"{label:<60} {a:9.3f}s -> {b:9.3f}s  x{ratio:5.2f} {flag}")
+        if flag == "REGRESSION":
+            regressed.append(key)
+    return regressed
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the pipeline with stand-in tools.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name in ("scripts", "batch"):
+        p = sub.add_parser(name)
+        p.add_argument("--bp", type=int, default=BASE_PAIRS,
+                       help="base pairs per model (about 45 atoms each with waters; default: %(default)s)")
+        p.add_argument("--delay", action="append", default=[], metavar="TOOL=BASE[,PER_1000_ATOMS]",
+                       help="stand-in delay in seconds, per tool or 'all' (repeatable)")
+        p.add_argument("--work", default=WORK_DIR, help="directory for the benchmark inputs (default: %(default)s)")
+        p.add_argument("--out", default=RESULTS_FILE, help="results file to append to (default: %(default)s)")
+    sub.choices['scripts'].add_argument("--rows", default=",".join(map(str, ROWS)),
+                                        type=lambda s: [int(x) for x in s.split(",")],
+                                        help="results-table sizes (default: %(default)s)")
+    sub.choices['scripts'].add_argument("--calls", type=int, default=CALLS,
+                                        help="per-pair script calls per size (default: %(default)s)")
+    sub.choices['batch'].add_argument("--structures", type=int, default=2)
+    sub.choices['batch'].add_argument("--pairs", type=int, default=2, help="pairs per structure (default: %(default)s)")
+    sub.choices['batch'].add_argument("-j", "--workers", type=int, default=2)
+    sub.choices['batch'].add_argument("--engine", action="append", default=[], choices=sorted(pipeline.ENGINES),
+                                      help="pass --<ENGINE>-engine to batch_run.py (repeatable)")
+    p = sub.add_parser("compare")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=THRESHOLD,
+                   help="relative slow-down reported as a regression (default: %(default)s)")
+    sub.add_parser("env")
+    args = parser.parse_args()
+
+    if args.cmd == "env":
+        env = stub_env()
+        for name in ("PATH", "PYTHONPATH", "EDIA_BIN", "MPLBACKEND"):
+            print(f"export {name}={env[name]}")
+        sys.exit(0)
+
+    if args.cmd == "compare":
+        for path in (args.old, args.new):
+            if not os.path.exists(path):
+                print(f" Error: results file not found: {path}", file=sys.stderr)
+                sys.exit(1)
+        regressed = compare(args.old, args.new, args.threshold)
+        if regressed:
+            print(f" {len(regressed)} benchmark(s) slower by more than {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    args.work = os.path.abspath(args.work)
+    results = bench_scripts(args) if args.cmd == "scripts" else bench_batch(args)
+    append_results(args.out, results)
+    print(f"Appended {len(results)} results to {args.out}")
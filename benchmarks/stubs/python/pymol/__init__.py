@@ -0,0 +1,134 @@
+"""
+PyMOL stand-in for the benchmarks: the parts of pymol.cmd the pipeline calls.
+
+Objects are kept as their PDB lines, so load, create, extract, delete, save
+and h_add do real (if simple) work; selections understand object and
+selection names, "chain X and resi N" clauses joined by "or", solvent and
+polymer, and object//chain/resi/name atom paths.  png writes a small valid image after
+HG_STUB_DELAY_PYMOL seconds (see stubs/stublib.py).  Every other command is
+accepted and does nothing.
+"""
+import os
+import re
+import sys
+import zlib
+import struct
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import stublib  # noqa: E402
+
+ATOM_RECORDS = ("ATOM  ", "HETATM")
+PNG_SIZE = 64
+
+def _png(path, size=PNG_SIZE):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    rows = b"".join(b"\0" + bytes([255, 255, 255]) * size for _ in range(size))
+    data = (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+    stublib.write_atomic(path, data, "wb")
+
+class _Cmd:
+    def __init__(self):
+        self.reinitialize()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: None
+
+    def reinitialize(self, *args, **kwargs):
+        self.objects = {}       # name -> [header lines, atom lines]
+        self.selections = {}    # name -> expression
+
+    # -- selections
+    def _atoms(self, selection):
+        """[(object, line)] of the atoms of a selection."""
+        selection = str(selection).strip()
+        if selection in self.selections:
+            return self._atoms(self.selections[selection])
+        if selection in self.objects:
+            return [(selection, line) for line in self.objects[selection][1]]
+        if selection in ("all", "(all)", "*"):
+            return [(name, line) for name in self.objects for line in self.objects[name][1]]
+        path = re.fullmatch(r"([^/]*)//([^/]*)/\\?(-?\w+)/([^/]+)", selection)
+        if path:
+            obj, chain, resi, atom = path.groups()
+            return [(o, line) for o, line in self._atoms(obj or "all")
+                    if line[21] == chain and line[22:27].strip() == resi and line[12:16].strip() == atom]
+        clauses = re.findall(r"chain\s+(\S+)\s+and\s+resi\s+\\?(-?\w+)", selection)
+        scope = selection.split(" and ", 1)[0].strip("( ")
+        atoms = self._atoms(scope) if scope in self.objects or scope in self.selections else self._atoms("all")
+        if clauses:
+            wanted = {(chain, resi) for chain, resi in clauses}
+            atoms = [(o, line) for o, line in atoms if (line[21], line[22:27].strip()) in wanted]
+        elif re.search(r"\bsolvent\b", selection):
+            atoms = [(o, line) for o, line in atoms if line[17:20] == "HOH"]
+        elif "polymer" in selection:
+            atoms = [(o, line) for o, line in atoms if line[17:20] != "HOH"]
+        return atoms
+
+    # -- objects
+    def load(self, path, name=None, *args, **kwargs):
+        name = name or os.path.splitext(os.path.basename(path))[0]
+        if not path.endswith((".pdb", ".pdb1", ".ent")):
+            self.objects[name] = [[], []]
+            return
+        with open(path) as f:
+            lines = f.readlines()
+        self.objects[name] = [[line for line in lines if line.startswith("CRYST1")],
+                              [line for line in lines if line.startswith(ATOM_RECORDS)]]
+
+    def get_names(self, *args, **kwargs):
+        return list(self.objects)
+
+    def select(self, name, selection="", *args, **kwargs):
+        self.selections[name] = selection
+        return len(self._atoms(selection))
+
+    def create(self, name, selection, *args, **kwargs):
+        atoms = self._atoms(selection)
+        header = self.objects[atoms[0][0]][0] if atoms else []
+        self.objects[name] = [header, [line for _, line in atoms]]
+
+    def extract(self, name, selection, *args, **kwargs):
+        atoms = self._atoms(selection)
+        self.create(name, selection)
+        taken = {id(line) for _, line in atoms}
+        for obj in {o for o, _ in atoms}:
+            if obj != name:
+                self.objects[obj][1] = [line for line in self.objects[obj][1] if id(line) not in taken]
+
+    def delete(self, name, *args, **kwargs):
+        self.objects.pop(name, None)
+        self.selections.pop(name, None)
+
+    def h_add(self, selection="all", *args, **kwargs):
+        """Add a hydrogen 1 A along x from each selected N/O atom."""
+        for obj, line in self._atoms(selection):
+            if line[76:78].strip() not in ("N", "O"):
+                continue
+            x = float(line[30:38]) + 1.0
+            name = f"H{line[12:16].strip()}"[:4]
+            label = name if len(name) == 4 else f" {name:<3}"
+            h = f"{line[:12]}{label}{line[16:30]}{x:8.3f}{line[38:76]} H\n"
+            lines = self.objects[obj][1]
+            lines.insert(lines.index(line) + 1, h)
+
+    def get_dihedral(self, *atoms, **kwargs):
+        return 0.0
+
+    def count_atoms(self, selection="all", *args, **kwargs):
+        return len(self._atoms(selection))
+
+    # -- output
+    def save(self, path, selection="all", *args, **kwargs):
+        atoms = self._atoms(selection)
+        header = self.objects[atoms[0][0]][0] if atoms else []
+        stublib.write_atomic(path, "".join(header + [line for _, line in atoms]) + "END\n")
+
+    def png(self, path, *args, **kwargs):
+        stublib.start("pymol", sum(len(atoms) for _, atoms in self.objects.values()))
+        _png(path)
+
+cmd = _Cmd()
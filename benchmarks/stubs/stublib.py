@@ -0,0 +1,68 @@
+"""
+Shared code of the stand-in executables in stubs/bin.
+
+Each stub parses the arguments of the real tool, sleeps for a configurable
+delay and writes outputs with the names and formats the pipeline reads,
+computed deterministically from its inputs.
+
+Environment:
+    HG_STUB_DELAY=base[,per_1000_atoms]            seconds for every tool (default 0)
+    HG_STUB_DELAY_<TOOL>=base[,per_1000_atoms]     for one tool, e.g. HG_STUB_DELAY_PHENIX_REFINE=2,0.5
+    HG_STUB_BUSY=1                                 spin the CPU for the delay instead of sleeping
+    HG_STUB_FAIL_<TOOL>=text                       exit 1 when text is in the arguments or the directory
+    HG_STUB_LIGANDS=1                              phenix.ready_set writes a ligands CIF
+"""
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path[:0] = [REPO_DIR, BENCH_DIR]
+
+import structure_index  # noqa: E402
+import synth  # noqa: E402
+
+def env_name(tool):
+    """PHENIX_REFINE for phenix.refine."""
+    return re.sub(r"[^A-Z0-9]", "_", tool.upper())
+
+def delay(tool, atoms=0):
+    """Seconds a call of tool on a model of atoms atoms takes: HG_STUB_DELAY_<TOOL> or HG_STUB_DELAY."""
+    value = os.environ.get(f"HG_STUB_DELAY_{env_name(tool)}", os.environ.get("HG_STUB_DELAY", "0"))
+    base, _, per_1000 = value.partition(",")
+    return float(base or 0) + float(per_1000 or 0) * atoms / 1000.0
+
+def start(tool, atoms=0):
+    """Fail if HG_STUB_FAIL_<TOOL> matches the call, then wait for the tool's delay."""
+    match = os.environ.get(f"HG_STUB_FAIL_{env_name(tool)}")
+    if match and (match in " ".join(sys.argv[1:]) or match in os.getcwd()):
+        print(f"Sorry: {tool} stub set to fail on {match!r}", file=sys.stderr)
+        sys.exit(1)
+    seconds = delay(tool, atoms)
+    if os.environ.get("HG_STUB_BUSY") == "1":
+        end = time.process_time() + seconds
+        while time.process_time() < end:
+            pass
+    elif seconds > 0:
+        time.sleep(seconds)
+
+def atom_count(pdb_file):
+    with open(pdb_file) as f:
+        return sum(1 for line in f if line.startswith(("ATOM  ", "HETATM")))
+
+def rng(*paths):
+    """Generator seeded by the contents of paths."""
+    return np.random.default_rng(synth.content_seed(*paths))
+
+def model(pdb_file):
+    return structure_index.parse(pdb_file)
+
+def write_atomic(path, text, mode="w"):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, mode) as f:
+        f.write(text)
+    os.replace(tmp, path)
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Synthetic inputs for the benchmarks: B-form DNA models of any size, their
+PDB-REDO-style MTZ files and PairTable_X_ray.csv files.
+
+A structure is a set of Watson-Crick duplexes laid side by side, each base
+placed in the standard reference frame of its base pair (3DNA atom
+coordinates) and the base pairs stacked with a 36 degree twist and 3.38 A
+rise; the sugar and phosphate atoms are put at idealised positions next to
+C1'.  The models are not refined-quality, but they have the atom count,
+residue layout, B-factors and contacts of a real DNA crystal structure, so
+every stage of the pipeline does realistic work on them.  Everything is
+seeded, so the same arguments always give the same files.
+
+Usage:
+    python3 synth.py pdb <out.pdb> [--bp N] [--duplex-bp N] [--waters N] [--seed S]
+    python3 synth.py mtz <out.mtz> <model.pdb> [--resolution D] [--seed S]
+    python3 synth.py table <out.csv> [--rows N] [--duplex-bp N] [--seed S]
+    python3 synth.py structures <dir> [--structures N] [--bp N] [--resolution D]
+"""
+import os
+import zlib
+import argparse
+
+import numpy as np
+
+# -------------------------
+# Config
+# -------------------------
+TWIST = 36.0
+RISE = 3.38
+DUPLEX_BP = 12
+DUPLEX_SPACING = 24.0       # distance between neighbouring helix axes (A)
+MARGIN = 8.0                # cell margin around the model (A)
+RESOLUTION = 2.0
+WATERS_PER_BP = 4
+WATER_CLEARANCE = 2.7      # minimum distance of a water from any atom (A)
+
+# Chain IDs, taken two by two for the strands of the duplexes; waters are chain W
+CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVXYZabcdefghijklmnopqrstuvwxyz0123456789"
+WATER_CHAIN = "W"
+
+PARTNER = {'A': 'T', 'T': 'A', 'G': 'C', 'C': 'G'}
+
+# Base atoms in the standard reference frame of a base pair (3DNA Atomic_*.pdb)
+BASES = {
+    'G': [("C1'", -2.477, 5.399), ("N9", -1.289, 4.551), ("C8", 0.023, 4.962), ("N7", 0.870, 3.969),
+          ("C5", 0.071, 2.833), ("C6", 0.424, 1.460), ("O6", 1.554, 0.955), ("N1", -0.700, 0.641),
+          ("C2", -1.999, 1.087), ("N2", -2.949, 0.139), ("N3", -2.342, 2.364), ("C4", -1.265, 3.177)],
+    'A': [("C1'", -2.479, 5.346), ("N9", -1.291, 4.498), ("C8", 0.024, 4.897), ("N7", 0.877, 3.902),
+          ("C5", 0.071, 2.771), ("C6", 0.369, 1.398), ("N6", 1.611, 0.909), ("N1", -0.668, 0.532),
+          ("C2", -1.912, 1.023), ("N3", -2.320, 2.290), ("C4", -1.267, 3.124)],
+    'C': [("C1'", -2.477, 5.402), ("N1", -1.285, 4.542), ("C2", -1.472, 3.158), ("O2", -2.628, 2.709),
+          ("N3", -0.391, 2.344), ("C4", 0.837, 2.868), ("N4", 1.875, 2.027), ("C5", 1.056, 4.275),
+          ("C6", -0.023, 5.068)],
+    'T': [("C1'", -2.481, 5.354), ("N1", -1.284, 4.500), ("C2", -1.462, 3.135), ("O2", -2.562, 2.608),
+          ("N3", -0.298, 2.407), ("C4", 0.994, 2.897), ("O4", 1.944, 2.119), ("C5", 1.106, 4.338),
+          ("C7", 2.466, 4.961), ("C6", -0.024, 5.057)],
+}
+GLYCOSIDIC_N = {'A': "N9", 'G': "N9", 'C': "N1", 'T': "N1"}
+BACKBONE = ["P", "OP1", "OP2", "O5'", "C5'", "C4'", "O4'", "C3'", "O3'", "C2'"]
+
+# -------------------------
+# Geometry
+# -------------------------
+def _unit(v):
+    return v / np.linalg.norm(v)
+
+def nucleotide(base):
+    """{atom name: xyz} of a nucleotide in the base-pair frame, sugar ring and phosphate included."""
+    atoms = {name: np.array([x, y, 0.0]) for name, x, y in BASES[base]}
+    c1 = atoms["C1'"]
+    u = _unit(c1 - atoms[GLYCOSIDIC_N[base]])      # away from the base
+    v = np.array([0.0, 0.0, 1.0])                  # normal of the base plane
+    # sugar ring: a regular pentagon (1.5 A sides) through C1', tilted out of the base plane
+    # away from the next base pair up, so that stacked residues do not clash
+    w = _unit(u - 0.6 * v)
+    n = np.cross(w, _unit(np.cross(v, w)))
+    radius = 1.5 / (2 * np.sin(np.radians(36)))
+    center = c1 + w * radius
+    for k, name in enumerate(["C1'", "C2'", "C3'", "C4'", "O4'"]):
+        t = np.radians(180 + 72 * k)
+        if k:
+            atoms[name] = center + radius * (np.cos(t) * w + np.sin(t) * n)
+    out4, out3 = _unit(atoms["C4'"] - center), _unit(atoms["C3'"] - center)
+    atoms["O3'"] = atoms["C3'"] + 1.43 * _unit(out3 - 0.5 * v)
+    atoms["C5'"] = atoms["C4'"] + 1.51 * _unit(out4 - 0.7 * v)
+    atoms["O5'"] = atoms["C5'"] + 1.44 * _unit(out4 + 0.2 * u - 0.9 * v)
+    atoms["P"] = atoms["O5'"] + 1.59 * u
+    atoms["OP1"] = atoms["P"] + 1.48 * _unit(u - 0.3 * v + 0.8 * n)
+    atoms["OP2"] = atoms["P"] + 1.48 * _unit(u - 0.3 * v - 0.8 * n)
+    return atoms
+
+_TEMPLATES = {base: nucleotide(base) for base in BASES}
+
+def rotation_z(angle):
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+
+# complementary strand: the base-pair frame turned 180 degrees about x
+FLIP_X = np.diag([1.0, -1.0, -1.0])
+
+def atom_line(serial, name, resname, chain, resseq, xyz, b, element, record="ATOM  ", occupancy=1.0):
+    label = name if len(name) == 4 else f" {name:<3}"
+    return (f"{record}{serial % 100000:5d} {label} {resname:>3} {chain}{resseq:4d}    "
+            f"{xyz[0]:8.3f}{xyz[1]:8.3f}{xyz[2]:8.3f}{occupancy:6.2f}{b:6.2f}          {element:>2}\n")
+
+def residue_order(base):
+    """Atom names of a nucleotide in PDB order (backbone, sugar, then base)."""
+    return BACKBONE + ["C1'"] + [name for name, _, _ in BASES[base] if name != "C1'"]
+
+# -------------------------
+# Structures
+# -------------------------
+def sequence(n, rng):
+    return "".join(rng.choice(list("ACGT"), size=n))
+
+def duplex_sizes(n_bp, duplex_bp):
+    """Lengths of the duplexes holding n_bp base pairs, at most len(CHAIN_IDS) // 2 of them."""
+    n_duplex = max(1, -(-n_bp // duplex_bp))
+    n_duplex = min(n_duplex, len(CHAIN_IDS) // 2)
+    base, extra = divmod(n_bp, n_duplex)
+    return [base + (k < extra) for k in range(n_duplex)]
+
+def build_structure(n_bp=DUPLEX_BP, duplex_bp=DUPLEX_BP, waters=None, seed=0):
+    """
+    Lines of a synthetic DNA model with n_bp base pairs (CRYST1 and ATOM/HETATM
+    records) and its base pairs [(chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2)].
+    Strand 1 of a duplex of n base pairs is numbered 1..n, strand 2 n+1..2n, so
+    residue i pairs with 2n+1-i.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = duplex_sizes(n_bp, duplex_bp)
+    side = int(np.ceil(np.sqrt(len(sizes))))
+    records, pairs = [], []
+    for d, n in enumerate(sizes):
+        chain_1, chain_2 = CHAIN_IDS[2 * d], CHAIN_IDS[2 * d + 1]
+        offset = np.array([(d % side) * DUPLEX_SPACING, (d // side) * DUPLEX_SPACING, 0.0])
+        seq = sequence(n, rng)
+        for i, base in enumerate(seq):
+            R = rotation_z(TWIST * i)
+            origin = offset + np.array([0.0, 0.0, RISE * i])
+            partner = PARTNER[base]
+            resseq_1, resseq_2 = i + 1, 2 * n - i
+            for chain, resseq, b, frame in ((chain_1, resseq_1, base, np.eye(3)),
+                                            (chain_2, resseq_2, partner, FLIP_X)):
+                template = _TEMPLATES[b]
+                for name in residue_order(b):
+                    records.append((chain, resseq, f"D{b}", name, R @ frame @ template[name] + origin))
+            pairs.append((chain_1, base, resseq_1, chain_2, partner, resseq_2))
+
+    xyz = np.array([r[4] for r in records])
+    lo = xyz.min(axis=0) - MARGIN
+    xyz -= lo
+    cell = np.ceil(xyz.max(axis=0) + MARGIN)
+    b_factors = np.round(rng.uniform(15.0, 45.0, len(records)), 2)
+
+    lines = [f"CRYST1{cell[0]:9.3f}{cell[1]:9.3f}{cell[2]:9.3f}  90.00  90.00  90.00 P 1           1\n"]
+    # records are grouped by duplex; write each chain's residues in order
+    order = sorted(range(len(records)), key=lambda k: (CHAIN_IDS.index(records[k][0]), records[k][1]))
+    serial = 0
+    for k in order:
+        chain, resseq, resname, name, _ = records[k]
+        serial += 1
+        lines.append(atom_line(serial, name, resname, chain, resseq, xyz[k], b_factors[k], name[0]))
+    lines.append("TER\n")
+
+    # waters in a shell around the helices, kept WATER_CLEARANCE apart from atoms and each other
+    n_waters = WATERS_PER_BP * n_bp if waters is None else waters
+    centers = np.array([[(d % side) * DUPLEX_SPACING, (d // side) * DUPLEX_SPACING] for d in range(len(sizes))]) - lo[:2]
+    occupied = set(map(tuple, np.floor(xyz / WATER_CLEARANCE).astype(int).tolist()))
+    placed = 0
+    for attempt in range(20 * n_waters):
+        if placed == n_waters:
+            break
+        d = attempt % len(sizes)
+        t = rng.uniform(0, 2 * np.pi)
+        r = rng.uniform(11.5, 15.0)
+        pos = np.array([centers[d][0] + r * np.cos(t), centers[d][1] + r * np.sin(t),
+                        rng.uniform(0, RISE * sizes[d]) - lo[2]])
+        slot = tuple(np.floor(pos / WATER_CLEARANCE).astype(int).tolist())
+        neighbours = [(slot[0] + i, slot[1] + j, slot[2] + k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)]
+        if any(c in occupied for c in neighbours):
+            continue
+        occupied.add(slot)
+        placed += 1
+        serial += 1
+        lines.append(atom_line(serial, "O", "HOH", WATER_CHAIN, placed, pos, rng.uniform(25, 60), "O", record="HETATM"))
+    lines.append("END\n")
+    return lines, pairs, tuple(cell.tolist()) + (90.0, 90.0, 90.0)
+
+def write_pdb(path, n_bp=DUPLEX_BP, duplex_bp=DUPLEX_BP, waters=None, seed=0):
+    """Write a synthetic model (see build_structure); return (base pairs, cell)."""
+    lines, pairs, cell = build_structure(n_bp, duplex_bp, waters, seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.writelines(lines)
+    return pairs, cell
+
+def read_cell(pdb_file):
+    with open(pdb_file) as f:
+        for line in f:
+            if line.startswith("CRYST1"):
+                return tuple(float(line[k:k + 9]) for k in (6, 15, 24)) + \
+                    tuple(float(line[k:k + 7]) for k in (33, 40, 47))
+    raise ValueError(f"no CRYST1 record in {pdb_file}")
+
+# -------------------------
+# MTZ
+# -------------------------
+MTZ_COLUMNS = [("H", "H"), ("K", "H"), ("L", "H"), ("FP", "F"), ("SIGFP", "Q"), ("FREE", "I")]
+
+def reflections(cell, resolution):
+    """Unique P1 reflections (h, k, l) of an orthogonal cell to the resolution limit."""
+    a, b, c = cell[:3]
+    hmax, kmax, lmax = (int(x / resolution) for x in (a, b, c))
+    k, l = np.meshgrid(np.arange(-kmax, kmax + 1), np.arange(-lmax, lmax + 1), indexing="ij")
+    k, l = k.ravel(), l.ravel()
+    out = []
+    for h in range(hmax + 1):
+        s2 = (h / a) ** 2 + (k / b) ** 2 + (l / c) ** 2
+        keep = (s2 <= 1.0 / resolution ** 2) & (s2 > 0)
+        if h == 0:
+            keep &= (k > 0) | ((k == 0) & (l > 0))
+        out.append(np.column_stack([np.full(keep.sum(), h), k[keep], l[keep]]))
+    return np.concatenate(out) if out else np.empty((0, 3), dtype=int)
+
+def write_mtz(path, cell, resolution=RESOLUTION, seed=0):
+    """
+    Write an MTZ file (little-endian, MTZ:V1.1 header) with H K L FP SIGFP FREE
+    columns for the unique reflections of cell to resolution.  Return the number of reflections.
+    """
+    hkl = reflections(cell, resolution)
+    rng = np.random.default_rng(seed)
+    s2 = ((hkl / np.array(cell[:3])) ** 2).sum(axis=1)
+    fp = 100.0 * np.exp(-5.0 * s2) * rng.rayleigh(1.0, len(hkl)) + 1.0
+    data = np.column_stack([hkl, fp, 0.05 * fp + 0.5, rng.integers(0, 20, len(hkl))]).astype("<f4")
+    nref, ncol = data.shape
+    lo, hi = data.min(axis=0), data.max(axis=0)
+    s2_lo, s2_hi = float(s2.min()) if len(s2) else 0.0, float(s2.max()) if len(s2) else 0.0
+    cell_text = " ".join(f"{x:.4f}" for x in cell)
+    records = [
+        "VERS MTZ:V1.1",
+        "TITLE synthetic data for benchmarks",
+        f"NCOL {ncol:8d} {nref:12d} {0:8d}",
+        f"CELL {cell_text}",
+        "SORT    1   2   3   0   0",
+        "SYMINF   1  1 P     1                 'P 1' PG1",
+        "SYMM X,  Y,  Z",
+        f"RESO {s2_lo:.6f} {s2_hi:.6f}",
+        "VALM NAN",
+    ]
+    for (label, kind), a, b in zip(MTZ_COLUMNS, lo, hi):
+        records.append(f"COLUMN {label:<30} {kind} {a:17.4f} {b:17.4f}    1")
+    records += ["NDIF        1", "PROJECT       1 synthetic", "CRYSTAL       1 synthetic",
+                "DATASET       1 synthetic", f"DCELL         1 {cell_text}", "DWAVEL        1    1.00000",
+                "END", "MTZENDOFHEADERS"]
+    header_word = 21 + nref * ncol
+    first = b"MTZ " + np.array([header_word], dtype="<i4").tobytes() + bytes([0x44, 0x41, 0, 0])
+    tmp = path + ".tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(first.ljust(80, b"\0"))
+        f.write(data.tobytes())
+        f.write("".join(r[:80].ljust(80) for r in records).encode())
+    os.replace(tmp, path)
+    return nref
+
+def read_mtz_header(path):
+    """(cell, resolution limit, header records) of an MTZ file written by write_mtz or phenix."""
+    with open(path, "rb") as f:
+        first = f.read(12)
+        endian = "<" if first[9] & 0xF0 == 0x40 else ">"
+        word = int(np.frombuffer(first[4:8], dtype=f"{endian}i4")[0])
+        f.seek(4 * (word - 1))
+        raw = f.read().decode("ascii", "replace")
+    records = [raw[k:k + 80] for k in range(0, len(raw), 80)]
+    cell, resolution = None, RESOLUTION
+    for r in records:
+        if r.startswith("CELL"):
+            cell = tuple(float(x) for x in r.split()[1:7])
+        elif r.startswith("RESO"):
+            s2 = float(r.split()[2])
+            resolution = 1.0 / np.sqrt(s2) if s2 > 0 else RESOLUTION
+        elif r.startswith("END"):
+            break
+    return cell, resolution, records
+
+# -------------------------
+# Pair tables
+# -------------------------
+def pdb_code(k):
+    """Synthetic PDB code of structure k: a digit then three letters or digits (9zzz, 9zzy, ...)."""
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789"
+    k, a = divmod(k, 36)
+    k, b = divmod(k, 36)
+    k, c = divmod(k, 36)
+    return f"{9 - k % 9}{alphabet[c]}{alphabet[b]}{alphabet[a]}"
+
+def table_rows(structures, resolution=RESOLUTION):
+    """PairTable_X_ray.csv rows of {pdb_code: base pairs}."""
+    rows = []
+    for code, pairs in structures.items():
+        for chain_1, nt_1, n_1, chain_2, nt_2, n_2 in pairs:
+            rows.append([code, "1", f"{resolution:.1f}", "anti", "anti", chain_1, nt_1, str(n_1), chain_2, nt_2, str(n_2)])
+    return rows
+
+def write_table(path, rows):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(",".join(row) + "\n")
+
+def synthetic_table(n_rows, duplex_bp=DUPLEX_BP, seed=0):
+    """n_rows pair-table rows over structures of one duplex_bp duplex each (no files written)."""
+    rng = np.random.default_rng(seed)
+    structures = {}
+    k = 0
+    while sum(len(p) for p in structures.values()) < n_rows:
+        seq = sequence(duplex_bp, rng)
+        structures[pdb_code(k)] = [("A", b, i + 1, "B", PARTNER[b], 2 * duplex_bp - i) for i, b in enumerate(seq)]
+        k += 1
+    return table_rows(structures)[:n_rows]
+
+def write_structures(out_dir, n_structures=1, n_bp=DUPLEX_BP, duplex_bp=DUPLEX_BP, resolution=RESOLUTION,
+                     waters=None):
+    """
+    Write n_structures synthetic structures under out_dir, laid out as the
+    pipeline finds them: pdb/<code>.pdb1 (the --pdb-path directory) and
+    redo/<code>/<code>_final.mtz (a file:// stand-in for PDB-REDO, see
+    mtz_cache.mtz_url).  Return their pair-table rows.
+    """
+    structures = {}
+    for k in range(n_structures):
+        code = pdb_code(k)
+        pairs, cell = write_pdb(os.path.join(out_dir, "pdb", f"{code}.pdb1"), n_bp, duplex_bp, waters, seed=k)
+        write_mtz(os.path.join(out_dir, "redo", code, f"{code}_final.mtz"), cell, resolution, seed=k)
+        structures[code] = pairs
+    return table_rows(structures, resolution)
+
+def content_seed(*paths):
+    """Seed derived from the contents of files, for deterministic stubs."""
+    crc = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+    return crc
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic structures, MTZ files and pair tables.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("pdb", help="one synthetic DNA model")
+    p.add_argument("out")
+    p.add_argument("--bp", type=int, default=DUPLEX_BP, help="base pairs (about 41 atoms each)")
+    p.add_argument("--duplex-bp", type=int, default=DUPLEX_BP, help="base pairs per duplex")
+    p.add_argument("--waters", type=int, default=None, help=f"waters (default: up to {WATERS_PER_BP} per base pair)")
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("mtz", help="MTZ file matching a model's cell")
+    p.add_argument("out")
+    p.add_argument("model")
+    p.add_argument("--resolution", type=float, default=RESOLUTION)
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("table", help="pair table without structure files")
+    p.add_argument("out")
+    p.add_argument("--rows", type=int, default=100)
+    p.add_argument("--duplex-bp", type=int, default=DUPLEX_BP)
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("structures", help="structures with MTZ files and their pair table")
+    p.add_argument("dir")
+    p.add_argument("--structures", type=int, default=1)
+    p.add_argument("--bp", type=int, default=DUPLEX_BP)
+    p.add_argument("--duplex-bp", type=int, default=DUPLEX_BP)
+    p.add_argument("--resolution", type=float, default=RESOLUTION)
+    args = parser.parse_args()
+
+    if args.cmd == "pdb":
+        pairs, cell = write_pdb(args.out, args.bp, args.duplex_bp, args.waters, args.seed)
+        print(f"Written {args.out}: {len(pairs)} base pairs, cell {' '.join(f'{x:.0f}' for x in cell[:3])}")
+    elif args.cmd == "mtz":
+        n = write_mtz(args.out, read_cell(args.model), args.resolution, args.seed)
+        print(f"Written {args.out}: {n} reflections")
+    elif args.cmd == "table":
+        rows = synthetic_table(args.rows, args.duplex_bp, args.seed)
+        write_table(args.out, rows)
+        print(f"Written {args.out}: {len(rows)} rows")
+    else:
+        rows = write_structures(args.dir, args.structures, args.bp, args.duplex_bp, args.resolution)
+        write_table(os.path.join(args.dir, "PairTable_X_ray.csv"), rows)
+        print(f"Written {args.structures} structures and {len(rows)} pairs to {args.dir}")
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+CCP4/MRC density maps as written by phenix.mtz2map, read through a memory map.
+
+The header gives the grid sampling of the unit cell, the extent of the
+stored box and the order of its axes.  The values are not read up front:
+CCP4Map keeps a memory-mapped view of them indexed as [x, y, z] grid points
+of the cell (grid point g sits at fractional coordinates g / grid), so only
+the pages of the regions actually used are read.  box() returns the values
+of a bounding box given in Cartesian or fractional coordinates: a numpy view
+of the file when the box lies inside the stored map, otherwise a small array
+gathered with
+
+  - periodic wrapping, for maps covering the whole cell;
+  - the symmetry operators of the header, for maps covering less (e.g. an
+    asymmetric unit), so points outside the stored box are taken from a
+    symmetry-equivalent point inside it; points with none are NaN.
+
+Usage:
+    python3 ccp4_map.py <map.ccp4>                                  # print the header
+    python3 ccp4_map.py <map.ccp4> <x0> <y0> <z0> <x1> <y1> <z1>    # statistics of a Cartesian box
+    python3 ccp4_map.py <map.ccp4> <x0> <y0> <z0> <x1> <y1> <z1> --out <box.ccp4>
+
+write_map() stores a box as a CCP4 map of its own; crop() replaces a map by
+the box around some atoms, keeping the mean and RMS of the full map in the
+header.
+"""
+import os
+import re
+import sys
+from fractions import Fraction
+
+import numpy as np
+
+# -------------------------
+# Config
+# -------------------------
+HEADER_BYTES = 1024
+MODES = {0: np.int8, 1: np.int16, 2: np.float32}
+SYMOP_RECORD = 80
+
+# -------------------------
+# Helpers
+# -------------------------
+def orthogonalization(cell):
+    """Matrix taking fractional to Cartesian coordinates (a along x, b in the xy plane)."""
+    a, b, c, alpha, beta, gamma = cell
+    ca, cb, cg = np.cos(np.radians([alpha, beta, gamma]))
+    sg = np.sin(np.radians(gamma))
+    volume = a * b * c * np.sqrt(1 - ca * ca - cb * cb - cg * cg + 2 * ca * cb * cg)
+    return np.array([
+        [a, b * cg, c * cb],
+        [0.0, b * sg, c * (ca - cb * cg) / sg],
+        [0.0, 0.0, volume / (a * b * sg)],
+    ])
+
+def read_header(raw):
+    """Parse the 1024-byte header; return (dict, numpy byte order)."""
+    for order in ("<", ">"):
+        words = np.frombuffer(raw[:HEADER_BYTES], dtype=f"{order}i4")
+        if words[3] in MODES and 0 < words[16] <= 3:
+            break
+    else:
+        raise ValueError("not a CCP4 map (unknown mode or axis order)")
+    floats = np.frombuffer(raw[:HEADER_BYTES], dtype=f"{order}f4")
+    header = {
+        'counts': words[0:3].tolist(),        # columns, rows, sections
+        'mode': int(words[3]),
+        'starts': words[4:7].tolist(),
+        'grid': words[7:10].tolist(),         # sampling of the cell along x, y, z
+        'cell': floats[10:16].tolist(),
+        'axes': words[16:19].tolist(),        # axis (1=x, 2=y, 3=z) of columns, rows, sections
+        'amin': float(floats[19]), 'amax': float(floats[20]), 'amean': float(floats[21]),
+        'spacegroup': int(words[22]),
+        'nsymbt': int(words[23]),
+        'rms': float(floats[54]),
+    }
+    return header, order
+
+def parse_symop(text):
+    """(R, t) of a symmetry operator such as '-X,Y+1/2,-Z' (fractional coordinates)."""
+    rows = [part.strip().upper().replace(" ", "") for part in text.split(",")]
+    if len(rows) != 3:
+        raise ValueError(f"bad symmetry operator: {text!r}")
+    R = np.zeros((3, 3))
+    t = np.zeros(3)
+    for i, row in enumerate(rows):
+        for sign, term in re.findall(r"([+-]?)([^+-]+)", row):
+            value = -1 if sign == "-" else 1
+            if term in "XYZ":
+                R[i, "XYZ".index(term)] += value
+            else:
+                t[i] += value * float(Fraction(term))
+    return R, t
+
+def parse_symops(block):
+    """Operators of the symmetry records that follow the header (identity first)."""
+    ops = [(np.eye(3), np.zeros(3))]
+    text = block.decode("ascii", errors="replace")
+    for n in range(0, len(text), SYMOP_RECORD):
+        for op in text[n:n + SYMOP_RECORD].split("*"):
+            if op.strip():
+                R, t = parse_symop(op)
+                if not (np.array_equal(R, np.eye(3)) and not t.any()):
+                    ops.append((R, t))
+    return ops
+
+# -------------------------
+# Map
+# -------------------------
+class CCP4Map:
+    """Header, geometry and memory-mapped values of a CCP4 map file."""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            raw = f.read(HEADER_BYTES)
+            self.header, order = read_header(raw)
+            symbols = f.read(self.header['nsymbt'])
+        self.path = path
+        h = self.header
+        nc, nr, ns = h['counts']
+        dtype = np.dtype(MODES[h['mode']]).newbyteorder(order)
+        values = np.memmap(path, dtype=dtype, mode="r", offset=HEADER_BYTES + h['nsymbt'], shape=(ns, nr, nc))
+
+        # file axes are (sections, rows, columns); put them in x, y, z order (still a view)
+        file_axes = [h['axes'][2] - 1, h['axes'][1] - 1, h['axes'][0] - 1]
+        self.data = values.transpose([file_axes.index(k) for k in range(3)])
+        self.start = np.array([h['starts'][h['axes'].index(k + 1)] for k in range(3)])
+        self.shape = np.array(self.data.shape)
+        self.grid = np.array(h['grid'])
+        self.cell = h['cell']
+        self.frac_to_cart = orthogonalization(self.cell)
+        self.cart_to_frac = np.linalg.inv(self.frac_to_cart)
+        self.periodic = bool(np.all(self.shape >= self.grid))
+        try:
+            self.symops = parse_symops(symbols)
+        except ValueError:
+            self.symops = [(np.eye(3), np.zeros(3))]
+
+    def statistics(self):
+        """(min, max, mean, rms) of the stored values, read one section at a time."""
+        lo, hi, total, squares, n = np.inf, -np.inf, 0.0, 0.0, 0
+        for k in range(self.data.shape[2]):
+            v = np.asarray(self.data[:, :, k], dtype=np.float64)
+            lo, hi = min(lo, v.min()), max(hi, v.max())
+            total += v.sum()
+            squares += np.sum(v * v)
+            n += v.size
+        mean = total / n
+        return float(lo), float(hi), float(mean), float(np.sqrt(max(squares / n - mean * mean, 0.0)))
+
+    def grid_to_cart(self, points):
+        """Cartesian coordinates of (n, 3) grid points."""
+        return (np.asarray(points) / self.grid) @ self.frac_to_cart.T
+
+    def grid_range(self, lo, hi, frac=False):
+        """Grid index bounds (inclusive) of the box with corners lo, hi (Cartesian, or fractional)."""
+        corners = np.array([[x, y, z] for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])],
+                           dtype=float)
+        f = corners if frac else corners @ self.cart_to_frac.T
+        g = f * self.grid
+        return np.floor(g.min(axis=0)).astype(int), np.ceil(g.max(axis=0)).astype(int)
+
+    def box(self, lo, hi, frac=False):
+        """The map values of the box with corners lo, hi (Cartesian, or fractional) as a MapBox."""
+        return self.grid_box(*self.grid_range(lo, hi, frac))
+
+    def grid_box(self, g0, g1):
+        """The map values of grid points g0 to g1 (inclusive) as a MapBox."""
+        g0, g1 = np.asarray(g0), np.asarray(g1)
+        i0, i1 = g0 - self.start, g1 - self.start + 1
+        if np.all(i0 >= 0) and np.all(i1 <= self.shape):
+            return MapBox(self, g0, self.data[i0[0]:i1[0], i0[1]:i1[1], i0[2]:i1[2]])
+        axes = [np.arange(a, b + 1) for a, b in zip(g0, g1)]
+        points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+        return MapBox(self, g0, self.values(points).reshape(*(g1 - g0 + 1)))
+
+    def box_around(self, xyz, pad):
+        """box() around Cartesian coordinates xyz (n, 3) plus pad (A)."""
+        xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+        return self.box(xyz.min(axis=0) - pad, xyz.max(axis=0) + pad)
+
+    def points_near(self, center, radius):
+        """Grid points (n, 3) within radius (A) of a Cartesian center, and their Cartesian coordinates."""
+        g = self.cart_to_frac @ np.asarray(center, dtype=float) * self.grid
+        # half-extent of the sphere along each grid axis
+        reach = radius * np.linalg.norm(self.cart_to_frac, axis=1) * self.grid
+        lo = np.floor(g - reach).astype(int)
+        hi = np.ceil(g + reach).astype(int)
+        axes = [np.arange(l, h + 1) for l, h in zip(lo, hi)]
+        points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+        cart = self.grid_to_cart(points)
+        close = np.sum((cart - center) ** 2, axis=1) <= radius * radius
+        return points[close], cart[close]
+
+    def values(self, points):
+        """
+        Map values at (n, 3) grid points: wrapped into a whole-cell map, else
+        taken from the first symmetry-equivalent point inside the stored box (NaN if none).
+        """
+        points = np.asarray(points)
+        if self.periodic:
+            idx = np.mod(np.mod(points, self.grid) - self.start, self.shape)
+            return np.asarray(self.data[idx[:, 0], idx[:, 1], idx[:, 2]], dtype=np.float32)
+        out = np.full(len(points), np.nan, dtype=np.float32)
+        todo = np.ones(len(points), dtype=bool)
+        frac = points / self.grid
+        for R, t in self.symops:
+            g = np.rint((frac[todo] @ R.T + t) * self.grid).astype(int)
+            idx = np.mod(g - self.start, self.grid)
+            inside = np.all(idx < self.shape, axis=1)
+            rows = np.flatnonzero(todo)[inside]
+            idx = idx[inside]
+            out[rows] = self.data[idx[:, 0], idx[:, 1], idx[:, 2]]
+            todo[rows] = False
+            if not todo.any():
+                break
+        return out
+
+class MapBox:
+    """The values of a box of grid points of a CCP4Map, starting at grid point origin."""
+    def __init__(self, parent, origin, data):
+        self.parent = parent
+        self.origin = np.asarray(origin)
+        self.data = data
+        self.shape = np.array(data.shape)
+
+    def points_near(self, center, radius):
+        return self.parent.points_near(center, radius)
+
+    def values(self, points):
+        """Values at (n, 3) grid points of the cell; NaN outside the box."""
+        idx = np.asarray(points) - self.origin
+        inside = np.all((idx >= 0) & (idx < self.shape), axis=1)
+        out = np.full(len(idx), np.nan, dtype=np.float32)
+        out[inside] = self.data[idx[inside, 0], idx[inside, 1], idx[inside, 2]]
+        return out
+
+# -------------------------
+# Writing
+# -------------------------
+def write_map(path, box, mean=None, rms=None):
+    """
+    Write a MapBox as a CCP4 map (mode 2, x along columns) on the grid of its
+    parent map; mean and rms default to those of the box.
+    """
+    data = np.nan_to_num(np.asarray(box.data, dtype="<f4"))
+    header = np.zeros(HEADER_BYTES // 4, dtype="<i4")
+    floats = header.view("<f4")
+    header[0:3] = box.shape
+    header[3] = 2
+    header[4:7] = box.origin
+    header[7:10] = box.parent.grid
+    floats[10:16] = box.parent.cell
+    header[16:19] = [1, 2, 3]
+    floats[19], floats[20] = data.min(), data.max()
+    floats[21] = data.mean() if mean is None else mean
+    header[22] = box.parent.header['spacegroup']
+    header[52] = int.from_bytes(b"MAP ", "little")
+    header[53] = 0x00004144                      # little-endian machine stamp
+    floats[54] = data.std() if rms is None else rms
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header.tobytes())
+        f.write(np.ascontiguousarray(data.transpose(2, 1, 0)).tobytes())
+    os.replace(tmp, path)
+
+def crop(map_file, xyz, padding, out_file=None):
+    """
+    Replace map_file (or write out_file) by the box around Cartesian
+    coordinates xyz plus padding (A), never wider than the stored map along
+    an axis.  Return the box shape, or None if the box would not be smaller
+    than the stored map (map_file is then left as it is).
+    """
+    full = CCP4Map(map_file)
+    xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+    g0, g1 = full.grid_range(xyz.min(axis=0) - padding, xyz.max(axis=0) + padding)
+    wide = g1 - g0 + 1 >= full.shape
+    g0[wide], g1[wide] = full.start[wide], (full.start + full.shape - 1)[wide]
+    if np.prod(g1 - g0 + 1) >= np.prod(full.shape):
+        if out_file:
+            write_map(out_file, full.grid_box(full.start, full.start + full.shape - 1))
+        return None
+    _, _, mean, rms = full.statistics()
+    box = full.grid_box(g0, g1)
+    write_map(out_file or map_file, box, mean, rms)
+    return box.shape
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    out = None
+    if "--out" in sys.argv:
+        n = sys.argv.index("--out")
+        out = sys.argv[n + 1] if n + 1 < len(sys.argv) else None
+        del sys.argv[n:n + 2]
+    if len(sys.argv) not in (2, 8) or (out is not None and len(sys.argv) != 8):
+        print("Usage: python3 ccp4_map.py <map.ccp4> [<x0> <y0> <z0> <x1> <y1> <z1> [--out <box.ccp4>]]", file=sys.stderr)
+        sys.exit(1)
+
+    m = CCP4Map(sys.argv[1])
+    if len(sys.argv) == 2:
+        for key, value in m.header.items():
+            print(f"{key:12s} {value}")
+        print(f"{'box':12s} start {m.start.tolist()} shape {m.shape.tolist()} (x, y, z)"
+              f"{' whole cell' if m.periodic else ''}")
+        print(f"{'symops':12s} {len(m.symops)}")
+    else:
+        coords = [float(v) for v in sys.argv[2:]]
+        b = m.box(coords[:3], coords[3:])
+        v = np.asarray(b.data, dtype=float)
+        print(f"origin {b.origin.tolist()} shape {b.shape.tolist()} "
+              f"min {np.nanmin(v):.4f} max {np.nanmax(v):.4f} mean {np.nanmean(v):.4f}")
+        if out:
+            write_map(out, b)
+            print(f"Written to {out}")
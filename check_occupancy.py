@@ -1,5 +1,6 @@
 import sys, re
-from collections import defaultdict
+
+import structure_index
 
 def split_resi(s: str):
     # Allow optional leading '-' for negative residue numbers
@@ -11,31 +12,11 @@ def split_resi(s: str):
 pdb, chain, resi = sys.argv[1], sys.argv[2], sys.argv[3]
 resn, icode = split_resi(resi)
 
-rows, by_alt = [], defaultdict(list)
-with open(pdb) as fh:
-    for ln in fh:
-        if not (ln.startswith("ATOM  ") or ln.startswith("HETATM")):
-            continue
-        if ln[21] != chain:                          # chain ID
-            continue
-        try:
-            seq = int(ln[22:26])                     # resSeq (can be negative)
-        except ValueError:
-            continue
-        ic = ln[26]                                  # insertion code
-
-        if seq != resn or (icode != " " and ic != icode):
-            continue
-
-        resname = ln[17:20].strip()
-        atom    = ln[12:16].strip()
-        alt     = (ln[16].strip() or ".")           # altLoc
-        occ     = float(ln[54:60])                  # occupancy
-        rows.append((resname, f"{seq}{'' if ic==' ' else ic}", atom, alt, occ))
-        by_alt[alt].append(occ)
+# Parsed with the same PDB parser as Bfactor.py and preflight.py (see structure_index.py)
+by_alt = structure_index.load(pdb).occupancy_by_alt(chain, resn, icode)
 
-if not rows:
+if not by_alt:
     sys.exit("No atoms found for that selection.")
 
-for alt, qs in by_alt.items():
-    print(f"{sum(qs)/len(qs):.3f}")
+for alt, q in by_alt:
+    print(f"{q:.3f}")
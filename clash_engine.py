@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+In-process all-atom clashscore for small selections of a refined model.
+
+Clashes.py scored the base pair and the purine +-1 neighbours by saving each
+selection with PyMOL and running phenix.clashscore on the file.  Here the
+model is read once (structure_index.py), the selection's atoms are put in a
+spatial tree (scipy's cKDTree, or a cell grid without scipy) and every pair
+of atoms closer than the sum of their van der Waals radii is checked:
+
+  - atoms up to BOND_SEPARATION covalent bonds apart (bonds inferred from
+    covalent radii) and atoms of different alternate conformations never clash;
+  - a polar hydrogen and an N/O acceptor form an H-bond and only clash if
+    they overlap by more than HBOND_OVERLAP;
+  - any other pair overlapping by CLASH_OVERLAP (0.4 A) or more is a serious
+    clash, as in MolProbity.
+
+clashscore = 1000 * serious clashes / atoms of the selection, the definition
+of phenix.clashscore.  phenix.clashscore adds hydrogens with Reduce before
+scoring, and refined X-ray models carry none, so the engine scores a copy of
+the model with hydrogens added by the same program (add_hydrogens(): one
+Reduce run per model, REDUCE_SUFFIX next to it); the selections of a state
+are all taken from that copy.  --calibrate compares the engine with the
+phenix.clashscore outputs (*_clashscore_local_*.txt next to *_bp.pdb /
+*_bp_plus1.pdb) left in tuple directories by a phenix run, scoring the same
+residues the way a run with --clash-engine (pipeline.py, batch_run.py) does.
+
+Global clashscores of refined models are rescored against a contact baseline
+of the deposited structure (ContactBaseline), computed once per structure and
+saved next to it: only atoms that moved more than MOVE_TOLERANCE are searched
+again, and the baseline pairs of the others are re-checked at their new
+positions.  The baseline keeps every pair that could clash after moving by the
+tolerance, so the result equals a full recomputation by the engine.  Both
+sides are the hydrogen-added copies: the deposited structure is protonated
+once, and each refined model reuses the copy its selections are scored on.
+
+Usage:
+    python3 clash_engine.py <pdb_file> <chain> <resseq> [<chain> <resseq> ...]
+    python3 clash_engine.py --global <model_pdb> <reference_pdb>
+    python3 clash_engine.py --calibrate [TUPLE_ROOT ...]
+"""
+import os
+import sys
+import glob
+import subprocess
+from collections import deque
+
+import numpy as np
+
+import instrument
+import structure_index
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# -------------------------
+# Config
+# -------------------------
+CLASH_OVERLAP = 0.4     # serious clash (A)
+HBOND_OVERLAP = 0.8     # H-bond pairs only clash beyond this overlap (A)
+BOND_SEPARATION = 3     # atoms up to this many bonds apart do not clash
+BOND_TOLERANCE = 0.45   # bonded if closer than the sum of covalent radii plus this (A)
+MOVE_TOLERANCE = 0.25   # global mode: atoms that moved further are searched again (A)
+GRID_CELL = 4.0         # cell edge of the neighbour grid used without scipy (A)
+
+# Probe-style van der Waals radii (A); hydrogens bonded to N/O use POLAR_H_RADIUS
+VDW_RADII = {
+    'H': 1.17, 'C': 1.75, 'N': 1.55, 'O': 1.40, 'P': 1.80, 'S': 1.80, 'SE': 1.90,
+    'F': 1.30, 'CL': 1.75, 'BR': 1.85, 'I': 2.20,
+    'NA': 0.95, 'K': 1.33, 'MG': 0.65, 'CA': 0.99, 'MN': 0.80, 'FE': 0.74,
+    'CO': 0.70, 'NI': 0.66, 'CU': 0.72, 'ZN': 0.74, 'CD': 0.97, 'SR': 1.12, 'BA': 1.34,
+}
+DEFAULT_RADIUS = 1.80
+POLAR_H_RADIUS = 1.00
+
+COVALENT_RADII = {'H': 0.37, 'C': 0.77, 'N': 0.75, 'O': 0.73, 'P': 1.06, 'S': 1.02, 'SE': 1.16,
+                  'F': 0.71, 'CL': 0.99, 'BR': 1.14, 'I': 1.33}
+ACCEPTORS = ("N", "O")
+
+# Files written by this engine start with this line (and are left out of --calibrate)
+ENGINE_TAG = "# clash_engine.py"
+# Hydrogens are added as phenix.clashscore adds them: Reduce, without flipping side chains
+REDUCE = ["phenix.reduce", "-NOFLIP", "-Quiet"]
+REDUCE_SUFFIX = "_reduceH.pdb"
+BASELINE_SUFFIX = ".clash_baseline.npz"
+CALIBRATION_GLOBS = {
+    'bp': ("*_bp.pdb", "_bp.pdb", "_clashscore_local_bp.txt"),
+    'neighbour': ("*_bp_plus1.pdb", "_bp_plus1.pdb", "_clashscore_local_neighbours.txt"),
+}
+
+# -------------------------
+# Neighbour search
+# -------------------------
+class SpatialIndex:
+    """Fixed-radius queries over points: a cKDTree, or a grid of cubic cells without scipy."""
+    def __init__(self, xyz, cell=GRID_CELL):
+        self.xyz = xyz
+        self.tree = cKDTree(xyz) if cKDTree is not None and len(xyz) else None
+        self.cell = cell
+        self.cells = None
+
+    def _grid(self):
+        if self.cells is None:
+            self.cells = {}
+            for i, c in enumerate(map(tuple, np.floor(self.xyz / self.cell).astype(np.int64).tolist())):
+                self.cells.setdefault(c, []).append(i)
+        return self.cells
+
+    def _offsets(self, r):
+        k = int(np.ceil(r / self.cell))
+        return [(dx, dy, dz) for dx in range(-k, k + 1) for dy in range(-k, k + 1) for dz in range(-k, k + 1)]
+
+    def pairs(self, r):
+        """(n, 2) array of index pairs i < j of points closer than r."""
+        if len(self.xyz) < 2:
+            return np.empty((0, 2), dtype=np.intp)
+        if self.tree is not None:
+            return self.tree.query_pairs(r, output_type="ndarray")
+        return self._grid_pairs(r)
+
+    def _grid_pairs(self, r):
+        """pairs() without scipy: atoms sorted by cell, each cell paired with itself and half of its neighbours."""
+        cell = np.floor(self.xyz / max(r, self.cell)).astype(np.int64)
+        cell -= cell.min(axis=0) - 1
+        span = cell.max(axis=0) + 2
+        ids = (cell[:, 0] * span[1] + cell[:, 1]) * span[2] + cell[:, 2]
+        order = np.argsort(ids, kind="stable")
+        cells, starts, counts = np.unique(ids[order], return_index=True, return_counts=True)
+
+        found = []
+        offsets = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+        for dx, dy, dz in offsets[13:]:  # (0, 0, 0) and the 13 offsets after it
+            pos = np.searchsorted(cells, cells + (dx * span[1] + dy) * span[2] + dz)
+            pos = np.minimum(pos, len(cells) - 1)
+            a = np.flatnonzero(cells[pos] == cells + (dx * span[1] + dy) * span[2] + dz)
+            b = pos[a]
+            sizes = counts[a] * counts[b]
+            if not sizes.sum():
+                continue
+            local = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            nb = np.repeat(counts[b], sizes)
+            ii = order[np.repeat(starts[a], sizes) + local // nb]
+            jj = order[np.repeat(starts[b], sizes) + local % nb]
+            keep = np.sum((self.xyz[ii] - self.xyz[jj]) ** 2, axis=1) < r * r
+            if (dx, dy, dz) == (0, 0, 0):
+                keep &= ii < jj
+            found.append(np.sort(np.column_stack([ii[keep], jj[keep]]), axis=1))
+        if not found:
+            return np.empty((0, 2), dtype=np.intp)
+        return np.concatenate(found)
+
+    def ball(self, idx, r):
+        """For each point idx, the indices of the points closer than r (itself included)."""
+        if self.tree is not None:
+            return [np.asarray(n, dtype=np.intp) for n in self.tree.query_ball_point(self.xyz[idx], r)]
+        cells = self._grid()
+        out = []
+        for i in idx:
+            cx, cy, cz = np.floor(self.xyz[i] / self.cell).astype(np.int64).tolist()
+            near = [j for dx, dy, dz in self._offsets(r) for j in cells.get((cx + dx, cy + dy, cz + dz), ())]
+            near = np.array(near, dtype=np.intp)
+            out.append(near[np.sum((self.xyz[near] - self.xyz[i]) ** 2, axis=1) < r * r])
+        return out
+
+def pairs_within(xyz, r):
+    """(n, 2) array of index pairs i < j of points closer than r."""
+    return SpatialIndex(np.asarray(xyz, dtype=float), max(r, GRID_CELL)).pairs(r)
+
+# -------------------------
+# Atom set
+# -------------------------
+class AtomSet:
+    """
+    Coordinates, elements and alternate locations of a set of atoms.  Bonds
+    (and so polar hydrogens) are inferred from distances on demand, for the
+    atoms of candidate clashes only.
+    """
+    def __init__(self, xyz, element, altloc, labels=None):
+        self.xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+        self.element = np.asarray(element)
+        self.altloc = np.asarray(altloc)
+        self.labels = labels if labels is not None else [str(i) for i in range(len(self.xyz))]
+        self.space = SpatialIndex(self.xyz)
+        # radius of every atom before the polar hydrogen correction (an upper bound)
+        self.base_radius = np.array([VDW_RADII.get(e, DEFAULT_RADIUS) for e in self.element.tolist()])
+        self.covalent = np.array([COVALENT_RADII.get(e, 0.0) for e in self.element.tolist()])
+        self.max_covalent = self.covalent.max() if len(self) else 0.0
+        self.acceptor = np.isin(self.element, ACCEPTORS)
+        self._bonds = {}
+
+    @classmethod
+    def from_index(cls, index, idx=slice(None)):
+        """Atoms idx (slice or index array) of a StructureIndex."""
+        labels = [f"{c}{r} {n}{a}" for c, r, n, a in zip(index.chain[idx].tolist(), index.resseq[idx].tolist(),
+                                                         index.name[idx].tolist(), index.altloc[idx].tolist())]
+        return cls(index.xyz[idx], index.element[idx], index.altloc[idx], labels)
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def compatible(self, i, j):
+        """Boolean array: atom pairs that can coexist (same or blank alternate location)."""
+        a, b = self.altloc[i], self.altloc[j]
+        return (a == "") | (b == "") | (a == b)
+
+    def bonded(self, i):
+        """Atoms covalently bonded to atom i."""
+        if i not in self._bonds:
+            cov = self.covalent
+            if cov[i] == 0:
+                self._bonds[i] = []
+            else:
+                near = self.space.ball([i], cov[i] + self.max_covalent + BOND_TOLERANCE)[0]
+                d = np.linalg.norm(self.xyz[near] - self.xyz[i], axis=1)
+                ok = ((cov[near] > 0) & (d > 0.4) & (d < cov[i] + cov[near] + BOND_TOLERANCE)
+                      & self.compatible(np.full(len(near), i), near))
+                self._bonds[i] = near[ok].tolist()
+        return self._bonds[i]
+
+    def polar_h(self, idx):
+        """Boolean array: which atoms of idx are hydrogens bonded to N or O."""
+        polar = np.zeros(len(idx), dtype=bool)
+        for n in np.flatnonzero(self.element[idx] == "H").tolist():
+            polar[n] = any(self.acceptor[j] for j in self.bonded(int(idx[n])))
+        return polar
+
+    def within_bonds(self, i, depth=BOND_SEPARATION):
+        """Atoms at most depth bonds away from atom i (including i)."""
+        seen = {i: 0}
+        queue = deque([i])
+        while queue:
+            a = queue.popleft()
+            if seen[a] == depth:
+                continue
+            for b in self.bonded(a):
+                if b not in seen:
+                    seen[b] = seen[a] + 1
+                    queue.append(b)
+        return seen
+
+    def contacts(self, subset=None, candidates=None):
+        """
+        Serious clashes as an (n, 2) index array with their overlaps.  With
+        subset (index array), only pairs with at least one atom in it are
+        searched; candidates ((n, 2) array) are checked in addition.
+        """
+        if len(self) < 2:
+            return np.empty((0, 2), dtype=np.intp), np.empty(0)
+        cutoff = 2 * self.base_radius.max() - CLASH_OVERLAP
+        if subset is None:
+            pairs = self.space.pairs(cutoff)
+        else:
+            pairs = self._pairs_touching(np.asarray(subset, dtype=np.intp), cutoff)
+        if candidates is not None and len(candidates):
+            pairs = np.unique(np.concatenate([pairs, np.sort(candidates, axis=1)]), axis=0)
+        return self.serious(pairs)
+
+    def serious(self, pairs):
+        """The pairs of (n, 2) index array pairs that are serious clashes, with their overlaps."""
+        if len(pairs) == 0:
+            return np.empty((0, 2), dtype=np.intp), np.empty(0)
+        i, j = pairs[:, 0], pairs[:, 1]
+        d = np.linalg.norm(self.xyz[i] - self.xyz[j], axis=1)
+        # cheap bound first: without the polar hydrogen radius, nothing else can clash
+        near = (self.base_radius[i] + self.base_radius[j] - d >= CLASH_OVERLAP) & self.compatible(i, j)
+        i, j, d = i[near], j[near], d[near]
+
+        polar_i, polar_j = self.polar_h(i), self.polar_h(j)
+        radius_i = np.where(polar_i, POLAR_H_RADIUS, self.base_radius[i])
+        radius_j = np.where(polar_j, POLAR_H_RADIUS, self.base_radius[j])
+        overlap = radius_i + radius_j - d
+        hbond = (polar_i & self.acceptor[j]) | (polar_j & self.acceptor[i])
+        clash = overlap >= np.where(hbond, HBOND_OVERLAP, CLASH_OVERLAP)
+        i, j, overlap = i[clash], j[clash], overlap[clash]
+
+        reach = {}
+        keep = np.ones(len(i), dtype=bool)
+        for n, (a, b) in enumerate(zip(i.tolist(), j.tolist())):
+            if a not in reach:
+                reach[a] = self.within_bonds(a)
+            keep[n] = b not in reach[a]
+        return np.column_stack([i[keep], j[keep]]), overlap[keep]
+
+    def _pairs_touching(self, subset, cutoff):
+        """Pairs i < j closer than cutoff with i or j in subset."""
+        if len(subset) == 0:
+            return np.empty((0, 2), dtype=np.intp)
+        found = self.space.ball(subset, cutoff)
+        sizes = [len(n) for n in found]
+        pairs = np.column_stack([np.repeat(subset, sizes), np.concatenate(found)])
+        pairs = np.sort(pairs[pairs[:, 0] != pairs[:, 1]], axis=1)
+        return np.unique(pairs, axis=0)
+
+    def clashscore(self):
+        """Serious clashes per 1000 atoms (None for an empty set)."""
+        if len(self) == 0:
+            return None
+        pairs, _ = self.contacts()
+        return 1000.0 * len(pairs) / len(self)
+
+# -------------------------
+# Contact baseline
+# -------------------------
+def atom_keys(index):
+    """(chain, resseq, icode, altloc, name) of every atom of a StructureIndex."""
+    return list(zip(index.chain.tolist(), index.resseq.tolist(), index.icode.tolist(),
+                    index.altloc.tolist(), index.name.tolist()))
+
+def unique_lookup(keys):
+    """{key: position} for the keys that occur exactly once."""
+    lookup = {}
+    for n, key in enumerate(keys):
+        lookup[key] = -1 if key in lookup else n
+    return {k: n for k, n in lookup.items() if n >= 0}
+
+class ContactBaseline:
+    """
+    Close contacts of the deposited model of a structure, for rescoring its
+    refined models: every atom pair that could still clash after each of its
+    atoms moved by up to `tolerance`, judged with the upper-bound radii.
+    """
+    def __init__(self, keys, xyz, pairs, tolerance):
+        self.keys = keys
+        self.xyz = xyz
+        self.pairs = pairs
+        self.tolerance = tolerance
+        self.lookup = unique_lookup(keys)
+
+    @classmethod
+    def build(cls, index, tolerance=MOVE_TOLERANCE):
+        atoms = AtomSet.from_index(index)
+        r = atoms.base_radius
+        margin = CLASH_OVERLAP - 2 * tolerance
+        pairs = atoms.space.pairs(2 * r.max() - margin) if len(atoms) > 1 else np.empty((0, 2), dtype=np.intp)
+        i, j = pairs[:, 0], pairs[:, 1]
+        keep = r[i] + r[j] - np.linalg.norm(atoms.xyz[i] - atoms.xyz[j], axis=1) >= margin
+        return cls(atom_keys(index), atoms.xyz.copy(), pairs[keep], tolerance)
+
+    def save(self, path, stamp):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, stamp=np.array(stamp, dtype=np.int64), tolerance=self.tolerance,
+                     keys=np.array([tuple(map(str, k)) for k in self.keys], dtype="U8").reshape(-1, 5),
+                     xyz=self.xyz, pairs=self.pairs)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, stamp, tolerance):
+        """The baseline saved at path, or None if it belongs to another file version or tolerance."""
+        try:
+            with np.load(path) as data:
+                if tuple(data['stamp'].tolist()) != tuple(stamp) or float(data['tolerance']) != tolerance:
+                    return None
+                keys = [(c, int(r), i, a, n) for c, r, i, a, n in data['keys'].tolist()]
+                return cls(keys, data['xyz'], data['pairs'], tolerance)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def rescore(self, index):
+        """
+        Clashscore of a refined model of the structure: contacts of atoms that
+        moved more than the tolerance (or are new) are searched again, the
+        baseline pairs between the other atoms are re-checked at their new
+        positions.  Return (clashscore or None, atoms searched again).
+        """
+        model = AtomSet.from_index(index)
+        if len(model) == 0:
+            return None, 0
+        lookup = unique_lookup(atom_keys(index))
+        mapped = np.full(len(model), -1, dtype=np.intp)
+        for key, n in lookup.items():
+            mapped[n] = self.lookup.get(key, -1)
+        moved = mapped < 0
+        still = np.flatnonzero(~moved)
+        displaced = np.linalg.norm(model.xyz[still] - self.xyz[mapped[still]], axis=1) > self.tolerance
+        moved[still[displaced]] = True
+        still = still[~displaced]
+
+        to_model = np.full(len(self.keys), -1, dtype=np.intp)
+        to_model[mapped[still]] = still
+        if len(self.pairs):
+            bi, bj = to_model[self.pairs[:, 0]], to_model[self.pairs[:, 1]]
+            ok = (bi >= 0) & (bj >= 0)
+            candidates = np.column_stack([bi[ok], bj[ok]])
+        else:
+            candidates = None
+        pairs, _ = model.contacts(subset=np.flatnonzero(moved), candidates=candidates)
+        return 1000.0 * len(pairs) / len(model), int(moved.sum())
+
+def baseline_for(pdb_file, tolerance=MOVE_TOLERANCE):
+    """
+    The ContactBaseline of pdb_file, saved next to the file it resolves to
+    (so the pairs of a structure staged by batch_run.py share one) and
+    rebuilt when the file changes.
+    """
+    real = os.path.realpath(pdb_file)
+    st = os.stat(real)
+    stamp = (st.st_size, st.st_mtime_ns)
+    path = real + BASELINE_SUFFIX
+    baseline = ContactBaseline.load(path, stamp, tolerance) if os.path.exists(path) else None
+    if baseline is None:
+        baseline = ContactBaseline.build(structure_index.load(real), tolerance)
+        try:
+            baseline.save(path, stamp)
+        except OSError:
+            pass
+    return baseline
+
+def global_clashscore(model_file, reference_file, tolerance=MOVE_TOLERANCE):
+    """
+    Clashscore of the whole model_file with Reduce hydrogens added, rescored
+    against the baseline of reference_file with hydrogens added the same way.
+    Raise OSError if Reduce fails on either.
+    """
+    # The reference's copy goes next to the file it resolves to, like its baseline
+    real = os.path.realpath(reference_file)
+    if not os.access(os.path.dirname(real), os.W_OK):
+        real = reference_file
+    hydrogens = {path: add_hydrogens(path) for path in (model_file, real)}
+    for path, out in hydrogens.items():
+        if out is None:
+            raise OSError(f"no hydrogens added to {path}")
+    return baseline_for(hydrogens[real], tolerance).rescore(structure_index.load(hydrogens[model_file]))
+
+# -------------------------
+# Helpers
+# -------------------------
+def hydrogen_model_path(pdb_file):
+    return pdb_file[:-len(".pdb")] + REDUCE_SUFFIX if pdb_file.endswith(".pdb") else pdb_file + REDUCE_SUFFIX
+
+def add_hydrogens(pdb_file, out=None):
+    """
+    Write pdb_file with hydrogens added by Reduce to out (default
+    hydrogen_model_path()), unless an up-to-date one is there.  Return the
+    path, or None if Reduce failed.
+    """
+    out = out or hydrogen_model_path(pdb_file)
+    if os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(pdb_file):
+        return out
+    tmp = f"{out}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            # Reduce's exit code is not a reliable success flag; its output is checked instead
+            instrument.run(REDUCE + [pdb_file], stdout=f, stderr=subprocess.DEVNULL)
+        with open(tmp) as f:
+            ok = any(line.startswith(("ATOM  ", "HETATM")) for line in f)
+    except OSError as e:
+        print(f" Error running {REDUCE[0]} on {pdb_file}: {e}", file=sys.stderr)
+        ok = False
+    if not ok:
+        print(f" Error: {REDUCE[0]} wrote no model for {pdb_file}", file=sys.stderr)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+    os.replace(tmp, out)
+    return out
+
+def select(index, residues):
+    """Index array of the atoms of residues [(chain, resseq), ...] of a StructureIndex, in file order."""
+    parts = [np.arange(len(index))[index.atoms(chain, resseq)] for chain, resseq in residues]
+    if not parts:
+        return np.empty(0, dtype=np.intp)
+    return np.unique(np.concatenate(parts))
+
+def local_clashscores(pdb_file, selections):
+    """
+    {name: clashscore of the residues [(chain, resseq), ...] scored on their own} for one model
+    (the hydrogen-added copy, see add_hydrogens()).
+    """
+    index = structure_index.load(pdb_file)
+    return {name: AtomSet.from_index(index, select(index, residues)).clashscore()
+            for name, residues in selections.items()}
+
+def write_clashscore(txt_path, score, detail=""):
+    """Write a score in the format of phenix.clashscore output (read by Clashes.extract_clashscore)."""
+    with open(txt_path, "w") as f:
+        f.write(f"{ENGINE_TAG} {detail}\n".rstrip() + "\n")
+        if score is not None:
+            f.write(f"clashscore = {score:.2f}\n")
+
+def is_engine_output(txt_path):
+    with open(txt_path) as f:
+        return f.readline().startswith(ENGINE_TAG)
+
+def selection_residues(pdb_file):
+    """[(chain, resseq)] of the residues of a saved selection PDB."""
+    index = structure_index.load(pdb_file)
+    return sorted(set(zip(index.chain.tolist(), index.resseq.tolist())))
+
+def state_model(pdb):
+    """The refined model a selection PDB in <tuple>/<state>/ was cut from, or None."""
+    import Clashes
+
+    state_dir = os.path.dirname(pdb)
+    pdbid = os.path.basename(os.path.dirname(state_dir)).split("_")[0]
+    name = {'WC': Clashes.WC_PDB_NAME, 'HG': Clashes.HG_PDB_NAME}.get(os.path.basename(state_dir))
+    path = os.path.join(state_dir, name.format(pdbid=pdbid)) if name else None
+    return path if path and os.path.exists(path) else None
+
+def calibrate(roots):
+    """
+    For every saved selection PDB under roots with a phenix.clashscore output
+    next to it, score the same residues as a --clash-engine run does (on the
+    hydrogen-added refined model of the state) and print engine vs Phenix.
+    Return the list of (kind, pdb, phenix, engine).
+    """
+    from Clashes import extract_clashscore
+
+    results = []
+    for root in roots:
+        for kind, (pattern, pdb_suffix, txt_suffix) in CALIBRATION_GLOBS.items():
+            for pdb in sorted(glob.glob(os.path.join(root, "*", "*", pattern))):
+                if kind == 'bp' and pdb.endswith(CALIBRATION_GLOBS['neighbour'][1]):
+                    continue
+                txt = pdb[:-len(pdb_suffix)] + txt_suffix
+                if not os.path.exists(txt) or is_engine_output(txt):
+                    continue
+                phenix = extract_clashscore(txt)
+                model = state_model(pdb)
+                if phenix is None or model is None:
+                    continue
+                hydrogens = add_hydrogens(model)
+                if hydrogens is None:
+                    continue
+                scores = local_clashscores(hydrogens, {kind: selection_residues(pdb)})
+                results.append((kind, pdb, phenix, scores[kind]))
+
+    for kind, pdb, phenix, engine in results:
+        engine_text = "None" if engine is None else f"{engine:.2f}"
+        print(f"{kind:9s} {phenix:8.2f} {engine_text:>8s}  {pdb}")
+    for kind in CALIBRATION_GLOBS:
+        diff = np.array([e - p for k, _, p, e in results if k == kind and e is not None])
+        if len(diff):
+            print(f" {kind}: {len(diff)} selections, mean difference {diff.mean():+.2f}, "
+                  f"mean |difference| {np.abs(diff).mean():.2f}, max |difference| {np.abs(diff).max():.2f}")
+    if not results:
+        print(" No phenix.clashscore outputs found to calibrate against", file=sys.stderr)
+    return results
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--calibrate":
+        calibrate(sys.argv[2:] or ["PDB_without_nt"])
+        sys.exit(0)
+
+    if len(sys.argv) == 4 and sys.argv[1] == "--global":
+        try:
+            score, searched = global_clashscore(sys.argv[2], sys.argv[3])
+        except OSError as e:
+            print(f" Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"{searched} atoms searched again")
+        print(f"clashscore = {'None' if score is None else f'{score:.2f}'}")
+        sys.exit(0)
+
+    if len(sys.argv) < 4 or len(sys.argv) % 2:
+        print("Usage: python3 clash_engine.py <pdb_file> <chain> <resseq> [<chain> <resseq> ...]", file=sys.stderr)
+        sys.exit(1)
+
+    index = structure_index.load(sys.argv[1])
+    residues = [(sys.argv[i], int(sys.argv[i + 1])) for i in range(2, len(sys.argv), 2)]
+    atoms = AtomSet.from_index(index, select(index, residues))
+    pairs, overlap = atoms.contacts()
+    print(f"{len(atoms)} atoms, {len(pairs)} serious clashes")
+    for (a, b), o in zip(pairs.tolist(), overlap.tolist()):
+        print(f"  {atoms.labels[a]} - {atoms.labels[b]}  overlap {o:.2f}")
+    score = atoms.clashscore()
+    print(f"clashscore = {'None' if score is None else f'{score:.2f}'}")
@@ -4,6 +4,8 @@ import sys
 import pandas as pd
 import numpy as np
 
+import metrics_store
+
 
 SUMMARY_FILES = {
     'bfactor': 'classification_files/Bfactor_summary.txt',
@@ -27,6 +29,27 @@ EXPECTED_COLUMNS = [
     'mean_B_HG', 'mean_B_WC'
 ]
 
+KEY_COLUMNS = ['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 'chain_2', 'nt_type_2', 'nt_number_2']
+
+# Metric columns taken from each summary file
+METRIC_COLUMNS = {
+    'rvalues': ['r_total_WC', 'r_work_WC', 'r_free_WC', 'r_total_HG', 'r_work_HG', 'r_free_HG'],
+    'rscc': ['RSCC_WC', 'RSCC_HG'],
+    'edia': ['WC_edia', 'HG_edia'],
+    'clashscore': ['WC_clashscore_global', 'HG_clashscore_global',
+                   'WC_clashscore_bp', 'HG_clashscore_bp',
+                   'WC_clashscore_neighbour', 'HG_clashscore_neighbour'],
+    'bfactor': ['mean_B_HG', 'mean_B_WC'],
+}
+
+# delta column: (WC column, HG column)
+DELTA_COLUMNS = {
+    'delta_RSCC': ('RSCC_WC', 'RSCC_HG'),
+    'delta_edia': ('WC_edia', 'HG_edia'),
+    'delta_clashscore_bp': ('WC_clashscore_bp', 'HG_clashscore_bp'),
+    'delta_clashscore_neighbour': ('WC_clashscore_neighbour', 'HG_clashscore_neighbour'),
+}
+
 # -------------------------
 # Helper Functions
 # -------------------------
@@ -53,261 +76,134 @@ def safe_subtract(val1, val2):
     except:
         return None
 
-def get_value_from_df(df, pdb_id, chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2, column):
-    """Get a specific value from a dataframe based on the key columns."""
-    if df is None or column not in df.columns:
-        return None
-    
-    mask = (
-        (df['pdb_id'] == pdb_id) &
-        (df['chain_1'] == chain_1) &
-        (df['nt_type_1'] == nt_type_1) &
-        (df['nt_number_1'] == nt_number_1) &
-        (df['chain_2'] == chain_2) &
-        (df['nt_type_2'] == nt_type_2) &
-        (df['nt_number_2'] == nt_number_2)
-    )
-    
-    matches = df.loc[mask, column]
-    if len(matches) > 0:
-        val = matches.iloc[0]
-        return None if pd.isna(val) else val
-    return None
-
 def create_combined_table():
-    """Create the combined table from all summary files."""
+    """
+    Create the combined table from all summary files.
+    Each summary file is joined once on the key columns (first row of a key wins)
+    and the deltas are computed as column arithmetic, with NaN where either side is missing.
+    """
     
     # Read all summary files
-    df_bfactor = read_summary_file(SUMMARY_FILES['bfactor'])
-    df_clashscore = read_summary_file(SUMMARY_FILES['clashscore'])
-    df_edia = read_summary_file(SUMMARY_FILES['edia'])
-    df_rscc = read_summary_file(SUMMARY_FILES['rscc'])
-    df_rvalues = read_summary_file(SUMMARY_FILES['rvalues'])
+    frames = {source: read_summary_file(path) for source, path in SUMMARY_FILES.items()}
     
     # Check if at least one file exists
-    if all(df is None for df in [df_bfactor, df_clashscore, df_edia, df_rscc, df_rvalues]):
+    if all(df is None for df in frames.values()):
         print(" Error: No summary files found", file=sys.stderr)
         return False
     
     # Start with the first available dataframe as base
     base_df = None
-    for df in [df_rvalues, df_rscc, df_edia, df_clashscore, df_bfactor]:
-        if df is not None:
-            base_df = df[['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                          'chain_2', 'nt_type_2', 'nt_number_2']].copy()
+    for source in ['rvalues', 'rscc', 'edia', 'clashscore', 'bfactor']:
+        if frames[source] is not None:
+            base_df = frames[source][KEY_COLUMNS].drop_duplicates()
             break
     
     if base_df is None:
         print(" Error: Could not establish base dataframe", file=sys.stderr)
         return False
     
-    # Initialize result dataframe with base columns
-    result_df = base_df.copy()
-    
-    # Add R-values columns
-    if df_rvalues is not None:
-        for col in ['r_total_WC', 'r_work_WC', 'r_free_WC', 'r_total_HG', 'r_work_HG', 'r_free_HG']:
-            if col in df_rvalues.columns:
-                result_df = result_df.merge(
-                    df_rvalues[['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                               'chain_2', 'nt_type_2', 'nt_number_2', col]],
-                    on=['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                        'chain_2', 'nt_type_2', 'nt_number_2'],
-                    how='left'
-                )
-    
-    # Add RSCC columns
-    if df_rscc is not None:
-        for col in ['RSCC_WC', 'RSCC_HG']:
-            if col in df_rscc.columns:
-                result_df = result_df.merge(
-                    df_rscc[['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                            'chain_2', 'nt_type_2', 'nt_number_2', col]],
-                    on=['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                        'chain_2', 'nt_type_2', 'nt_number_2'],
-                    how='left'
-                )
-    
-    # Add EDIA columns
-    if df_edia is not None:
-        for col in ['WC_edia', 'HG_edia']:
-            if col in df_edia.columns:
-                result_df = result_df.merge(
-                    df_edia[['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                            'chain_2', 'nt_type_2', 'nt_number_2', col]],
-                    on=['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                        'chain_2', 'nt_type_2', 'nt_number_2'],
-                    how='left'
-                )
-    
-    # Add Clashscore columns
-    if df_clashscore is not None:
-        for col in ['WC_clashscore_global', 'HG_clashscore_global', 
-                    'WC_clashscore_bp', 'HG_clashscore_bp',
-                    'WC_clashscore_neighbour', 'HG_clashscore_neighbour']:
-            if col in df_clashscore.columns:
-                result_df = result_df.merge(
-                    df_clashscore[['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                                  'chain_2', 'nt_type_2', 'nt_number_2', col]],
-                    on=['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                        'chain_2', 'nt_type_2', 'nt_number_2'],
-                    how='left'
-                )
-    
-    # Add B-factor columns
-    if df_bfactor is not None:
-        for col in ['mean_B_HG', 'mean_B_WC']:
-            if col in df_bfactor.columns:
-                result_df = result_df.merge(
-                    df_bfactor[['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                               'chain_2', 'nt_type_2', 'nt_number_2', col]],
-                    on=['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                        'chain_2', 'nt_type_2', 'nt_number_2'],
-                    how='left'
-                )
-    
-    # Remove duplicate rows
-    result_df = result_df.drop_duplicates(
-        subset=['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 
-                'chain_2', 'nt_type_2', 'nt_number_2']
-    )
+    # One keyed join per summary file
+    result_df = base_df
+    for source in ['rvalues', 'rscc', 'edia', 'clashscore', 'bfactor']:
+        df = frames[source]
+        if df is None:
+            continue
+        cols = [col for col in METRIC_COLUMNS[source] if col in df.columns]
+        if not cols:
+            continue
+        right = df[KEY_COLUMNS + cols].drop_duplicates(subset=KEY_COLUMNS)
+        result_df = result_df.merge(right, on=KEY_COLUMNS, how='left')
     
     # Calculate difference columns
-    if 'RSCC_WC' in result_df.columns and 'RSCC_HG' in result_df.columns:
-        result_df['delta_RSCC'] = result_df.apply(
-            lambda row: safe_subtract(row['RSCC_WC'], row['RSCC_HG']), axis=1
-        )
-    
-    if 'WC_edia' in result_df.columns and 'HG_edia' in result_df.columns:
-        result_df['delta_edia'] = result_df.apply(
-            lambda row: safe_subtract(row['WC_edia'], row['HG_edia']), axis=1
-        )
+    for delta, (wc_col, hg_col) in DELTA_COLUMNS.items():
+        if wc_col in result_df.columns and hg_col in result_df.columns:
+            result_df[delta] = (pd.to_numeric(result_df[wc_col], errors='coerce')
+                                - pd.to_numeric(result_df[hg_col], errors='coerce'))
     
-    if 'WC_clashscore_bp' in result_df.columns and 'HG_clashscore_bp' in result_df.columns:
-        result_df['delta_clashscore_bp'] = result_df.apply(
-            lambda row: safe_subtract(row['WC_clashscore_bp'], row['HG_clashscore_bp']), axis=1
-        )
-    
-    if 'WC_clashscore_neighbour' in result_df.columns and 'HG_clashscore_neighbour' in result_df.columns:
-        result_df['delta_clashscore_neighbour'] = result_df.apply(
-            lambda row: safe_subtract(row['WC_clashscore_neighbour'], row['HG_clashscore_neighbour']), axis=1
-        )
-    
-    # Ensure all expected columns exist
-    for col in EXPECTED_COLUMNS:
-        if col not in result_df.columns:
-            result_df[col] = None
-    
-    # Reorder columns
-    result_df = result_df[EXPECTED_COLUMNS]
+    # Ensure all expected columns exist, in order
+    result_df = result_df.reindex(columns=EXPECTED_COLUMNS)
     
     # Write to output file
     result_df.to_csv(OUT_COMBINED, sep=' ', index=False, na_rep='None')
     
     return True
 
+def append_combined_line(values):
+    """Append one row to the flat combined table, writing the header if the file is new."""
+    new_file = not os.path.exists(OUT_COMBINED)
+    with open(OUT_COMBINED, "a") as f:
+        if new_file:
+            f.write(" ".join(EXPECTED_COLUMNS) + "\n")
+        f.write(metrics_store.format_line(values))
+
 def add_or_update_entry(pdb_id, chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2):
-    """Add or update a single entry in the combined metrics table."""
+    """
+    Add or update a single entry in the combined metrics store.
+    New keys are also appended to the flat combined table; updates of existing
+    keys only reach the flat file through an explicit export (--export).
+    """
     
     # Create output directory if needed
     os.makedirs("classification_files", exist_ok=True)
-    
-    # Check if combined table exists
-    if not os.path.exists(OUT_COMBINED):
-        print(f" Combined table not found at {OUT_COMBINED}")
-        if not create_combined_table():
-            print(" Failed to create combined table", file=sys.stderr)
+    conn = metrics_store.connect()
+
+    # First use: seed the store from the flat table, building it if needed.
+    # Without any summary file (every metric stage of the pair was skipped)
+    # there is nothing to seed and the pair's row of missing values starts the table.
+    has_summaries = any(os.path.exists(path) for path in SUMMARY_FILES.values())
+    if not metrics_store.has_combined(conn) and (has_summaries or os.path.exists(OUT_COMBINED)):
+        if not os.path.exists(OUT_COMBINED):
+            print(f" Combined table not found at {OUT_COMBINED}")
+            if not create_combined_table():
+                print(" Failed to create combined table", file=sys.stderr)
+                sys.exit(1)
+        try:
+            metrics_store.import_combined_file(conn, OUT_COMBINED, EXPECTED_COLUMNS)
+        except Exception as e:
+            print(f" Error reading combined table: {e}", file=sys.stderr)
             sys.exit(1)
     
-    # Read existing combined table
-    try:
-        combined_df = pd.read_csv(OUT_COMBINED, sep=r'\s+')
-    except Exception as e:
-        print(f" Error reading combined table: {e}", file=sys.stderr)
-        sys.exit(1)
-    
-    # Read all summary files
-    df_bfactor = read_summary_file(SUMMARY_FILES['bfactor'])
-    df_clashscore = read_summary_file(SUMMARY_FILES['clashscore'])
-    df_edia = read_summary_file(SUMMARY_FILES['edia'])
-    df_rscc = read_summary_file(SUMMARY_FILES['rscc'])
-    df_rvalues = read_summary_file(SUMMARY_FILES['rvalues'])
-    
-    # Build the new row
-    new_row = {
-        'pdb_id': pdb_id,
-        'chain_1': chain_1,
-        'nt_type_1': nt_type_1,
-        'nt_number_1': nt_number_1,
-        'chain_2': chain_2,
-        'nt_type_2': nt_type_2,
-        'nt_number_2': nt_number_2,
-    }
+    # Read only what was appended to the summary files since the last call
+    metrics_store.ingest_summaries(conn, SUMMARY_FILES)
+    key = metrics_store.key_tuple(pdb_id, chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2)
     
-    # Get R-values
-    for col in ['r_total_WC', 'r_work_WC', 'r_free_WC', 'r_total_HG', 'r_work_HG', 'r_free_HG']:
-        new_row[col] = get_value_from_df(df_rvalues, pdb_id, chain_1, nt_type_1, nt_number_1, 
-                                         chain_2, nt_type_2, nt_number_2, col)
-    
-    # Get RSCC
-    for col in ['RSCC_WC', 'RSCC_HG']:
-        new_row[col] = get_value_from_df(df_rscc, pdb_id, chain_1, nt_type_1, nt_number_1, 
-                                         chain_2, nt_type_2, nt_number_2, col)
-    
-    # Get EDIA
-    for col in ['WC_edia', 'HG_edia']:
-        new_row[col] = get_value_from_df(df_edia, pdb_id, chain_1, nt_type_1, nt_number_1, 
-                                         chain_2, nt_type_2, nt_number_2, col)
-    
-    # Get Clashscores
-    for col in ['WC_clashscore_global', 'HG_clashscore_global', 
-                'WC_clashscore_bp', 'HG_clashscore_bp',
-                'WC_clashscore_neighbour', 'HG_clashscore_neighbour']:
-        new_row[col] = get_value_from_df(df_clashscore, pdb_id, chain_1, nt_type_1, nt_number_1, 
-                                         chain_2, nt_type_2, nt_number_2, col)
-    
-    # Get B-factors
-    for col in ['mean_B_HG', 'mean_B_WC']:
-        new_row[col] = get_value_from_df(df_bfactor, pdb_id, chain_1, nt_type_1, nt_number_1, 
-                                         chain_2, nt_type_2, nt_number_2, col)
+    # Build the new row: recorded results first, then rows of summary files written by other tools
+    new_row = dict(zip(metrics_store.KEY_COLUMNS, key))
+    for source, columns in METRIC_COLUMNS.items():
+        found = (metrics_store.get_result(conn, source, key)
+                 or metrics_store.get_summary_row(conn, source, key) or {})
+        for col in columns:
+            new_row[col] = found.get(col)
     
     # Calculate deltas
-    new_row['delta_RSCC'] = safe_subtract(new_row.get('RSCC_WC'), new_row.get('RSCC_HG'))
-    new_row['delta_edia'] = safe_subtract(new_row.get('WC_edia'), new_row.get('HG_edia'))
-    new_row['delta_clashscore_bp'] = safe_subtract(new_row.get('WC_clashscore_bp'), new_row.get('HG_clashscore_bp'))
-    new_row['delta_clashscore_neighbour'] = safe_subtract(new_row.get('WC_clashscore_neighbour'), new_row.get('HG_clashscore_neighbour'))
-    
-    # Check if entry already exists
-    mask = (
-        (combined_df['pdb_id'] == pdb_id) &
-        (combined_df['chain_1'] == chain_1) &
-        (combined_df['nt_type_1'] == nt_type_1) &
-        (combined_df['nt_number_1'] == nt_number_1) &
-        (combined_df['chain_2'] == chain_2) &
-        (combined_df['nt_type_2'] == nt_type_2) &
-        (combined_df['nt_number_2'] == nt_number_2)
-    )
+    for delta, (wc_col, hg_col) in DELTA_COLUMNS.items():
+        diff = safe_subtract(new_row.get(wc_col), new_row.get(hg_col))
+        new_row[delta] = None if diff is None else float(diff)
     
-    if mask.any():
-        # Update existing entry
-        for col, val in new_row.items():
-            combined_df.loc[mask, col] = val
-
+    # Upsert; only brand-new keys are appended to the flat file
+    if metrics_store.upsert_combined(conn, new_row, EXPECTED_COLUMNS):
+        append_combined_line([new_row.get(col) for col in EXPECTED_COLUMNS])
     else:
-        # Add new entry
-        new_df = pd.DataFrame([new_row])
-        combined_df = pd.concat([combined_df, new_df], ignore_index=True)
-    
-    # Ensure all expected columns exist
-    for col in EXPECTED_COLUMNS:
-        if col not in combined_df.columns:
-            combined_df[col] = None
-    
-    # Reorder columns
-    combined_df = combined_df[EXPECTED_COLUMNS]
-    
-    # Write back to file
-    combined_df.to_csv(OUT_COMBINED, sep=' ', index=False, na_rep='None')
+        print(f" Updated existing entry; run 'python3 combine_metrics.py --export' to refresh {OUT_COMBINED}")
+    conn.close()
+
+def reload_store_from_table():
+    """Replace the combined rows of the metrics store with the flat combined table."""
+    conn = metrics_store.connect()
+    conn.execute("DROP TABLE IF EXISTS combined")
+    metrics_store.import_combined_file(conn, OUT_COMBINED, EXPECTED_COLUMNS)
+    conn.close()
+
+def export_combined_table():
+    """Rewrite the flat combined table from the metrics store."""
+    if not os.path.exists(metrics_store.STORE_PATH):
+        print(f" Error: metrics store not found: {metrics_store.STORE_PATH}", file=sys.stderr)
+        return False
+    conn = metrics_store.connect()
+    n = metrics_store.export_combined(conn, OUT_COMBINED, EXPECTED_COLUMNS)
+    conn.close()
+    print(f" Exported {n} rows to {OUT_COMBINED}")
+    return True
 
 # -------------------------
 # Main
@@ -317,11 +213,16 @@ if __name__ == "__main__":
         # No arguments: create/rebuild entire combined table
         os.makedirs("classification_files", exist_ok=True)
         if create_combined_table():
-            None
+            reload_store_from_table()
         else:
             print("\n Failed to create combined metrics table", file=sys.stderr)
             sys.exit(1)
     
+    elif len(sys.argv) == 2 and sys.argv[1] == "--export":
+        # Rebuild the flat combined table from the metrics store
+        if not export_combined_table():
+            sys.exit(1)
+
     elif len(sys.argv) == 8:
         # 7 arguments: add/update single entry
         pdb_id = sys.argv[1]
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+EDIA of the purine in the WC and HG models, with a machine-wide cap on
+concurrent ediascorer runs.
+
+Replaces get_EDIA.sh, which ran ediascorer on the WC and then the HG model,
+found the tuple directory with a find over PDB_without_nt and scanned each
+*_001structurescores.csv with awk for one residue.  Here both states of a
+pair are scored at the same time, but every run first takes one of
+HG_EDIA_JOBS slots (lock files under HG_EDIA_SLOTS, shared by every process
+and thread of the machine), so concurrent pairs queue for a slot instead of
+exceeding the licence or memory.  Each scores file is read once into a
+ScoreTable indexed by (chain, residue number), which also serves the
+neighbours of the purine.
+
+Usage:
+    python3 edia_runner.py pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2
+    python3 edia_runner.py --table <structurescores.csv> <chain> <resseq> [--neighbours N]
+"""
+import os
+import csv
+import sys
+import time
+import fcntl
+import shutil
+import threading
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import rscc
+import instrument
+import metrics_store
+import tuple_archive
+
+# -------------------------
+# Config
+# -------------------------
+EDIA_BIN = os.environ.get("EDIA_BIN", "/home/sg4109/software/EDIA/ediascorer_1.1.0/ediascorer")
+EDIA_LICENSE = os.environ.get("EDIA_LICENSE", "AAAAAAAAljfUAAAAU2CEpBAtTlNi83vbDe9jtzbdHCo8=")
+
+# ediascorer runs allowed at once on this machine, and where their slots live
+MAX_JOBS = int(os.environ.get("HG_EDIA_JOBS", 2))
+SLOTS_DIR = os.environ.get("HG_EDIA_SLOTS", os.path.expanduser("~/.cache/hg_search/edia_slots"))
+POLL_SECONDS = 0.5
+
+STATES = {'WC': rscc.WC_STEM, 'HG': rscc.HG_STEM}
+OUT_DIR = "edia_out"
+SCORES_GLOB = "*_001structurescores.csv"
+LOG_NAME = "ediascorer_log.txt"
+
+# -------------------------
+# Slots
+# -------------------------
+@contextmanager
+def slot(max_jobs=MAX_JOBS, slots_dir=SLOTS_DIR):
+    """Wait for one of max_jobs lock files to be free and hold it (safe across processes and threads)."""
+    os.makedirs(slots_dir, exist_ok=True)
+    while True:
+        for k in range(max(1, max_jobs)):
+            fh = open(os.path.join(slots_dir, f"slot_{k}.lock"), "a")
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                fh.close()
+                continue
+            try:
+                yield k
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+                fh.close()
+            return
+        time.sleep(POLL_SECONDS)
+
+# -------------------------
+# Score tables
+# -------------------------
+class ScoreTable:
+    """Residue rows of an ediascorer structurescores CSV, indexed by (chain, residue number)."""
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}
+        with tuple_archive.open_file(path, newline="") as f:
+            for fields in csv.reader(f):
+                # r,<resname>,<resseq>,<chain>,<EDIAm>,...; the first row of a residue wins, as in the awk
+                if len(fields) > 4:
+                    self.rows.setdefault((fields[3].strip(), fields[2].strip()), fields)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def field(self, chain, resseq):
+        """EDIAm of a residue as written in the file, or None if it is not in the table."""
+        fields = self.rows.get((chain, str(resseq)))
+        return fields[4].strip() if fields else None
+
+    def edia(self, chain, resseq):
+        """EDIAm of a residue, or None if it is not in the table."""
+        try:
+            return float(self.field(chain, resseq))
+        except (TypeError, ValueError):
+            return None
+
+    def neighbours(self, chain, resseq, n=2):
+        """{residue number: EDIAm or None} of the residues within n of resseq in the chain."""
+        resseq = int(resseq)
+        return {k: self.edia(chain, k) for k in range(resseq - n, resseq + n + 1)}
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+def load_table(path):
+    """ScoreTable of a scores file (unpacked or archived), parsed once per version of the file."""
+    size, mtime_ns = tuple_archive.stat(path)
+    key = (os.path.realpath(path), mtime_ns, size)
+    with _tables_lock:
+        table = _tables.get(key)
+    if table is None:
+        table = ScoreTable(path)
+        with _tables_lock:
+            _tables[key] = table
+    return table
+
+def find_scores(state_dir):
+    found = tuple_archive.glob_files(os.path.join(state_dir, OUT_DIR, SCORES_GLOB))
+    return found[0] if found else None
+
+# -------------------------
+# Scoring
+# -------------------------
+class Log:
+    """Timestamped lines of ediascorer_log.txt, written by both states."""
+    def __init__(self, path):
+        self.fh = open(path, "w")
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.fh.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {text}\n")
+            self.fh.flush()
+
+    def raw(self, text):
+        with self.lock:
+            self.fh.write(text)
+            self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+def score_state(state_dir, stem, log):
+    """
+    Run ediascorer on the refined model and 2mFo-DFc map of one state unless
+    its scores exist; return the path of the scores file or None.
+    """
+    if not os.path.isdir(state_dir):
+        log.write(f"WARNING: {state_dir} not found — skipping")
+        return None
+    scores = find_scores(state_dir)
+    if scores:
+        log.write(f"SKIPPING: EDIA output already exists in {os.path.join(state_dir, OUT_DIR)}")
+        return scores
+
+    pdb_file = os.path.join(state_dir, f"{stem}.pdb")
+    map_file = os.path.join(state_dir, f"{stem}{rscc.MAP_SUFFIX}")
+    if not (os.path.exists(pdb_file) and os.path.exists(map_file)):
+        log.write(f"ERROR: missing PDB or CCP4 in {state_dir}")
+        return None
+
+    outdir = os.path.join(state_dir, OUT_DIR)
+    os.makedirs(outdir, exist_ok=True)
+    with slot() as k:
+        log.write(f"Running EDIA in {state_dir} (slot {k})")
+        proc = instrument.run([EDIA_BIN, "-l", EDIA_LICENSE, "-t", pdb_file, "-d", map_file, "-o", outdir + "/"],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    log.raw(proc.stdout)
+    if proc.returncode != 0:
+        log.write(f"ERROR: EDIA failed for {state_dir}")
+        return None
+    log.write(f"SUCCESS: EDIA completed for {state_dir}")
+    return find_scores(state_dir)
+
+def pair_edia(tup_dir, pdbid, chain, resseq):
+    """Score both states of a tuple directory side by side; return {state: EDIAm as written, or None}."""
+    if not os.path.isdir(tup_dir):
+        # an archived tuple (tuple_archive.py) is finished: its scores are only read back
+        found = {state: find_scores(os.path.join(tup_dir, state)) for state in STATES}
+        return {state: load_table(path).field(chain, resseq) if path else None for state, path in found.items()}
+    log = Log(os.path.join(tup_dir, LOG_NAME))
+    log.write(f"Target: {tup_dir}")
+    try:
+        with ThreadPoolExecutor(max_workers=len(STATES)) as pool:
+            futures = {state: pool.submit(score_state, os.path.join(tup_dir, state), stem.format(pdbid=pdbid), log)
+                       for state, stem in STATES.items()}
+        values = {}
+        for state, fut in futures.items():
+            scores = fut.result()
+            values[state] = None
+            if scores is None:
+                log.write(f"WARNING: no EDIA score file found in {os.path.join(tup_dir, state, OUT_DIR)}")
+                continue
+            values[state] = load_table(scores).field(chain, resseq)
+            if values[state] is None:
+                log.write(f"WARNING: could not find EDIA entry for nt={resseq}, chain={chain} in {scores}")
+        return values
+    finally:
+        log.close()
+
+def fmt(value):
+    return "None" if value is None else str(value)
+
+def write_summary(fields):
+    """Record the pair's row in the results store (and its line in the text summary)."""
+    metrics_store.record_result("edia", fields)
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--table":
+        if len(sys.argv) not in (5, 7):
+            print("Usage: python3 edia_runner.py --table <structurescores.csv> <chain> <resseq> [--neighbours N]",
+                  file=sys.stderr)
+            sys.exit(1)
+        table = load_table(sys.argv[2])
+        n = int(sys.argv[6]) if len(sys.argv) == 7 else 0
+        for resseq, value in table.neighbours(sys.argv[3], sys.argv[4], n).items():
+            print(f"{sys.argv[3]} {resseq} {fmt(value)}")
+        sys.exit(0)
+
+    if len(sys.argv) != 8:
+        print("Usage: python3 edia_runner.py pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2",
+              file=sys.stderr)
+        sys.exit(1)
+
+    pdbid = sys.argv[1]
+    chain1, nt_type1, nt1 = sys.argv[2], sys.argv[3], int(sys.argv[4])
+    chain2, nt_type2, nt2 = sys.argv[5], sys.argv[6], int(sys.argv[7])
+
+    chain_purine, nt_purine = rscc.get_purine_info(chain1, nt_type1, nt1, chain2, nt_type2, nt2)
+    if chain_purine is None:
+        sys.exit(1)
+    if shutil.which(EDIA_BIN) is None:
+        print(f"ERROR: ediascorer not found at: {EDIA_BIN} (override with EDIA_BIN=...)", file=sys.stderr)
+        sys.exit(1)
+
+    tup_dir = rscc.locate_tuple_dir(pdbid, chain_purine, nt_purine)
+    if not tup_dir:
+        print(f"ERROR: directory {pdbid}_{chain_purine}_{nt_purine} not found under {rscc.ROOT_GLOBS[0]}",
+              file=sys.stderr)
+        sys.exit(1)
+
+    values = pair_edia(tup_dir, pdbid, chain_purine, nt_purine)
+    write_summary([pdbid, chain1, nt_type1, nt1, chain2, nt_type2, nt2, fmt(values['WC']), fmt(values['HG'])])
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Glycosidic flips (anti <-> syn) of many purines of a structure at once.
+
+flip.py and flip_negative.py load the model into PyMOL to add 180 degrees to
+the O4'-C1'-N9-C4 dihedral of one purine; the two differ only in how the
+selection escapes negative residue numbers.  Here the file is read once and,
+for every requested residue, the atoms on the base side of the C1'-N9 bond
+(those bonded to N9 without passing C1', from covalent distances within the
+residue, the fragment that PyMOL's set_dihedral moves) are rotated by 180
+degrees about the C1'-N9 axis.  Only the coordinates of the moved atoms and
+their ANISOU tensors change; every other line is written as it was read.
+
+Residues are given as (chain, resseq) or (chain, resseq, icode), so negative
+numbers and insertion codes need no escaping.
+
+pipeline.py still flips with PyMOL unless run with --flip-engine.  --compare
+checks this module against reference models written by flip.py /
+flip_negative.py on a machine with PyMOL: for every <stem>_flipped.pdb in the
+fixture directory (default FIXTURE_DIR) next to its <stem>.pdb, the residue
+that PyMOL moved is flipped here and every atom is compared with the
+reference, within COMPARE_TOL.  To add a fixture:
+
+    cp 1abc_final.pdb fixtures/flip/1abc_A_5.pdb
+    cd fixtures/flip && python3 ../../flip.py 1abc_A_5 A 5     # writes 1abc_A_5_flipped.pdb
+
+Usage:
+    python3 flip_engine.py <pdb_file> <chain> <resseq>[<icode>] <out.pdb> [<chain> <resseq> <out.pdb> ...]
+    python3 flip_engine.py --compare [FIXTURE_DIR]
+"""
+import os
+import re
+import sys
+import glob
+import tempfile
+from collections import deque
+
+import numpy as np
+
+from clash_engine import COVALENT_RADII, BOND_TOLERANCE
+from structure_index import element_of
+
+# -------------------------
+# Config
+# -------------------------
+ATOM_RECORDS = ("ATOM  ", "HETATM")
+AXIS = ("C1'", "N9")
+DIHEDRAL = ("O4'", "C1'", "N9", "C4")
+FLIP_ANGLE = 180.0
+FIXTURE_DIR = "fixtures/flip"
+COMPARE_TOL = 0.002     # A; PDB coordinates are rounded to 0.001 A
+
+# -------------------------
+# Helpers
+# -------------------------
+def residue_key(line):
+    """(chain, resseq, icode) of an ATOM/HETATM/ANISOU record, else None."""
+    if not line.startswith(ATOM_RECORDS + ("ANISOU",)) or len(line) < 27:
+        return None
+    try:
+        return line[21], int(line[22:26]), line[26]
+    except ValueError:
+        return None
+
+def normalise(key):
+    """(chain, resseq, icode) of a (chain, resseq[, icode]) target; a missing icode is blank."""
+    chain, resseq, *icode = key
+    return chain, int(resseq), (icode[0] if icode and icode[0] else " ")
+
+def rotation(axis, angle):
+    """Matrix of a rotation by angle (degrees) about the unit vector axis."""
+    x, y, z = axis
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    return np.array([
+        [c + x * x * (1 - c), x * y * (1 - c) - z * s, x * z * (1 - c) + y * s],
+        [y * x * (1 - c) + z * s, c + y * y * (1 - c), y * z * (1 - c) - x * s],
+        [z * x * (1 - c) - y * s, z * y * (1 - c) + x * s, c + z * z * (1 - c)],
+    ])
+
+def dihedral(p0, p1, p2, p3):
+    """Dihedral angle (degrees) of four points."""
+    b0, b1, b2 = p0 - p1, p2 - p1, p3 - p2
+    b1 = b1 / np.linalg.norm(b1)
+    v = b0 - np.dot(b0, b1) * b1
+    w = b2 - np.dot(b2, b1) * b1
+    return float(np.degrees(np.arctan2(np.dot(np.cross(b1, v), w), np.dot(v, w))))
+
+def base_side(atoms, start, stop):
+    """Indices of atoms bonded to start without passing stop (start included)."""
+    xyz = np.array([a['xyz'] for a in atoms])
+    cov = np.array([COVALENT_RADII.get(a['element'], 0.0) for a in atoms])
+    d = np.linalg.norm(xyz[:, None] - xyz[None], axis=2)
+    alt = [a['altloc'] for a in atoms]
+    bonded = (d > 0.4) & (d < cov[:, None] + cov[None] + BOND_TOLERANCE) & (cov[:, None] > 0) & (cov[None] > 0)
+    seen = {start, stop}
+    queue = deque([start])
+    while queue:
+        i = queue.popleft()
+        for j in np.flatnonzero(bonded[i]).tolist():
+            # alternate conformations of an atom are not bonded to each other's partners
+            if j not in seen and (alt[i] == " " or alt[j] == " " or alt[i] == alt[j]):
+                seen.add(j)
+                queue.append(j)
+    seen.discard(stop)
+    return sorted(seen)
+
+def flip_residue(atoms):
+    """
+    Rotate the base of one residue (list of atom dicts with name, altloc,
+    element, xyz) by FLIP_ANGLE about C1'-N9.  Return (moved atom indices,
+    rotation matrix, dihedral before, dihedral after).
+    """
+    by_name = {}
+    for i, a in enumerate(atoms):
+        by_name.setdefault(a['name'], []).append(i)
+    missing = [name for name in DIHEDRAL if name not in by_name]
+    if missing:
+        raise ValueError(f"missing atoms {' '.join(missing)}")
+    if any(len(by_name[name]) > 1 for name in AXIS):
+        raise ValueError("alternate conformations of C1'/N9")
+
+    c1, n9 = by_name["C1'"][0], by_name["N9"][0]
+    origin = atoms[n9]['xyz']
+    axis = origin - atoms[c1]['xyz']
+    R = rotation(axis / np.linalg.norm(axis), FLIP_ANGLE)
+    moved = base_side(atoms, n9, c1)
+    points = [atoms[by_name[name][0]]['xyz'] for name in DIHEDRAL]
+    before = dihedral(*points)
+    for i in moved:
+        atoms[i]['xyz'] = (atoms[i]['xyz'] - origin) @ R.T + origin
+    after = dihedral(*[atoms[by_name[name][0]]['xyz'] for name in DIHEDRAL])
+    return moved, R, before, after
+
+def rotate_anisou(line, R):
+    """ANISOU line with its tensor (U11 U22 U33 U12 U13 U23, 1e-4 A^2) rotated by R."""
+    u11, u22, u33, u12, u13, u23 = (int(line[28 + 7 * k:35 + 7 * k]) for k in range(6))
+    U = np.array([[u11, u12, u13], [u12, u22, u23], [u13, u23, u33]], dtype=float)
+    V = R @ U @ R.T
+    values = [V[0, 0], V[1, 1], V[2, 2], V[0, 1], V[0, 2], V[1, 2]]
+    return line[:28] + "".join(f"{int(round(v)):7d}" for v in values) + line[70:]
+
+def write_flipped_models(pdb_file, targets, errors=None):
+    """
+    Write one flipped model per residue of targets, {(chain, resseq[, icode]): [out_path, ...]},
+    from a single read of pdb_file.  Return {(chain, resseq, icode): (dihedral before, after)}.
+    Raise ValueError if a residue is missing or cannot be flipped, or, given an
+    errors dict, record the message there under the residue and go on with the others.
+    """
+    with open(pdb_file) as f:
+        lines = f.readlines()
+
+    targets = {normalise(key): paths for key, paths in targets.items()}
+    atoms = {key: [] for key in targets}
+    anisou = {key: {} for key in targets}
+    for n, line in enumerate(lines):
+        key = residue_key(line)
+        if key not in atoms:
+            continue
+        if line.startswith("ANISOU"):
+            anisou[key][line[12:17]] = n
+        else:
+            atoms[key].append({'line': n, 'name': line[12:16].strip(), 'altloc': line[16],
+                               'element': element_of(line),
+                               'xyz': np.array([float(line[30:38]), float(line[38:46]), float(line[46:54])])})
+
+    angles = {}
+    for key, paths in targets.items():
+        try:
+            if not atoms[key]:
+                raise ValueError("residue not found")
+            moved, R, before, after = flip_residue(atoms[key])
+        except ValueError as e:
+            message = f"cannot flip {key[0]}/{key[1]}{key[2].strip()} of {pdb_file}: {e}"
+            if errors is None:
+                raise ValueError(message) from e
+            errors[key] = message
+            continue
+        angles[key] = (before, after)
+
+        changed = {}
+        for i in moved:
+            a = atoms[key][i]
+            line = lines[a['line']]
+            x, y, z = a['xyz']
+            changed[a['line']] = f"{line[:30]}{x:8.3f}{y:8.3f}{z:8.3f}{line[54:]}"
+            n = anisou[key].get(line[12:17])
+            if n is not None:
+                changed[n] = rotate_anisou(lines[n], R)
+
+        for path in paths:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as out:
+                out.writelines(changed.get(n, line) for n, line in enumerate(lines))
+            os.replace(tmp, path)
+    return angles
+
+def atom_table(pdb_file):
+    """{(chain, resseq, icode, atom name, altloc): xyz} of the ATOM/HETATM records of pdb_file."""
+    table = {}
+    with open(pdb_file) as f:
+        for line in f:
+            key = residue_key(line)
+            if key is None or line.startswith("ANISOU"):
+                continue
+            table[key + (line[12:16].strip(), line[16])] = \
+                np.array([float(line[30:38]), float(line[38:46]), float(line[46:54])])
+    return table
+
+def compare_fixture(original, reference):
+    """
+    Flip the residue that reference (written by flip.py) moved relative to
+    original and compare every atom with reference.  Return (residue,
+    atoms compared, max deviation, atoms in only one of the two models).
+    """
+    before, expected = atom_table(original), atom_table(reference)
+    moved = sorted({key[:3] for key, xyz in expected.items()
+                    if key in before and np.linalg.norm(xyz - before[key]) > COMPARE_TOL})
+    if len(moved) != 1:
+        raise ValueError(f"expected one flipped residue, found {len(moved)}")
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "flipped.pdb")
+        write_flipped_models(original, {moved[0]: [out]})
+        ours = atom_table(out)
+    common = sorted(set(ours) & set(expected))
+    deviation = max(float(np.linalg.norm(ours[key] - expected[key])) for key in common)
+    return moved[0], len(common), deviation, len(set(ours) ^ set(expected))
+
+def compare(fixture_dir):
+    """Compare flip_engine with every PyMOL reference in fixture_dir; True if all agree."""
+    references = sorted(glob.glob(os.path.join(fixture_dir, "*_flipped.pdb")))
+    if not references:
+        print(f" Error: no *_flipped.pdb references in {fixture_dir}", file=sys.stderr)
+        return False
+    ok = True
+    for reference in references:
+        original = reference[:-len("_flipped.pdb")] + ".pdb"
+        try:
+            (chain, resseq, icode), n, deviation, unmatched = compare_fixture(original, reference)
+        except (OSError, ValueError) as e:
+            print(f" Error: {os.path.basename(reference)}: {e}", file=sys.stderr)
+            ok = False
+            continue
+        agree = deviation <= COMPARE_TOL and unmatched == 0
+        ok = ok and agree
+        print(f"{os.path.basename(reference)} {chain}/{resseq}{icode.strip()}: {n} atoms, "
+              f"max deviation {deviation:.4f} A, {unmatched} unmatched {'OK' if agree else 'DIFFERS'}")
+    return ok
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--compare":
+        sys.exit(0 if compare(sys.argv[2] if len(sys.argv) > 2 else FIXTURE_DIR) else 1)
+
+    if len(sys.argv) < 5 or (len(sys.argv) - 2) % 3:
+        print("Usage: python3 flip_engine.py <pdb_file> <chain> <resseq>[<icode>] <out.pdb> [...]", file=sys.stderr)
+        sys.exit(1)
+
+    targets = {}
+    for chain, resseq, out in zip(*[iter(sys.argv[2:])] * 3):
+        m = re.fullmatch(r"(-?\d+)([A-Za-z]?)", resseq)
+        if not m:
+            print(f" Error: bad residue number {resseq!r}", file=sys.stderr)
+            sys.exit(1)
+        targets.setdefault((chain, int(m.group(1)), m.group(2) or " "), []).append(out)
+    try:
+        angles = write_flipped_models(sys.argv[1], targets)
+    except (OSError, ValueError) as e:
+        print(f" Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    for (chain, resseq, icode), (before, after) in angles.items():
+        print(f"Flip {chain}/{resseq}{icode.strip()}: O4'-C1'-N9-C4 {before:.1f} -> {after:.1f}")
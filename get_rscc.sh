@@ -6,6 +6,8 @@ if [ $# -ne 7 ]; then
     exit 1
 fi
 
+script_dir="$(cd "$(dirname "$0")" && pwd)"
+
 pdb_id="$1"
 chain_1="$2"
 nt_type_1="$3"
@@ -31,19 +33,31 @@ fi
 # Find target directory
 # ---------------------------
 base="PDB_without_nt"
-target=$(find "$base" -type d -name "${pdb_id}_${chain_purine}_${nt_purine}" | head -n1)
+tuple="${pdb_id}_${chain_purine}_${nt_purine}"
+target=$(find "$base" -type d -name "$tuple" | head -n1)
+
+# an archived tuple (tuple_archive.py) is finished: its reports are only read back
+if [[ -z "$target" && -f "$base/$tuple.zip" ]]; then
+    target="$base/$tuple"
+fi
 
 if [[ -z "$target" ]]; then
     exit 1
 fi
 
-cd "$target"
+read_file() {
+  if [[ -f "$1" ]]; then
+    cat "$1"
+  else
+    python3 "$script_dir/tuple_archive.py" --cat "$1" 2>/dev/null || true
+  fi
+}
 
 # ---------------------------
 # Function to run RSCC in subdir
 # ---------------------------
 run_rscc() {
-  local subdir=$1
+  local subdir="$target/$1"
   local pdb_glob=$2
   local mtz_glob=$3
 
@@ -79,12 +93,7 @@ extract_nt_cc() {
   local chain="$2"
   local nt="$3"
 
-  if [[ ! -f "$file" ]]; then
-    echo "NA"
-    return 0
-  fi
-
-  awk -v chain="$chain" -v nt="$nt" '
+  read_file "$file" | awk -v chain="$chain" -v nt="$nt" '
     BEGIN {
       header_type = ""
       header_seen = 0
@@ -168,28 +177,19 @@ extract_nt_cc() {
         printf "%.4f\n", sum / n
       }
     }
-  ' "$file"
+  '
 }
 
 
-RSCC_WC="NA"
-RSCC_HG="NA"
-
-if [[ -f "WC/RSCC_report.txt" ]]; then
-  RSCC_WC=$(extract_nt_cc "WC/RSCC_report.txt" "$chain_purine" "$nt_purine")
-fi
-
-if [[ -f "HG/RSCC_report.txt" ]]; then
-  RSCC_HG=$(extract_nt_cc "HG/RSCC_report.txt" "$chain_purine" "$nt_purine")
-fi
-
-
-
+RSCC_WC=$(extract_nt_cc "$target/WC/RSCC_report.txt" "$chain_purine" "$nt_purine")
+RSCC_HG=$(extract_nt_cc "$target/HG/RSCC_report.txt" "$chain_purine" "$nt_purine")
+RSCC_WC="${RSCC_WC:-NA}"
+RSCC_HG="${RSCC_HG:-NA}"
 
-summary_file="../../classification_files/RSCC_summary.txt"
-
-if [[ ! -f "$summary_file" ]]; then
-  echo "pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 RSCC_WC RSCC_HG" > "$summary_file"
-fi
-
-echo "$pdb_id $chain_1 $nt_type_1 $nt_number_1 $chain_2 $nt_type_2 $nt_number_2 $RSCC_WC $RSCC_HG" >> "$summary_file"
+# ---------------------------
+# Record the row (and its line in
+# classification_files/RSCC_summary.txt)
+# ---------------------------
+python3 "$script_dir/metrics_store.py" --root . --record rscc \
+  "$pdb_id" "$chain_1" "$nt_type_1" "$nt_number_1" "$chain_2" "$nt_type_2" "$nt_number_2" \
+  "$RSCC_WC" "$RSCC_HG"
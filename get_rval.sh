@@ -6,6 +6,8 @@ if [ $# -ne 7 ]; then
     exit 1
 fi
 
+script_dir="$(cd "$(dirname "$0")" && pwd)"
+
 pdb_id="$1"
 #pdb_file="$1_final.pdb"
 mtz_file="$1_final.mtz"
@@ -34,19 +36,30 @@ fi
 # Find target directory
 # ---------------------------
 base="PDB_without_nt"
-target=$(find "$base" -type d -name "${pdb_id}_${chain_purine}_${nt_purine}" | head -n1)
+tuple="${pdb_id}_${chain_purine}_${nt_purine}"
+target=$(find "$base" -type d -name "$tuple" | head -n1)
+
+# an archived tuple (tuple_archive.py) is read without unpacking
+if [[ -z "$target" && -f "$base/$tuple.zip" ]]; then
+    target="$base/$tuple"
+fi
 
 if [[ -z "$target" ]]; then
     exit 1
 fi
 
-cd "$target"
-
 # ---------------------------
 # Extract R-values
 # ---------------------------
+read_file() {
+  if [[ -f "$1" ]]; then
+    cat "$1"
+  else
+    python3 "$script_dir/tuple_archive.py" --cat "$1" 2>/dev/null
+  fi
+}
+
 extract_r_values() {
-  local file=$1
   awk '
     /R VALUE.*WORKING.*TEST/        { r_total = $NF }
     /R VALUE.*WORKING SET/          { r_work  = $NF }
@@ -56,17 +69,10 @@ extract_r_values() {
     END {
       printf "%s %s %s\n", r_total, r_work, r_free
     }
-  ' "$file"
+  '
 }
 
 
-summary_file="../../classification_files/R_values_summary.txt"
-
-if [[ ! -f "$summary_file" ]]; then
-  echo "pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 r_total_WC r_work_WC r_free_WC r_total_HG r_work_HG r_free_HG" \
-    > "$summary_file"
-fi
-
 # ---------------------------
 # Collect WC / HG R-values
 # ---------------------------
@@ -75,29 +81,28 @@ r_total_HG="NA"; r_work_HG="NA"; r_free_HG="NA"
 
 for mode in WC HG; do
 
-  cd "$mode"
-
   if [[ "$mode" == "WC" ]]; then
-    pdbfile="${pdb_id}_final_refine_001.pdb"
-    if [[ -f "$pdbfile" ]]; then
-      read r_total_WC r_work_WC r_free_WC < <(extract_r_values "$pdbfile")
+    pdbfile="$target/WC/${pdb_id}_final_refine_001.pdb"
+    if values=$(read_file "$pdbfile" | extract_r_values); then
+      read r_total_WC r_work_WC r_free_WC <<< "$values"
     else
       echo "WARNING: WC file '$pdbfile' not found" >&2
     fi
   else  # HG
-    pdbfile="${pdb_id}_final_flipped_refine_001_refine_001.pdb"
-    if [[ -f "$pdbfile" ]]; then
-      read r_total_HG r_work_HG r_free_HG < <(extract_r_values "$pdbfile")
+    pdbfile="$target/HG/${pdb_id}_final_flipped_refine_001_refine_001.pdb"
+    if values=$(read_file "$pdbfile" | extract_r_values); then
+      read r_total_HG r_work_HG r_free_HG <<< "$values"
     else
       echo "WARNING: HG file '$pdbfile' not found" >&2
     fi
   fi
 
-  cd ..
 done
 
 # ---------------------------
-# Append one line to summary
+# Record the row (and its line in
+# classification_files/R_values_summary.txt)
 # ---------------------------
-echo "$pdb_id $chain_1 $nt_type_1 $nt_number_1 $chain_2 $nt_type_2 $nt_number_2 $r_total_WC $r_work_WC $r_free_WC $r_total_HG $r_work_HG $r_free_HG" \
-  >> "$summary_file"
+python3 "$script_dir/metrics_store.py" --root . --record rvalues \
+  "$pdb_id" "$chain_1" "$nt_type_1" "$nt_number_1" "$chain_2" "$nt_type_2" "$nt_number_2" \
+  "$r_total_WC" "$r_work_WC" "$r_free_WC" "$r_total_HG" "$r_work_HG" "$r_free_HG"
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Wall time, CPU time and peak RSS of the pipeline's stages and of every
+external tool they run.
+
+Each record is one JSON line in TIMINGS_LOG of the run directory, keyed by
+pair and stage: a "stage" record per pipeline stage and a "call" record per
+tool run (phenix.refine, phenix.ready_set, phenix.mtz2map, ediascorer,
+phenix.clashscore, the metric scripts, PyMOL renders).  A call record holds
+the exit code and the input sizes (atoms of the .pdb and reflections of the
+.mtz arguments); a stage record holds the sizes of the pair's structure, so
+both can be bucketed by structure size.  The CPU time and peak RSS of a call
+come from wait4() on the child, so they cover the tool and the processes it
+waited for; those of a stage add the CPU time of its own thread.
+
+run() starts its child with HG_INSTRUMENT_* set, so tools run by the metric
+scripts (ediascorer under edia_runner.py, phenix.clashscore under Clashes.py)
+are recorded under the pair and stage that started the script.
+
+Usage:
+    python3 instrument.py [timings.jsonl] [--by stage|tool] [--buckets N,N,...]
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import struct
+import argparse
+import resource
+import threading
+import subprocess
+from contextlib import contextmanager
+
+import numpy as np
+
+# -------------------------
+# Config
+# -------------------------
+TIMINGS_LOG = "timings.jsonl"
+
+# Upper atom counts of the structure-size buckets of the summary
+SIZE_BUCKETS = [2000, 10000, 50000, 200000]
+
+PERCENTILES = [50, 95]
+
+# Interpreters whose first argument names the tool
+INTERPRETERS = {"python", "python3", "bash", "sh"}
+
+ENV_LOG = "HG_INSTRUMENT_LOG"
+ENV_PAIR = "HG_INSTRUMENT_PAIR"
+ENV_STAGE = "HG_INSTRUMENT_STAGE"
+
+# -------------------------
+# Input sizes
+# -------------------------
+_sizes = {}
+_sizes_lock = threading.Lock()
+
+def _cached(path, count):
+    """count(path), computed once per version of the file; None if it cannot be read."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.realpath(path), st.st_mtime_ns, st.st_size)
+    with _sizes_lock:
+        if key in _sizes:
+            return _sizes[key]
+    try:
+        value = count(path)
+    except (OSError, ValueError, struct.error):
+        value = None
+    with _sizes_lock:
+        _sizes[key] = value
+    return value
+
+def _count_atoms(path):
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.startswith((b"ATOM  ", b"HETATM")))
+
+def _count_reflections(path):
+    """Reflections of an MTZ file, from the NCOL record of its header."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if head[:4] != b"MTZ ":
+            raise ValueError("not an MTZ file")
+        # machine stamp: 0x4_ for little-endian IEEE, 0x1_ for big-endian
+        endian = "<" if head[9] & 0xF0 == 0x40 else ">"
+        (word,) = struct.unpack(endian + "i", head[4:8])
+        f.seek(4 * (word - 1))
+        while True:
+            record = f.read(80)
+            if len(record) < 80 or record.startswith(b"END"):
+                raise ValueError("no NCOL record")
+            if record.startswith(b"NCOL"):
+                return int(record.split()[2])
+
+def atom_count(path):
+    return _cached(path, _count_atoms)
+
+def reflection_count(path):
+    return _cached(path, _count_reflections)
+
+def input_sizes(paths, cwd=None):
+    """{'atoms': n, 'reflections': n} of the largest .pdb and .mtz among paths (missing files are ignored)."""
+    sizes = {}
+    for path in paths:
+        path = os.path.join(cwd or ".", path)
+        if path.endswith(".pdb"):
+            n, key = atom_count(path), 'atoms'
+        elif path.endswith(".mtz"):
+            n, key = reflection_count(path), 'reflections'
+        else:
+            continue
+        if n is not None and n > sizes.get(key, -1):
+            sizes[key] = n
+    return sizes
+
+# -------------------------
+# Recording
+# -------------------------
+_local = threading.local()
+_write_lock = threading.Lock()
+
+def context():
+    """(log path, pair, stage) of the calling thread, else inherited from the parent process, else None."""
+    ctx = getattr(_local, 'ctx', None)
+    if ctx is not None:
+        return ctx
+    if os.environ.get(ENV_LOG):
+        return os.environ[ENV_LOG], os.environ.get(ENV_PAIR), os.environ.get(ENV_STAGE)
+    return None
+
+def write_record(record, ctx=None):
+    """Append record to the timings log of ctx (default: the current context); no-op without one."""
+    ctx = ctx or context()
+    if ctx is None:
+        return
+    path, pair, stage = ctx
+    record = {'pair': pair, 'stage': stage, **record, 'time': time.strftime('%F %T')}
+    line = json.dumps(record) + "\n"
+    with _write_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    stats = getattr(_local, 'stats', None)
+    if stats is not None and record['kind'] == "call":
+        stats['cpu'] += record.get('cpu') or 0.0
+        stats['max_rss_kb'] = max(stats['max_rss_kb'], record.get('max_rss_kb') or 0)
+
+def tool_name(cmd):
+    """Basename of the program of cmd, or of the script an interpreter runs."""
+    name = os.path.basename(cmd[0])
+    if name in INTERPRETERS and len(cmd) > 1:
+        return os.path.basename(cmd[1])
+    return name
+
+def record_call(tool, wall, cpu=None, max_rss_kb=None, exit_code=None, sizes=None):
+    """Record one tool call measured elsewhere (e.g. a render job in a worker process)."""
+    write_record({'kind': "call", 'tool': tool, 'wall': round(wall, 3),
+                  'cpu': None if cpu is None else round(cpu, 3), 'max_rss_kb': max_rss_kb,
+                  'exit': exit_code, **(sizes or {})})
+
+@contextmanager
+def stage(pair, name, root=".", sizes=None):
+    """
+    Record the stage `name` of pair run by the calling thread in root's
+    timings log, with the calls made inside it.  Yields a dict whose 'exit'
+    the caller may set (e.g. 0 or 1 for ok or failed).
+    """
+    outer = (getattr(_local, 'ctx', None), getattr(_local, 'stats', None))
+    _local.ctx = (os.path.abspath(os.path.join(root, TIMINGS_LOG)), pair, name)
+    _local.stats = {'cpu': 0.0, 'max_rss_kb': 0}
+    result = {'exit': None}
+    start, cpu_start = time.monotonic(), time.thread_time()
+    try:
+        yield result
+    finally:
+        stats = _local.stats
+        write_record({'kind': "stage", 'tool': None, 'wall': round(time.monotonic() - start, 3),
+                      'cpu': round(time.thread_time() - cpu_start + stats['cpu'], 3),
+                      'max_rss_kb': stats['max_rss_kb'] or None, 'exit': result['exit'], **(sizes or {})})
+        _local.ctx, _local.stats = outer
+
+def run(cmd, cwd=None, stdout=None, stderr=None, env=None):
+    """
+    subprocess.run(cmd) that records the call's wall time, CPU time, peak RSS,
+    exit code and input sizes.  Returns a CompletedProcess; with
+    stdout=subprocess.PIPE its output is in .stdout (stderr cannot be piped too).
+    Raises OSError if cmd cannot be started.
+    """
+    if stdout == subprocess.PIPE and stderr == subprocess.PIPE:
+        raise ValueError("instrument.run cannot pipe both stdout and stderr")
+    ctx = context()
+    if ctx is not None:
+        env = {**(os.environ if env is None else env),
+               ENV_LOG: ctx[0], ENV_PAIR: ctx[1] or "", ENV_STAGE: ctx[2] or ""}
+    sizes = input_sizes([arg for arg in cmd if not arg.startswith("-")], cwd)
+    text = stdout == subprocess.PIPE or stderr == subprocess.PIPE
+    start = time.monotonic()
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=stdout, stderr=stderr, env=env, text=text or None)
+    out = None
+    try:
+        pipe = proc.stdout or proc.stderr
+        if pipe is not None:
+            out = pipe.read()
+            pipe.close()
+        # wait4 (rather than proc.wait) reports the child's own resource usage
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    record_call(tool_name(cmd), time.monotonic() - start, usage.ru_utime + usage.ru_stime, usage.ru_maxrss,
+                proc.returncode, sizes)
+    return subprocess.CompletedProcess(cmd, proc.returncode,
+                                       out if proc.stdout is not None else None,
+                                       out if proc.stderr is not None else None)
+
+def self_usage():
+    """(CPU seconds, peak RSS in kB) of this process so far."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+# -------------------------
+# Summary
+# -------------------------
+def read_records(path):
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue    # a line cut short by a crash
+    return records
+
+def bucket_label(atoms, buckets=SIZE_BUCKETS):
+    """Structure-size bucket of an atom count, e.g. '2k-10k'."""
+    if atoms is None:
+        return "unknown"
+    def short(n):
+        return f"{n // 1000}k" if n >= 1000 else str(n)
+    low = 0
+    for high in buckets:
+        if atoms < high:
+            return f"{short(low)}-{short(high)}"
+        low = high
+    return f">={short(low)}"
+
+def summarise(records, by="stage", buckets=SIZE_BUCKETS):
+    """
+    Rows (group, bucket, n, failed, p50/p95 wall, p50/p95 CPU, p95 peak RSS in MB)
+    per stage or tool and structure-size bucket, slowest total first.
+    """
+    kind = "stage" if by == "stage" else "call"
+    # records without input sizes (e.g. the metric scripts) take the size of their pair's structure
+    pair_atoms = {}
+    for rec in records:
+        if rec.get('kind') == "stage" and rec.get('atoms') is not None:
+            pair_atoms[rec['pair']] = rec['atoms']
+    groups = {}
+    for rec in records:
+        if rec.get('kind') != kind:
+            continue
+        atoms = rec.get('atoms', pair_atoms.get(rec.get('pair')))
+        for bucket in ("all", bucket_label(atoms, buckets)):
+            groups.setdefault((rec[by], bucket), []).append(rec)
+
+    def pct(values, q):
+        values = [v for v in values if v is not None]
+        return float(np.percentile(values, q)) if values else None
+
+    rows = []
+    for (group, bucket), recs in groups.items():
+        wall = [r['wall'] for r in recs]
+        rss = pct([r.get('max_rss_kb') for r in recs], 95)
+        rows.append({
+            by: group, 'bucket': bucket, 'n': len(recs),
+            'failed': sum(1 for r in recs if r.get('exit') not in (0, None)),
+            **{f"wall_p{q}": pct(wall, q) for q in PERCENTILES},
+            **{f"cpu_p{q}": pct([r.get('cpu') for r in recs], q) for q in PERCENTILES},
+            'rss_p95_mb': None if rss is None else rss / 1024,
+            'total': sum(wall),
+        })
+    totals = {row[by]: row['total'] for row in rows if row['bucket'] == "all"}
+    rows.sort(key=lambda row: (-totals[row[by]], row['bucket'] != "all", row['bucket']))
+    return rows
+
+def format_table(rows, by="stage"):
+    def fmt(v, spec):
+        return "-" if v is None else format(v, spec)
+    cols = [(by, 22), ('bucket', 10), ('n', 6), ('failed', 6)] + \
+        [(f"wall_p{q}", 10) for q in PERCENTILES] + [(f"cpu_p{q}", 10) for q in PERCENTILES] + \
+        [('rss_p95_mb', 10), ('total', 10)]
+    lines = [" ".join(f"{name:>{w}}" if i > 1 else f"{name:<{w}}" for i, (name, w) in enumerate(cols))]
+    for row in rows:
+        cells = []
+        for i, (name, w) in enumerate(cols):
+            v = row[name]
+            if i <= 1:
+                cells.append(f"{v or '-':<{w}}")
+            elif isinstance(v, int):
+                cells.append(f"{v:>{w}}")
+            else:
+                cells.append(f"{fmt(v, '.1f' if name.startswith(('rss', 'total')) else '.2f'):>{w}}")
+        lines.append(" ".join(cells))
+    return "\n".join(lines)
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise the stage and tool timings of a run.")
+    parser.add_argument("log", nargs="?", default=TIMINGS_LOG, help=f"timings log (default: {TIMINGS_LOG})")
+    parser.add_argument("--by", choices=["stage", "tool"], default="stage",
+                        help="group the stage records by stage, or the call records by tool (default: stage)")
+    parser.add_argument("--buckets", default=",".join(map(str, SIZE_BUCKETS)),
+                        help="upper atom counts of the structure-size buckets (default: %(default)s)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.log):
+        print(f" Error: timings log not found: {args.log}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        buckets = sorted(int(n) for n in args.buckets.split(","))
+    except ValueError:
+        print(f" Error: bad --buckets {args.buckets!r}", file=sys.stderr)
+        sys.exit(1)
+    rows = summarise(read_records(args.log), args.by, buckets)
+    if not rows:
+        print(f" No {args.by} records in {args.log}")
+        sys.exit(0)
+    print(format_table(rows, args.by))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Per-pair stage journal for pipeline.py.
+
+Each pair has one JSON file under JOURNAL_DIR recording, for every stage that
+finished, its status ("ok", "failed" or "skipped"), the fingerprints (size,
+mtime) of the files it produced and the summary tables it wrote a row to.
+Failed and skipped stages carry a reason code, and the pair keeps the reason
+code of its first failure for make_report.py.  A stage whose
+recorded outputs are still on disk unchanged is skipped when the pair is run
+again.  The journal lives outside PDB_without_nt/, so it survives
+pipeline.py packing the tuple folder into its archive (tuple_archive.py);
+once the report and archive stages are recorded the pair counts as complete.
+
+Usage:
+    python3 journal.py [--journal-dir DIR]      # list pairs and their progress
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import metrics_store
+
+# -------------------------
+# Config
+# -------------------------
+JOURNAL_DIR = "journal"
+FINAL_STAGE = "report"
+ARCHIVE_STAGE = "archive"     # runs after FINAL_STAGE; a pair is complete once both are recorded
+
+# -------------------------
+# Helpers
+# -------------------------
+def pair_id(pdb_code, chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2):
+    return f"{pdb_code.lower()}_{chain_1}_{nt_type_1}_{nt_number_1}_{chain_2}_{nt_type_2}_{nt_number_2}"
+
+def fingerprint(path):
+    """Return [size, mtime_ns] of path, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def row_present(conn, source, path, key):
+    """True if the results (or summary) table `source`, or the combined table, holds a row for key."""
+    if source == "combined":
+        return metrics_store.fetch_combined(conn, key) is not None
+    if metrics_store.get_result(conn, source, key) is not None:
+        return True
+    metrics_store.ingest_summary(conn, source, path)
+    return metrics_store.get_summary_row(conn, source, key) is not None
+
+class Journal:
+    """
+    Stage records of one pair.  Output paths are stored relative to `root`
+    (the run directory), so a journal stays valid when batch_run.py moves a
+    finished task's outputs into the run directory.
+    """
+    def __init__(self, pair, key, journal_dir=JOURNAL_DIR, root="."):
+        self.pair = pair
+        self.key = key
+        self.root = root
+        self.path = os.path.join(root, journal_dir, f"{pair}.json")
+        self.data = self.load()
+        self._conn = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {'pair': self.pair, 'stages': {}}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f" Warning: unreadable journal {self.path}, starting over: {e}", file=sys.stderr)
+            return {'pair': self.pair, 'stages': {}}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp, self.path)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def conn(self):
+        if self._conn is None:
+            self._conn = metrics_store.connect(os.path.join(self.root, metrics_store.STORE_PATH))
+        return self._conn
+
+    def status(self, stage):
+        entry = self.data['stages'].get(stage)
+        return entry['status'] if entry else None
+
+    def valid(self, stage, retry_failed=False):
+        """
+        True if stage was recorded and everything it produced is still there:
+        every output file with the recorded fingerprint and every summary row.
+        """
+        entry = self.data['stages'].get(stage)
+        if entry is None or entry['status'] == "skipped" or (retry_failed and entry['status'] != "ok"):
+            return False
+        for rel, fp in entry['outputs'].items():
+            if fingerprint(os.path.join(self.root, rel)) != fp:
+                return False
+        for source, rel in entry.get('rows', {}).items():
+            if not row_present(self.conn(), source, os.path.join(self.root, rel), self.key):
+                return False
+        return True
+
+    def complete(self, retry_failed=False):
+        """
+        True if the final stage and the packing of the tuple directory are
+        recorded; earlier outputs may have been packed since.
+        With retry_failed, a pair with a failed stage is not complete.
+        """
+        if retry_failed and any(e['status'] == "failed" for e in self.data['stages'].values()):
+            return False
+        if self.status(FINAL_STAGE) == "skipped":
+            return True
+        return self.valid(FINAL_STAGE) and self.status(ARCHIVE_STAGE) is not None
+
+    def reason(self, stage=None):
+        """Reason code of a failed or skipped stage, or (without stage) of the pair."""
+        if stage is None:
+            return self.data.get('reason')
+        entry = self.data['stages'].get(stage)
+        return entry.get('reason') if entry else None
+
+    def set_reason(self, reason):
+        if self.data.get('reason') != reason:
+            self.data['reason'] = reason
+            self.save()
+
+    def record(self, stage, ok, outputs=(), rows=None, seconds=None, reason=None):
+        """Record a finished stage with the fingerprints of the output files that exist."""
+        entry = {
+            'status': "ok" if ok else "failed",
+            'finished': time.strftime('%F %T'),
+            'outputs': {},
+            'rows': dict(rows or {}),
+        }
+        if seconds is not None:
+            entry['seconds'] = round(seconds, 3)
+        if reason is not None:
+            entry['reason'] = reason
+        for path in outputs:
+            fp = fingerprint(os.path.join(self.root, path))
+            if fp is not None:
+                entry['outputs'][os.path.normpath(path)] = fp
+        self.data['stages'][stage] = entry
+        self.save()
+
+    def skip(self, stage, reason):
+        """Record a stage that was not run because a stage it needs failed (or cannot run)."""
+        self.data['stages'][stage] = {
+            'status': "skipped",
+            'finished': time.strftime('%F %T'),
+            'outputs': {},
+            'rows': {},
+            'reason': reason,
+        }
+        self.save()
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the stage journal of every pair.")
+    parser.add_argument("--journal-dir", default=JOURNAL_DIR)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.journal_dir):
+        print(f" Error: journal directory not found: {args.journal_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    n_done = 0
+    names = sorted(n for n in os.listdir(args.journal_dir) if n.endswith(".json"))
+    for name in names:
+        with open(os.path.join(args.journal_dir, name)) as f:
+            data = json.load(f)
+        stages = data['stages']
+        failed = [s for s, e in stages.items() if e['status'] == "failed"]
+        skipped = [s for s, e in stages.items() if e['status'] == "skipped"]
+        done = FINAL_STAGE in stages and ARCHIVE_STAGE in stages
+        n_done += done
+        print(f"{name[:-5]} {'complete' if done else 'partial'} {len(stages)} stages"
+              + (f" failed: {','.join(failed)}" if failed else "")
+              + (f" skipped: {len(skipped)}" if skipped else "")
+              + (f" reason: {data['reason']}" if data.get('reason') else ""))
+    print(f"{len(names)} pairs, {n_done} complete")
@@ -2,10 +2,12 @@
 import sys
 import os
 import math
-import shutil
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+
+import journal
+import metrics_store
+import tuple_archive
 
 # -------------------------
 # Config
@@ -13,6 +15,42 @@ from matplotlib.backends.backend_pdf import PdfPages
 COMBINED_TABLE = "classification_files/combined_metrics.txt"
 PATH_TO_IMAGES = "PDB_without_nt"
 OUTPUT_FOLDER = "reports"
+RESULTS_FILE = "classification_files/classification_results.txt"
+PAIR_TABLE = "PairTable_X_ray.csv"
+
+PAIR_TABLE_COLUMNS = [
+    'pdb_code', 'assembly', 'resolution', 'chi_1', 'chi_2',
+    'chain_1', 'nt_type_1', 'nt_number_1', 'chain_2', 'nt_type_2', 'nt_number_2',
+]
+
+RESULTS_HEADER = (
+    "pdb_id resolution chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 "
+    "RSCC_WC RSCC_HG delta_RSCC "
+    "EDIA_WC EDIA_HG delta_EDIA "
+    "Clashscore_bp_WC Clashscore_bp_HG delta_Clashscore_bp "
+    "Clashscore_neighbour_WC Clashscore_neighbour_HG delta_Clashscore_neighbour "
+    "Clashscore_global_WC Clashscore_global_HG "
+    "R_work_WC R_work_HG delta_R_work "
+    "R_free_WC R_free_HG delta_R_free "
+    "B_factor_WC B_factor_HG "
+    "Initial_conformation "
+    "classification\n"
+)
+
+CORE_METRICS = ["RSCC", "EDIA", "Clashscore bp", "Clashscore neighbour"]
+INTERPRETED_METRICS = CORE_METRICS + ["R-work", "R-free"]
+
+# Per-state columns of the combined table: {metric: column template}
+STATE_COLUMNS = {
+    'rscc': 'RSCC_{s}',
+    'edia': '{s}_edia',
+    'clash_bp': '{s}_clashscore_bp',
+    'clash_neigh': '{s}_clashscore_neighbour',
+    'clash_global': '{s}_clashscore_global',
+    'rwork': 'r_work_{s}',
+    'rfree': 'r_free_{s}',
+    'b': 'mean_B_{s}',
+}
 
 # -------------------------
 # Helper Functions
@@ -111,25 +149,218 @@ def format_value(val, decimals=3):
     except:
         return 'NA'
 
-def delete_folder_safely(folder_path):
-    """Delete a folder and all its contents safely."""
-    if os.path.exists(folder_path) and os.path.isdir(folder_path):
+# -------------------------
+# Table-level classification
+# -------------------------
+def load_combined_table():
+    """Load the whole combined metrics table, from the metrics store when available."""
+    if os.path.exists(metrics_store.STORE_PATH):
+        conn = metrics_store.connect()
         try:
-            shutil.rmtree(folder_path)
-            return True
-        except Exception as e:
-            print(f"  Warning: Could not delete folder {folder_path}: {e}")
-            return False
+            if metrics_store.has_combined(conn):
+                return pd.read_sql_query("SELECT * FROM combined ORDER BY rowid", conn)
+        finally:
+            conn.close()
+    if not os.path.exists(COMBINED_TABLE):
+        return None
+    return pd.read_csv(COMBINED_TABLE, sep=r'\s+')
+
+def load_pair_table(path):
+    """Read PairTable_X_ray.csv (no header) keeping every field as a string."""
+    pairs = pd.read_csv(path, header=None, dtype=str, keep_default_na=False,
+                        usecols=range(len(PAIR_TABLE_COLUMNS)), names=PAIR_TABLE_COLUMNS)
+    pairs = pairs[(pairs['pdb_code'] != '') & (pairs['pdb_code'] != 'pdb_code')]
+    for col in ['nt_number_1', 'nt_number_2']:
+        pairs[col] = pairs[col].astype(int)
+    for col in ['nt_type_1', 'nt_type_2']:
+        pairs[col] = pairs[col].str.upper()
+    pairs['pdb_code'] = pairs['pdb_code'].str.lower()
+    return pairs
+
+def interpret_diff(diff, tol):
+    """Vectorised interpret_metric: 'WC'/'HG'/'Ambiguous', None where diff is NaN."""
+    if tol is None:
+        # clashscore: lower is better, only an exact tie is ambiguous
+        out = np.select([diff == 0, diff > 0, diff < 0], ["Ambiguous", "HG", "WC"], default=None)
     else:
-        print(f"  Folder does not exist: {folder_path}")
+        out = np.select([diff.abs() <= tol, diff > tol, diff < -tol], ["Ambiguous", "WC", "HG"], default=None)
+    return pd.Series(out, index=diff.index, dtype=object)
+
+def format_column(values, decimals=3):
+    """Vectorised format_value."""
+    arr = values.to_numpy(dtype=float)
+    out = np.char.mod(f"%.{decimals}f", np.nan_to_num(arr)).astype(object)
+    out[np.isnan(arr)] = 'NA'
+    return pd.Series(out, index=values.index)
+
+def read_occupancy(pdb_code, chain_purine, nt_purine):
+    """Return the classification for a pair without any metric: 'Occupancy_not_1' or 'Error'."""
+    occupancy_file = os.path.join(PATH_TO_IMAGES, f'{pdb_code}_{chain_purine}_{nt_purine}', 'WC', 'occupancy')
+    try:
+        with tuple_archive.open_file(occupancy_file) as f:
+            occ_float = float(f.read().strip())
+    except (OSError, ValueError):
+        return "Error"
+    return "Occupancy_not_1" if abs(occ_float - 1.0) > 0.001 else "Error"
+
+def failure_classification(pdb_code, chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2,
+                           chain_purine, nt_purine):
+    """
+    Return the classification for a pair without any metric: the reason code
+    that pipeline.py recorded in the pair's journal (e.g. HG_refine_failed),
+    else the occupancy check of read_occupancy().
+    """
+    pair = journal.pair_id(pdb_code, chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2)
+    reason = journal.Journal(pair, None).reason()
+    return reason or read_occupancy(pdb_code, chain_purine, nt_purine)
+
+def classify_table(data, pairs):
+    """
+    Classify every pair of `pairs` that has an entry in the combined table `data`,
+    with the same rules as the per-pair mode (swap for syn purines, majority vote of
+    RSCC/EDIA/clashscores, poor-density and occupancy overrides).
+    Return one row per pair with the raw (swapped) WC/HG values, deltas,
+    interpretations and overall_result; see format_results() for the text columns.
+    """
+    keys = ['chain_1', 'nt_type_1', 'nt_number_1', 'chain_2', 'nt_type_2', 'nt_number_2']
+    data = data.copy()
+    data['pdb_code'] = data['pdb_id'].astype(str).str.lower()
+    for col in ['chain_1', 'chain_2', 'nt_type_1', 'nt_type_2']:
+        data[col] = data[col].astype(str)
+    for col in ['nt_number_1', 'nt_number_2']:
+        data[col] = data[col].astype(int)
+    data = data.drop_duplicates(subset=['pdb_code'] + keys)
+    df = pairs.merge(data, on=['pdb_code'] + keys, how='inner')
+
+    # Purine side and its conformation; pairs without a purine are skipped
+    purine_1 = df['nt_type_1'].isin(['A', 'G'])
+    purine_2 = df['nt_type_2'].isin(['A', 'G'])
+    df = df[purine_1 | purine_2].reset_index(drop=True)
+    purine_1 = df['nt_type_1'].isin(['A', 'G'])
+    out = df[['pdb_code', 'resolution'] + keys].copy()
+    out['purine'] = df['nt_type_1'].where(purine_1, df['nt_type_2'])
+    out['chain_purine'] = df['chain_1'].where(purine_1, df['chain_2'])
+    out['nt_purine'] = df['nt_number_1'].where(purine_1, df['nt_number_2'])
+    out['conformation'] = df['chi_1'].where(purine_1, df['chi_2'])
+    out['conformation_bp'] = np.select([out['conformation'] == 'syn', out['conformation'] == 'anti'],
+                                       ['HG', 'WC'], 'Other')
+
+    # Swap WC/HG columns when the deposited purine is syn
+    swap = (out['conformation'] == 'syn').to_numpy()
+    for metric, template in STATE_COLUMNS.items():
+        col_wc = pd.to_numeric(df.get(template.format(s='WC')), errors='coerce')
+        col_hg = pd.to_numeric(df.get(template.format(s='HG')), errors='coerce')
+        out[f'{metric}_wc'] = np.where(swap, col_hg, col_wc).astype(float)
+        out[f'{metric}_hg'] = np.where(swap, col_wc, col_hg).astype(float)
+    for metric in ['rscc', 'edia', 'clash_bp', 'clash_neigh', 'rwork', 'rfree']:
+        out[f'{metric}_diff'] = out[f'{metric}_wc'] - out[f'{metric}_hg']
+
+    # Interpretations; the core four decide by majority vote
+    out['interp_RSCC'] = interpret_diff(out['rscc_diff'], 0.007)
+    out['interp_EDIA'] = interpret_diff(out['edia_diff'], 0.010)
+    out['interp_Clashscore bp'] = interpret_diff(out['clash_bp_diff'], None)
+    out['interp_Clashscore neighbour'] = interpret_diff(out['clash_neigh_diff'], None)
+    for metric, name in [('rwork', 'R-work'), ('rfree', 'R-free')]:
+        d = out[f'{metric}_diff']
+        out[f'interp_{name}'] = pd.Series(np.where(d.abs() > 0.01, "Highlight in Red", "Normal"),
+                                          index=d.index, dtype=object).where(d.notna(), None)
+
+    votes = out[[f'interp_{k}' for k in CORE_METRICS]]
+    wc_count = (votes == "WC").sum(axis=1)
+    hg_count = (votes == "HG").sum(axis=1)
+    overall = pd.Series(np.select([wc_count > hg_count, hg_count > wc_count], ["WC", "HG"], "Ambiguous"),
+                        index=out.index, dtype=object)
+
+    # Poor density override
+    poor_density = (out['edia_hg'] < 0.5) & (out['edia_wc'] < 0.5)
+    overall[poor_density] = "Poor electron density"
+
+    # Failure reason / occupancy override when every metric is missing
+    state_cols = [f'{m}_{s}' for m in STATE_COLUMNS for s in ('wc', 'hg')]
+    all_missing = out[state_cols].isna().all(axis=1)
+    for i in out.index[all_missing]:
+        overall[i] = failure_classification(*(out.at[i, k] for k in ['pdb_code'] + keys),
+                                            out.at[i, 'chain_purine'], out.at[i, 'nt_purine'])
+    out['overall_result'] = overall
+    return out
+
+def format_results(classified):
+    """Format a classify_table() frame as the columns of RESULTS_HEADER."""
+    c = classified
+    return pd.DataFrame({
+        'pdb_id': c['pdb_code'], 'resolution': c['resolution'],
+        'chain_1': c['chain_1'], 'nt_type_1': c['nt_type_1'], 'nt_number_1': c['nt_number_1'],
+        'chain_2': c['chain_2'], 'nt_type_2': c['nt_type_2'], 'nt_number_2': c['nt_number_2'],
+        'RSCC_WC': format_column(c['rscc_wc']), 'RSCC_HG': format_column(c['rscc_hg']),
+        'delta_RSCC': format_column(c['rscc_diff']),
+        'EDIA_WC': format_column(c['edia_wc']), 'EDIA_HG': format_column(c['edia_hg']),
+        'delta_EDIA': format_column(c['edia_diff']),
+        'Clashscore_bp_WC': format_column(c['clash_bp_wc'], 1), 'Clashscore_bp_HG': format_column(c['clash_bp_hg'], 1),
+        'delta_Clashscore_bp': format_column(c['clash_bp_diff'], 1),
+        'Clashscore_neighbour_WC': format_column(c['clash_neigh_wc'], 1),
+        'Clashscore_neighbour_HG': format_column(c['clash_neigh_hg'], 1),
+        'delta_Clashscore_neighbour': format_column(c['clash_neigh_diff'], 1),
+        'Clashscore_global_WC': format_column(c['clash_global_wc'], 1),
+        'Clashscore_global_HG': format_column(c['clash_global_hg'], 1),
+        'R_work_WC': format_column(c['rwork_wc']), 'R_work_HG': format_column(c['rwork_hg']),
+        'delta_R_work': format_column(c['rwork_diff']),
+        'R_free_WC': format_column(c['rfree_wc']), 'R_free_HG': format_column(c['rfree_hg']),
+        'delta_R_free': format_column(c['rfree_diff']),
+        'B_factor_WC': format_column(c['b_wc'], 1), 'B_factor_HG': format_column(c['b_hg'], 1),
+        'Initial_conformation': c['conformation_bp'],
+        'classification': c['overall_result'],
+    })
+
+def classified_records(classified):
+    """Turn a classify_table() frame into report records for render_reports.py."""
+    from render_reports import report_paths
+    records = []
+    for rec in classified.to_dict('records'):
+        rec['interpretations'] = {k: rec.pop(f'interp_{k}') for k in INTERPRETED_METRICS}
+        rec['base_path'], rec['images'] = report_paths(
+            rec['pdb_code'], rec['chain_1'], rec['nt_number_1'], rec['chain_2'], rec['nt_number_2'],
+            rec['chain_purine'], rec['nt_purine'], rec['conformation'])
+        records.append(rec)
+    return records
+
+def classify_all(pair_table=PAIR_TABLE, results_file=RESULTS_FILE):
+    """Rewrite results_file by classifying every pair of pair_table in one pass (no PDFs)."""
+    data = load_combined_table()
+    if data is None:
+        print(f" Error: Combined metrics table not found: {COMBINED_TABLE}", file=sys.stderr)
         return False
+    results = format_results(classify_table(data, load_pair_table(pair_table))).astype(str)
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    conn = metrics_store.connect()
+    try:
+        metrics_store.replace_results(conn, "classification", results.values.tolist())
+    finally:
+        conn.close()
+    with open(results_file, "w") as f:
+        f.write(RESULTS_HEADER)
+        for line in results.agg(" ".join, axis=1):
+            f.write(line + "\n")
+    print(f" Classified {len(results)} pairs into {results_file}")
+    return True
 
 # -------------------------
 # Main
 # -------------------------
 if __name__ == "__main__":
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "--classify-all":
+        # Reclassify the whole run from the combined table, without rendering PDFs
+        if not classify_all(sys.argv[2] if len(sys.argv) == 3 else PAIR_TABLE):
+            sys.exit(1)
+        sys.exit(0)
+
+    # --no-pdf: classify only; render later with render_reports.py
+    no_pdf = "--no-pdf" in sys.argv[1:]
+    if no_pdf:
+        sys.argv.remove("--no-pdf")
+
     if len(sys.argv) != 11:
-        print("Usage: python3 make_report.py <pdb_code> <resolution> <chain_1> <nt_type_1> <nt_number_1> <chain_2> <nt_type_2> <nt_number_2> <chi_1> <chi_2>", file=sys.stderr)
+        print("Usage: python3 make_report.py <pdb_code> <resolution> <chain_1> <nt_type_1> <nt_number_1> <chain_2> <nt_type_2> <nt_number_2> <chi_1> <chi_2> [--no-pdf]", file=sys.stderr)
+        print("       python3 make_report.py --classify-all [PairTable_X_ray.csv]", file=sys.stderr)
         sys.exit(1)
 
     # Parse arguments
@@ -144,40 +375,48 @@ if __name__ == "__main__":
     chi_1 = sys.argv[9]
     chi_2 = sys.argv[10]
 
-    # Check if combined table exists
-    if not os.path.exists(COMBINED_TABLE):
-        print(f" Error: Combined metrics table not found: {COMBINED_TABLE}", file=sys.stderr)
-        sys.exit(1)
+    # Look the entry up in the metrics store, falling back to the flat table
+    row = None
+    if os.path.exists(metrics_store.STORE_PATH):
+        conn = metrics_store.connect()
+        row = metrics_store.fetch_combined(conn, metrics_store.key_tuple(
+            pdb_code, chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2))
+        conn.close()
+
+    if row is None:
+        # Check if combined table exists
+        if not os.path.exists(COMBINED_TABLE):
+            print(f" Error: Combined metrics table not found: {COMBINED_TABLE}", file=sys.stderr)
+            sys.exit(1)
 
-    # Load the data
-    try:
-        data = pd.read_csv(COMBINED_TABLE, sep=r'\s+')
-    except Exception as e:
-        print(f" Error reading combined table: {e}", file=sys.stderr)
-        sys.exit(1)
+        # Load the data
+        try:
+            data = pd.read_csv(COMBINED_TABLE, sep=r'\s+')
+        except Exception as e:
+            print(f" Error reading combined table: {e}", file=sys.stderr)
+            sys.exit(1)
 
-    # Find the specific entry
-    mask = (
-        (data['pdb_id'].str.lower() == pdb_code) &
-        (data['chain_1'] == chain_1) &
-        (data['nt_type_1'] == nt_type_1) &
-        (data['nt_number_1'] == nt_number_1) &
-        (data['chain_2'] == chain_2) &
-        (data['nt_type_2'] == nt_type_2) &
-        (data['nt_number_2'] == nt_number_2)
-    )
-    
-    matching_rows = data[mask]
-    
-    if len(matching_rows) == 0:
-        print(f" Error: No entry found for {pdb_code} {chain_1} {nt_type_1} {nt_number_1} {chain_2} {nt_type_2} {nt_number_2}")
-        sys.exit(1)
-    
-    if len(matching_rows) > 1:
-        print(f"  Warning: Multiple entries found, using the first one")
-    
-    row_index = matching_rows.index[0]
-    row = matching_rows.iloc[0]
+        # Find the specific entry
+        mask = (
+            (data['pdb_id'].str.lower() == pdb_code) &
+            (data['chain_1'] == chain_1) &
+            (data['nt_type_1'] == nt_type_1) &
+            (data['nt_number_1'] == nt_number_1) &
+            (data['chain_2'] == chain_2) &
+            (data['nt_type_2'] == nt_type_2) &
+            (data['nt_number_2'] == nt_number_2)
+        )
+        
+        matching_rows = data[mask]
+        
+        if len(matching_rows) == 0:
+            print(f" Error: No entry found for {pdb_code} {chain_1} {nt_type_1} {nt_number_1} {chain_2} {nt_type_2} {nt_number_2}")
+            sys.exit(1)
+        
+        if len(matching_rows) > 1:
+            print(f"  Warning: Multiple entries found, using the first one")
+        
+        row = matching_rows.iloc[0]
 
     # Create output directory
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
@@ -334,150 +573,52 @@ if __name__ == "__main__":
         if poor_density:
             overall_result = "Poor electron density"
 
-        # Error override - check occupancy first
+        # Error override - the journal's failure reason, else the occupancy check
         if all_missing:
-            # Check occupancy file
-            occupancy_file = os.path.join(PATH_TO_IMAGES, f'{pdb_code}_{chain_purine}_{nt_purine}', 'WC', 'occupancy')
-            if os.path.exists(occupancy_file):
-                try:
-                    with open(occupancy_file, 'r') as f:
-                        occupancy_value = f.read().strip()
-                        # Check if occupancy is not equal to 1
-                        try:
-                            occ_float = float(occupancy_value)
-                            if abs(occ_float - 1.0) > 0.001:
-                                overall_result = "Occupancy_not_1"
-                            else:
-                                overall_result = "Error"
-                        except ValueError:
-                            overall_result = "Error"
-                except Exception as e:
-                    print(f"  Warning: Could not read occupancy file: {e}")
-                    overall_result = "Error"
-            else:
-                overall_result = "Error"
-
-        # Create a new file with metrics + classification
-        RESULTS_FILE = "classification_files/classification_results.txt"
-        
-        # Prepare the output line with all metrics and classification
-        output_line = (
-            f"{pdb_code} {resolution} {chain_1} {nt_type_1} {nt_number_1} "
-            f"{chain_2} {nt_type_2} {nt_number_2} "
-            f"{format_value(rscc_wc)} {format_value(rscc_hg)} {format_value(rscc_diff)} "
-            f"{format_value(edia_wc)} {format_value(edia_hg)} {format_value(edia_diff)} "
-            f"{format_value(clash_bp_wc, 1)} {format_value(clash_bp_hg, 1)} {format_value(clash_bp_diff, 1)} "
-            f"{format_value(clash_neigh_wc, 1)} {format_value(clash_neigh_hg, 1)} {format_value(clash_neigh_diff, 1)} "
-            f"{format_value(clash_global_wc, 1)} {format_value(clash_global_hg, 1)} "
-            f"{format_value(rwork_wc)} {format_value(rwork_hg)} {format_value(rwork_diff)} "
-            f"{format_value(rfree_wc)} {format_value(rfree_hg)} {format_value(rfree_diff)} "
-            f"{format_value(b_wc, 1)} {format_value(b_hg, 1)} "
-            f"{conformation_bp} "
-            f"{overall_result}\n"
-        )
-        
-        # Create header if file doesn't exist
-        os.makedirs("classification_files", exist_ok=True)
-        if not os.path.exists(RESULTS_FILE):
-            header = (
-                "pdb_id resolution chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 "
-                "RSCC_WC RSCC_HG delta_RSCC "
-                "EDIA_WC EDIA_HG delta_EDIA "
-                "Clashscore_bp_WC Clashscore_bp_HG delta_Clashscore_bp "
-                "Clashscore_neighbour_WC Clashscore_neighbour_HG delta_Clashscore_neighbour "
-                "Clashscore_global_WC Clashscore_global_HG "
-                "R_work_WC R_work_HG delta_R_work "
-                "R_free_WC R_free_HG delta_R_free "
-                "B_factor_WC B_factor_HG "
-                "Initial_conformation "
-                "classification\n"
-            )
-            with open(RESULTS_FILE, 'w') as f:
-                f.write(header)
-        
-        # Append the new result
-        with open(RESULTS_FILE, 'a') as f:
-            f.write(output_line)
-
-        # Create plot with 2 rows and 2 columns
-        with PdfPages(OUTPUT_PDF) as pdf:
-            fig = plt.figure(figsize=(14, 16))
-            
-            # Create grid: 2 rows for images, space at bottom for text
-            gs = fig.add_gridspec(3, 2, height_ratios=[1, 1, 0.5], hspace=0.15, wspace=0.1)
-            
-            # Top row - 90 degree rotated views
-            ax_hg_90 = fig.add_subplot(gs[0, 0])
-            ax_wc_90 = fig.add_subplot(gs[0, 1])
-            
-            # Bottom row - original views
-            ax_hg = fig.add_subplot(gs[1, 0])
-            ax_wc = fig.add_subplot(gs[1, 1])
-
-            # HG 90° image
-            if os.path.exists(hg_image_90):
-                ax_hg_90.imshow(plt.imread(hg_image_90))
-                ax_hg_90.set_title(f'{purine}(syn) Model - HG (90° rotation)')
-            else:
-                ax_hg_90.text(0.5, 0.5, f'{purine}(syn) 90° image not found', 
-                             ha='center', va='center')
-            ax_hg_90.axis('off')
-
-            # WC 90° image
-            if os.path.exists(wc_image_90):
-                ax_wc_90.imshow(plt.imread(wc_image_90))
-                ax_wc_90.set_title(f'{purine}(anti) Model - WC (90° rotation)')
-            else:
-                ax_wc_90.text(0.5, 0.5, f'{purine}(anti) 90° image not found', 
-                             ha='center', va='center')
-            ax_wc_90.axis('off')
-
-            # HG image
-            if os.path.exists(hg_image):
-                ax_hg.imshow(plt.imread(hg_image))
-                ax_hg.set_title(f'{purine}(syn) Model - HG')
-            else:
-                ax_hg.text(0.5, 0.5, f'{purine}(syn) image not found', 
-                          ha='center', va='center')
-            ax_hg.axis('off')
-
-            # WC image
-            if os.path.exists(wc_image):
-                ax_wc.imshow(plt.imread(wc_image))
-                ax_wc.set_title(f'{purine}(anti) Model - WC')
-            else:
-                ax_wc.text(0.5, 0.5, f'{purine}(anti) image not found', 
-                          ha='center', va='center')
-            ax_wc.axis('off')
-
-            # Format metrics text
-            metric_text = f"""
-PDB ID: {pdb_code} | Resolution: {resolution} Å
-Chains: {chain_1}, {chain_2} | Nucleotides: {nt_type_1}.{nt_number_1} : {nt_type_2}.{nt_number_2}
-Original conformation: {purine}({conformation}) - {conformation_bp}
-
-Metric                      HG        WC        Δ(WC - HG)  Favours
-------------------------------------------------------------------
-RSCC                        {format_value(rscc_hg):>9} {format_value(rscc_wc):>9} {format_value(rscc_diff):>10} {interpretations['RSCC'] or 'N/A'}
-EDIA                        {format_value(edia_hg):>9} {format_value(edia_wc):>9} {format_value(edia_diff):>10} {interpretations['EDIA'] or 'N/A'}
-Clashscore bp               {format_value(clash_bp_hg, 1):>9} {format_value(clash_bp_wc, 1):>9} {format_value(clash_bp_diff, 1):>10} {interpretations['Clashscore bp'] or 'N/A'}
-Clashscore neighbour        {format_value(clash_neigh_hg, 1):>9} {format_value(clash_neigh_wc, 1):>9} {format_value(clash_neigh_diff, 1):>10} {interpretations['Clashscore neighbour'] or 'N/A'}
-Clashscore global           {format_value(clash_global_hg, 1):>9} {format_value(clash_global_wc, 1):>9}
-R-work                      {format_value(rwork_hg):>9} {format_value(rwork_wc):>9} {format_value(rwork_diff):>10} {interpretations['R-work'] or 'N/A'}
-R-free                      {format_value(rfree_hg):>9} {format_value(rfree_wc):>9} {format_value(rfree_diff):>10} {interpretations['R-free'] or 'N/A'}
-B-factor (purine avg)       {format_value(b_hg, 1):>9} {format_value(b_wc, 1):>9}
-"""
-            fig.text(0.05, 0.12, metric_text, fontsize=10, family='monospace')
-            fig.text(0.05, 0.08, f"Overall Result: {overall_result}", 
-                    fontsize=12, family='monospace', weight='bold')
-
-            pdf.savefig(fig)
-            plt.close(fig)
-
-        # AFTER generating the PDF, check if we need to delete the folder
-        if overall_result in ["Poor electron density", "WC"]:
-            folder_to_delete = base_path
-            delete_folder_safely(folder_to_delete)
+            overall_result = failure_classification(pdb_code, chain_1, nt_type_1, nt_number_1,
+                                                    chain_2, nt_type_2, nt_number_2, chain_purine, nt_purine)
+
+        # Record the metrics + classification (and its line in RESULTS_FILE)
+        metrics_store.record_result("classification", [
+            pdb_code, resolution, chain_1, nt_type_1, nt_number_1,
+            chain_2, nt_type_2, nt_number_2,
+            format_value(rscc_wc), format_value(rscc_hg), format_value(rscc_diff),
+            format_value(edia_wc), format_value(edia_hg), format_value(edia_diff),
+            format_value(clash_bp_wc, 1), format_value(clash_bp_hg, 1), format_value(clash_bp_diff, 1),
+            format_value(clash_neigh_wc, 1), format_value(clash_neigh_hg, 1), format_value(clash_neigh_diff, 1),
+            format_value(clash_global_wc, 1), format_value(clash_global_hg, 1),
+            format_value(rwork_wc), format_value(rwork_hg), format_value(rwork_diff),
+            format_value(rfree_wc), format_value(rfree_hg), format_value(rfree_diff),
+            format_value(b_wc, 1), format_value(b_hg, 1),
+            conformation_bp,
+            overall_result,
+        ])
+
+        # With --no-pdf, rendering is left to render_reports.py
+        if no_pdf:
+            sys.exit(0)
+
+        # render_reports imports this module, so import it only when a PDF is drawn
+        import render_reports
+        record = {
+            'pdb_code': pdb_code, 'resolution': resolution,
+            'chain_1': chain_1, 'nt_type_1': nt_type_1, 'nt_number_1': nt_number_1,
+            'chain_2': chain_2, 'nt_type_2': nt_type_2, 'nt_number_2': nt_number_2,
+            'purine': purine, 'conformation': conformation, 'conformation_bp': conformation_bp,
+            'images': {'hg': hg_image, 'wc': wc_image, 'hg_90': hg_image_90, 'wc_90': wc_image_90},
+            'base_path': base_path,
+            'rscc_wc': rscc_wc, 'rscc_hg': rscc_hg, 'rscc_diff': rscc_diff,
+            'edia_wc': edia_wc, 'edia_hg': edia_hg, 'edia_diff': edia_diff,
+            'clash_bp_wc': clash_bp_wc, 'clash_bp_hg': clash_bp_hg, 'clash_bp_diff': clash_bp_diff,
+            'clash_neigh_wc': clash_neigh_wc, 'clash_neigh_hg': clash_neigh_hg, 'clash_neigh_diff': clash_neigh_diff,
+            'clash_global_wc': clash_global_wc, 'clash_global_hg': clash_global_hg,
+            'rwork_wc': rwork_wc, 'rwork_hg': rwork_hg, 'rwork_diff': rwork_diff,
+            'rfree_wc': rfree_wc, 'rfree_hg': rfree_hg, 'rfree_diff': rfree_diff,
+            'b_wc': b_wc, 'b_hg': b_hg,
+            'interpretations': interpretations,
+            'overall_result': overall_result,
+        }
+        render_reports.render_pdf(OUTPUT_PDF, [record])
 
     except Exception as e:
         print(f" Error processing entry: {e}")
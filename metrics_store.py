@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+"""
+Keyed SQLite store of the per-pair results.
+
+The metric scripts and make_report.py record their row of each pair with
+record_result(): one transaction per row, upserted into a typed table per
+source (REAL/INTEGER/TEXT columns, NULL for a missing value) keyed on
+(pdb_id, chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2).
+Writers from any number of processes are serialised by SQLite's write lock,
+and the line of the source's text file in classification_files/ is appended
+under the same lock, header included, so those files no longer race.  The
+text files are a compatibility copy: export_results() (--export) rewrites
+them from the tables, e.g. after a pair was rerun and its row replaced.
+
+Summary files written by other tools are still ingested incrementally (only
+the bytes appended since the last call are parsed) into one table per
+source, and the combined metrics are kept in a table on the same key.
+Single-row lookups and upserts therefore cost an index probe instead of a
+full re-read of every text file.
+
+Usage:
+    python3 metrics_store.py --record <source> <field> ... [--root DIR]
+    python3 metrics_store.py --get <source> <pdb_id> <chain_1> <nt_type_1> <nt_number_1> <chain_2> <nt_type_2> <nt_number_2>
+    python3 metrics_store.py --export [<source> ...]
+"""
+import os
+import sys
+import fcntl
+import sqlite3
+from contextlib import contextmanager
+
+# -------------------------
+# Config
+# -------------------------
+STORE_PATH = "classification_files/metrics.sqlite"
+
+KEY_COLUMNS = ['pdb_id', 'chain_1', 'nt_type_1', 'nt_number_1', 'chain_2', 'nt_type_2', 'nt_number_2']
+
+# Tokens that pd.read_csv would turn into NaN
+NA_TOKENS = {'', 'None', 'NA', 'N/A', 'NaN', 'nan', 'NULL', 'null', '-nan'}
+
+KEY_TYPES = [('pdb_id', "TEXT"), ('chain_1', "TEXT"), ('nt_type_1', "TEXT"), ('nt_number_1', "INTEGER"),
+             ('chain_2', "TEXT"), ('nt_type_2', "TEXT"), ('nt_number_2', "INTEGER")]
+
+def _real(*names):
+    return [(name, "REAL") for name in names]
+
+# Per-pair results: {source: text file, its columns (name, type) in file order, token written for NULL,
+# decimals of the columns its writer formats to a fixed precision (the others are exported in shortest form)}
+RESULTS = {
+    'rvalues': {
+        'path': "classification_files/R_values_summary.txt", 'na': "NA",
+        'columns': KEY_TYPES + _real('r_total_WC', 'r_work_WC', 'r_free_WC', 'r_total_HG', 'r_work_HG', 'r_free_HG'),
+        'decimals': 4,
+    },
+    'rscc': {
+        'path': "classification_files/RSCC_summary.txt", 'na': "NA",
+        'columns': KEY_TYPES + _real('RSCC_WC', 'RSCC_HG'),
+        'decimals': 4,
+    },
+    'edia': {
+        'path': "classification_files/EDIA_summary.txt", 'na': "None",
+        'columns': KEY_TYPES + _real('WC_edia', 'HG_edia'),
+    },
+    'clashscore': {
+        'path': "classification_files/clashscore_summary.txt", 'na': "None",
+        'columns': KEY_TYPES + _real('WC_clashscore_global', 'HG_clashscore_global', 'WC_clashscore_bp',
+                                     'HG_clashscore_bp', 'WC_clashscore_neighbour', 'HG_clashscore_neighbour'),
+    },
+    'bfactor': {
+        'path': "classification_files/Bfactor_summary.txt", 'na': "None",
+        'columns': KEY_TYPES + _real('mean_B_HG', 'mean_B_WC'),
+    },
+    'classification': {
+        'path': "classification_files/classification_results.txt", 'na': "NA",
+        'columns': KEY_TYPES[:1] + [('resolution', "TEXT")] + KEY_TYPES[1:] + _real(
+            'RSCC_WC', 'RSCC_HG', 'delta_RSCC', 'EDIA_WC', 'EDIA_HG', 'delta_EDIA',
+            'Clashscore_bp_WC', 'Clashscore_bp_HG', 'delta_Clashscore_bp',
+            'Clashscore_neighbour_WC', 'Clashscore_neighbour_HG', 'delta_Clashscore_neighbour',
+            'Clashscore_global_WC', 'Clashscore_global_HG',
+            'R_work_WC', 'R_work_HG', 'delta_R_work', 'R_free_WC', 'R_free_HG', 'delta_R_free',
+            'B_factor_WC', 'B_factor_HG') + [('Initial_conformation', "TEXT"), ('classification', "TEXT")],
+        'decimals': {'Clashscore': 1, 'B_factor': 1, '': 3},
+    },
+}
+
+# -------------------------
+# Helpers
+# -------------------------
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def key_ddl():
+    return ("pdb_id TEXT COLLATE NOCASE, chain_1 TEXT, nt_type_1 TEXT, nt_number_1 INTEGER, "
+            "chain_2 TEXT, nt_type_2 TEXT, nt_number_2 INTEGER")
+
+def key_tuple(pdb_id, chain_1, nt_type_1, nt_number_1, chain_2, nt_type_2, nt_number_2):
+    return (str(pdb_id), str(chain_1), str(nt_type_1), int(nt_number_1),
+            str(chain_2), str(nt_type_2), int(nt_number_2))
+
+def parse_token(tok):
+    """Convert one whitespace-separated field the way pd.read_csv would (NaN -> None)."""
+    if tok in NA_TOKENS:
+        return None
+    try:
+        return float(tok)
+    except ValueError:
+        return tok
+
+def connect(path=STORE_PATH):
+    """Open (and create if needed) the metrics store."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS ingested ("
+                 "source TEXT PRIMARY KEY, path TEXT, inode INTEGER, offset INTEGER, header TEXT)")
+    return conn
+
+def ensure_table(conn, table, value_columns):
+    """Create table (keyed on KEY_COLUMNS) or add any value columns it is missing."""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {quote(table)} ({key_ddl()}, "
+                 f"PRIMARY KEY ({', '.join(KEY_COLUMNS)}))")
+    existing = {r[1] for r in conn.execute(f"PRAGMA table_info({quote(table)})")}
+    for col in value_columns:
+        if col not in existing:
+            conn.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(col)}")
+
+# -------------------------
+# Summary files
+# -------------------------
+def ingest_summary(conn, source, path):
+    """
+    Ingest the lines appended to the summary file at `path` since the last call.
+    As with the first-match lookup of the text tables, the first row of a key wins.
+    If the file was truncated or replaced, the source is re-ingested from scratch.
+    Return the number of new data lines read.
+    """
+    table = f"summary_{source}"
+    if not os.path.exists(path):
+        return 0
+
+    st = os.stat(path)
+    row = conn.execute("SELECT inode, offset, header FROM ingested WHERE source = ?", (source,)).fetchone()
+    if row is None or row[0] != st.st_ino or row[1] > st.st_size:
+        conn.execute(f"DROP TABLE IF EXISTS {quote(table)}")
+        offset, header = 0, None
+    else:
+        offset, header = row[1], row[2]
+    if offset == st.st_size:
+        return 0
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    # only consume complete lines; a partially written last line is read next time
+    end = data.rfind(b"\n") + 1
+    lines = data[:end].decode().splitlines()
+
+    if header is None and lines:
+        header = lines.pop(0)
+    columns = header.split() if header else []
+    value_columns = [c for c in columns if c not in KEY_COLUMNS]
+
+    n = 0
+    if columns:
+        ensure_table(conn, table, value_columns)
+        sql = (f"INSERT OR IGNORE INTO {quote(table)} ({', '.join(quote(c) for c in columns)}) "
+               f"VALUES ({', '.join('?' * len(columns))})")
+        records = []
+        for line in lines:
+            fields = line.split()
+            if len(fields) != len(columns):
+                continue
+            try:
+                rec = dict(zip(columns, fields))
+                key = key_tuple(*(rec[k] for k in KEY_COLUMNS))
+            except (KeyError, ValueError):
+                continue
+            key_vals = dict(zip(KEY_COLUMNS, key))
+            records.append([key_vals[c] if c in key_vals else parse_token(rec[c]) for c in columns])
+        conn.executemany(sql, records)
+        n = len(records)
+
+    conn.execute("INSERT OR REPLACE INTO ingested (source, path, inode, offset, header) VALUES (?, ?, ?, ?, ?)",
+                 (source, path, st.st_ino, offset + end, header))
+    conn.commit()
+    return n
+
+def ingest_summaries(conn, summary_files):
+    """Incrementally ingest every {source: path} summary file."""
+    return {source: ingest_summary(conn, source, path) for source, path in summary_files.items()}
+
+def get_summary_row(conn, source, key):
+    """Return {column: value} of `source` for key, or None if the key (or source) is unknown."""
+    table = f"summary_{source}"
+    try:
+        cur = conn.execute(f"SELECT * FROM {quote(table)} WHERE "
+                           + " AND ".join(f"{c} = ?" for c in KEY_COLUMNS), key)
+    except sqlite3.OperationalError:
+        return None
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip([d[0] for d in cur.description], row))
+
+# -------------------------
+# Results
+# -------------------------
+def result_table(source):
+    return f"result_{source}"
+
+def typed(value, sqltype):
+    """A field converted to its column type; NA tokens, NaN and unparsable numbers become None."""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if sqltype == "TEXT":
+        return str(value)
+    if isinstance(value, str) and value.strip() in NA_TOKENS:
+        return None
+    try:
+        return int(value) if sqltype == "INTEGER" else float(value)
+    except (TypeError, ValueError):
+        return None
+
+def ensure_result_table(conn, source):
+    columns = RESULTS[source]['columns']
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {quote(result_table(source))} ("
+                 + ", ".join(f"{quote(c)} {t}" + (" COLLATE NOCASE" if c == 'pdb_id' else "") for c, t in columns)
+                 + f", PRIMARY KEY ({', '.join(KEY_COLUMNS)}))")
+
+def upsert_result(conn, source, values):
+    """Insert or replace the row (a list over the source's columns) of one pair, keeping its rowid."""
+    names = [c for c, _ in RESULTS[source]['columns']]
+    updates = ", ".join(f"{quote(c)} = excluded.{quote(c)}" for c in names if c not in KEY_COLUMNS)
+    conn.execute(f"INSERT INTO {quote(result_table(source))} ({', '.join(quote(c) for c in names)}) "
+                 f"VALUES ({', '.join('?' * len(names))}) "
+                 f"ON CONFLICT ({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates}", values)
+
+@contextmanager
+def locked_file(path):
+    """Hold an exclusive lock on path (opened for appending) while it is written."""
+    with open(path, "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield fh
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+def record_result(source, fields, root="."):
+    """
+    Record one pair's row of `source` (fields in the order of its text file)
+    in the store under root, in one transaction that also appends the line
+    (and the header, for a new file) to the source's text file.
+    """
+    spec = RESULTS[source]
+    if len(fields) != len(spec['columns']):
+        raise ValueError(f"{source}: expected {len(spec['columns'])} fields, got {len(fields)}")
+    values = [typed(v, t) for v, (_, t) in zip(fields, spec['columns'])]
+    text_path = os.path.join(root, spec['path'])
+    os.makedirs(os.path.dirname(text_path), exist_ok=True)
+    conn = connect(os.path.join(root, STORE_PATH))
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        ensure_result_table(conn, source)
+        upsert_result(conn, source, values)
+        with locked_file(text_path) as f:
+            if f.tell() == 0:
+                f.write(" ".join(c for c, _ in spec['columns']) + "\n")
+            f.write(format_line([None if v == "" else v for v in fields], spec['na']))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_result(conn, source, key):
+    """Return {column: value} of `source` for key, or None if the key (or source) is unknown."""
+    try:
+        cur = conn.execute(f"SELECT * FROM {quote(result_table(source))} WHERE "
+                           + " AND ".join(f"{c} = ?" for c in KEY_COLUMNS), key)
+    except sqlite3.OperationalError:
+        return None
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip([d[0] for d in cur.description], row))
+
+def iter_results(conn, source):
+    """Yield the rows of `source` (lists over its columns) in the order they were first recorded."""
+    names = [c for c, _ in RESULTS[source]['columns']]
+    try:
+        yield from conn.execute(f"SELECT {', '.join(quote(c) for c in names)} FROM {quote(result_table(source))} "
+                                f"ORDER BY rowid")
+    except sqlite3.OperationalError:
+        return
+
+def replace_results(conn, source, rows):
+    """Replace every row of `source` by rows (lists over its columns), in one transaction."""
+    columns = RESULTS[source]['columns']
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {quote(result_table(source))}")
+        ensure_result_table(conn, source)
+        for fields in rows:
+            upsert_result(conn, source, [typed(v, t) for v, (_, t) in zip(fields, columns)])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+def column_decimals(source):
+    """[decimals or None] over the columns of `source`; a dict maps column-name prefixes (longest first) to decimals."""
+    spec = RESULTS[source]
+    decimals = spec.get('decimals')
+    out = []
+    for name, sqltype in spec['columns']:
+        if sqltype != "REAL" or decimals is None:
+            out.append(None)
+        elif isinstance(decimals, int):
+            out.append(decimals)
+        else:
+            prefix = max((p for p in decimals if name.startswith(p) or name.startswith("delta_" + p)), key=len)
+            out.append(decimals[prefix])
+    return out
+
+def export_field(value, decimals, na):
+    if decimals is None or value is None:
+        return format_field(value, na)
+    return f"{value:.{decimals}f}"
+
+def export_results(conn, source, path=None):
+    """Rewrite the text file of `source` from the store. Return the number of rows."""
+    spec = RESULTS[source]
+    path = path or spec['path']
+    decimals = column_decimals(source)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    n = 0
+    with open(tmp, "w") as f:
+        f.write(" ".join(c for c, _ in spec['columns']) + "\n")
+        for values in iter_results(conn, source):
+            f.write(" ".join(export_field(v, d, spec['na']) for v, d in zip(values, decimals)) + "\n")
+            n += 1
+    os.replace(tmp, path)
+    return n
+
+def merge_results(src_path, dst_path):
+    """Upsert every result row of the store at src_path into the store at dst_path."""
+    src = connect(src_path)
+    dst = connect(dst_path)
+    try:
+        dst.execute("BEGIN IMMEDIATE")
+        for source in RESULTS:
+            rows = list(iter_results(src, source))
+            if rows:
+                ensure_result_table(dst, source)
+                for values in rows:
+                    upsert_result(dst, source, list(values))
+        dst.commit()
+    finally:
+        src.close()
+        dst.close()
+
+# -------------------------
+# Combined table
+# -------------------------
+def has_combined(conn):
+    try:
+        return conn.execute("SELECT 1 FROM combined LIMIT 1").fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+
+def upsert_combined(conn, row, columns):
+    """
+    Insert or update one combined row (a dict over `columns`, which start with KEY_COLUMNS).
+    Return True if the key was new.
+    """
+    ensure_table(conn, "combined", [c for c in columns if c not in KEY_COLUMNS])
+    key = key_tuple(*(row[k] for k in KEY_COLUMNS))
+    values = [key[KEY_COLUMNS.index(c)] if c in KEY_COLUMNS else row.get(c) for c in columns]
+    where = " AND ".join(f"{c} = ?" for c in KEY_COLUMNS)
+    exists = conn.execute(f"SELECT 1 FROM combined WHERE {where}", key).fetchone() is not None
+    if exists:
+        sets = ", ".join(f"{quote(c)} = ?" for c in columns if c not in KEY_COLUMNS)
+        conn.execute(f"UPDATE combined SET {sets} WHERE {where}",
+                     [v for c, v in zip(columns, values) if c not in KEY_COLUMNS] + list(key))
+    else:
+        conn.execute(f"INSERT INTO combined ({', '.join(quote(c) for c in columns)}) "
+                     f"VALUES ({', '.join('?' * len(columns))})", values)
+    conn.commit()
+    return not exists
+
+def fetch_combined(conn, key):
+    """Return the combined row for key as a dict, or None."""
+    try:
+        cur = conn.execute("SELECT * FROM combined WHERE "
+                           + " AND ".join(f"{c} = ?" for c in KEY_COLUMNS), key)
+    except sqlite3.OperationalError:
+        return None
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip([d[0] for d in cur.description], row))
+
+def iter_combined(conn, columns):
+    """Yield combined rows (as lists over `columns`) in insertion order."""
+    try:
+        yield from conn.execute(f"SELECT {', '.join(quote(c) for c in columns)} FROM combined ORDER BY rowid")
+    except sqlite3.OperationalError:
+        return
+
+def format_field(val, na="None"):
+    """Format one value like DataFrame.to_csv(sep=' ', na_rep=na)."""
+    if val is None:
+        return na
+    if isinstance(val, float) and val != val:
+        return na
+    return str(val)
+
+def format_line(values, na="None"):
+    return " ".join(format_field(v, na) for v in values) + "\n"
+
+def import_combined_file(conn, path, columns):
+    """Load an existing flat combined table into the store (first row of a key wins)."""
+    ensure_table(conn, "combined", [c for c in columns if c not in KEY_COLUMNS])
+    with open(path) as f:
+        header = f.readline().split()
+        records = []
+        for line in f:
+            fields = line.split()
+            if len(fields) != len(header):
+                continue
+            rec = dict(zip(header, fields))
+            try:
+                key = dict(zip(KEY_COLUMNS, key_tuple(*(rec[k] for k in KEY_COLUMNS))))
+            except (KeyError, ValueError):
+                continue
+            records.append([key[c] if c in key else parse_token(rec.get(c, 'None')) for c in columns])
+    conn.executemany(f"INSERT OR IGNORE INTO combined ({', '.join(quote(c) for c in columns)}) "
+                     f"VALUES ({', '.join('?' * len(columns))})", records)
+    conn.commit()
+    return len(records)
+
+def export_combined(conn, path, columns):
+    """Rewrite the flat combined table at `path` from the store. Return the number of rows."""
+    tmp = path + ".tmp"
+    n = 0
+    with open(tmp, "w") as f:
+        f.write(" ".join(columns) + "\n")
+        for values in iter_combined(conn, columns):
+            f.write(format_line(values))
+            n += 1
+    os.replace(tmp, path)
+    return n
+
+def merge_combined(src_path, dst_path):
+    """Upsert every combined row of the store at src_path into the store at dst_path."""
+    src = connect(src_path)
+    dst = connect(dst_path)
+    try:
+        columns = [r[1] for r in src.execute("PRAGMA table_info(combined)")]
+        for values in iter_combined(src, columns):
+            upsert_combined(dst, dict(zip(columns, values)), columns)
+    finally:
+        src.close()
+        dst.close()
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    root = "."
+    if "--root" in args:
+        n = args.index("--root")
+        root = args[n + 1] if n + 1 < len(args) else "."
+        del args[n:n + 2]
+
+    if len(args) >= 2 and args[0] == "--record" and args[1] in RESULTS:
+        try:
+            record_result(args[1], args[2:], root)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f" Error: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    elif len(args) == 9 and args[0] == "--get" and args[1] in RESULTS:
+        conn = connect(os.path.join(root, STORE_PATH))
+        row = get_result(conn, args[1], key_tuple(*args[2:]))
+        conn.close()
+        if row is None:
+            sys.exit(1)
+        for name, value in row.items():
+            print(f"{name} {format_field(value, RESULTS[args[1]]['na'])}")
+
+    elif args and args[0] == "--export":
+        sources = args[1:] or list(RESULTS)
+        unknown = [s for s in sources if s not in RESULTS]
+        if unknown:
+            print(f" Error: unknown sources {' '.join(unknown)} (known: {' '.join(RESULTS)})", file=sys.stderr)
+            sys.exit(1)
+        conn = connect(os.path.join(root, STORE_PATH))
+        for source in sources:
+            n = export_results(conn, source, os.path.join(root, RESULTS[source]['path']))
+            print(f" Exported {n} rows to {RESULTS[source]['path']}")
+        conn.close()
+
+    else:
+        print(__doc__.split("Usage:")[1], file=sys.stderr)
+        sys.exit(1)
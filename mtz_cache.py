@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Persistent, size-bounded cache for PDB-REDO MTZ files.
+
+Files are stored content-addressed as <cache>/objects/<sha256>.mtz and looked
+up through index.json, which maps each pdb_code to its checksum, size and
+last use.  Objects are read-only, since the files placed in run directories
+are hard links to them, and their checksum is verified each time one is
+served; a corrupted object is dropped and downloaded again.  When the cache
+grows beyond its byte budget the least recently used entries are evicted.
+In offline mode only cached files are served.
+
+Usage:
+    python3 mtz_cache.py <pdb_code> <dest.mtz> [--offline]
+    python3 mtz_cache.py --list
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import argparse
+import tempfile
+import http.client
+import urllib.request
+from contextlib import contextmanager
+
+# -------------------------
+# Config
+# -------------------------
+MTZ_URL = "https://pdb-redo.eu/db"
+CACHE_DIR = os.environ.get("HG_MTZ_CACHE", os.path.expanduser("~/.cache/hg_search/mtz"))
+MAX_BYTES = int(os.environ.get("HG_MTZ_CACHE_BYTES", 50 * 1024**3))
+TIMEOUT = 120
+CHUNK = 1 << 20
+
+INDEX_NAME = "index.json"
+LOCK_NAME = ".lock"
+OBJECT_MODE = 0o444
+
+# -------------------------
+# Helpers
+# -------------------------
+def mtz_url(pdb_code, base_url=MTZ_URL):
+    return f"{base_url}/{pdb_code}/{pdb_code}_final.mtz"
+
+@contextmanager
+def locked(cache_dir):
+    """Hold an exclusive lock on the cache index (safe across processes and threads)."""
+    os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+    with open(os.path.join(cache_dir, LOCK_NAME), "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+def load_index(cache_dir):
+    path = os.path.join(cache_dir, INDEX_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f" Warning: unreadable MTZ cache index, starting empty: {e}", file=sys.stderr)
+        return {}
+
+def save_index(cache_dir, index):
+    path = os.path.join(cache_dir, INDEX_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+def object_path(cache_dir, sha):
+    return os.path.join(cache_dir, "objects", f"{sha}.mtz")
+
+def evict(cache_dir, index, max_bytes, keep=None):
+    """
+    Drop least recently used entries until the cached objects fit in max_bytes.
+    An object shared by several pdb_codes is deleted with its last entry.
+    Return the list of evicted pdb_codes.
+    """
+    sizes = {e['sha256']: e['size'] for e in index.values()}
+    total = sum(sizes.values())
+    evicted = []
+    for code in sorted(index, key=lambda c: index[c]['last_used']):
+        if total <= max_bytes:
+            break
+        if code == keep:
+            continue
+        sha = index.pop(code)['sha256']
+        evicted.append(code)
+        if not any(e['sha256'] == sha for e in index.values()):
+            total -= sizes[sha]
+            try:
+                os.remove(object_path(cache_dir, sha))
+            except FileNotFoundError:
+                pass
+    return evicted
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def download(url, cache_dir):
+    """
+    Stream url into a temporary file inside cache_dir.
+    Return (tmp_path, sha256, size), or None on failure.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.join(cache_dir, "objects"), suffix=".part")
+    sha = hashlib.sha256()
+    size = 0
+    ok = False
+    try:
+        with os.fdopen(fd, "wb") as out, urllib.request.urlopen(url, timeout=TIMEOUT) as resp:
+            while True:
+                chunk = resp.read(CHUNK)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+            # read(n) returns short at a dropped connection instead of raising
+            length = resp.headers.get("Content-Length")
+            if length is not None and size != int(length):
+                raise http.client.IncompleteRead(b"", int(length) - size)
+        ok = size > 0
+    except (OSError, ValueError, http.client.HTTPException) as e:
+        print(f" Failed to download {url}: {e}", file=sys.stderr)
+    finally:
+        if not ok:
+            os.remove(tmp)
+    if not ok:
+        return None
+    return tmp, sha.hexdigest(), size
+
+def place(src, dest):
+    """Hard-link src (a read-only cache object) to dest when possible, otherwise copy."""
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+def drop_object(cache_dir, index, sha):
+    """Remove a bad object and every index entry that points to it."""
+    for code in [c for c, e in index.items() if e['sha256'] == sha]:
+        index.pop(code)
+    try:
+        os.remove(object_path(cache_dir, sha))
+    except FileNotFoundError:
+        pass
+
+def serve_cached(pdb_code, dest, cache_dir=CACHE_DIR):
+    """
+    Place the cached MTZ of pdb_code at dest and mark it as used.  Return
+    False on a miss, or if the object no longer matches its checksum.
+    """
+    with locked(cache_dir):
+        index = load_index(cache_dir)
+        entry = index.get(pdb_code)
+        if entry is None:
+            return False
+        path = object_path(cache_dir, entry['sha256'])
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size'] \
+                or file_sha256(path) != entry['sha256']:
+            print(f" Warning: cached MTZ of {pdb_code} is missing or corrupted, fetching it again",
+                  file=sys.stderr)
+            drop_object(cache_dir, index, entry['sha256'])
+            save_index(cache_dir, index)
+            return False
+        # objects stored before they were made read-only
+        if os.stat(path).st_mode & 0o777 != OBJECT_MODE:
+            os.chmod(path, OBJECT_MODE)
+        entry['last_used'] = time.time()
+        save_index(cache_dir, index)
+        place(path, dest)
+        return True
+
+def fetch_mtz(pdb_code, dest, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES, offline=False, base_url=MTZ_URL):
+    """
+    Place the PDB-REDO MTZ of pdb_code at dest, downloading it into the cache on a miss.
+    Return True on success, False if the file is not cached (offline) or cannot be downloaded.
+    """
+    if serve_cached(pdb_code, dest, cache_dir):
+        return True
+    if offline:
+        print(f" MTZ for {pdb_code} not in cache (offline mode)", file=sys.stderr)
+        return False
+
+    result = download(mtz_url(pdb_code, base_url), cache_dir)
+    if result is None:
+        return False
+    tmp, sha, size = result
+    with locked(cache_dir):
+        index = load_index(cache_dir)
+        path = object_path(cache_dir, sha)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.chmod(tmp, OBJECT_MODE)
+            os.replace(tmp, path)
+        index[pdb_code] = {'sha256': sha, 'size': size, 'last_used': time.time()}
+        evict(cache_dir, index, max_bytes, keep=pdb_code)
+        save_index(cache_dir, index)
+        place(path, dest)
+    return True
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch PDB-REDO MTZ files through a local cache.")
+    parser.add_argument("pdb_code", nargs="?")
+    parser.add_argument("dest", nargs="?")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES)
+    parser.add_argument("--offline", action="store_true", help="serve cached files only")
+    parser.add_argument("--url", default=MTZ_URL, help="base URL of the MTZ server")
+    parser.add_argument("--list", action="store_true", help="print the cache index and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        with locked(args.cache_dir):
+            index = load_index(args.cache_dir)
+        for code, e in sorted(index.items(), key=lambda kv: kv[1]['last_used']):
+            print(f"{code} {e['sha256'][:12]} {e['size']} "
+                  f"{time.strftime('%F %T', time.localtime(e['last_used']))}")
+        print(f"{len(index)} entries, {sum(e['size'] for e in index.values())} bytes")
+        sys.exit(0)
+
+    if not args.pdb_code or not args.dest:
+        parser.print_usage(sys.stderr)
+        sys.exit(1)
+
+    ok = fetch_mtz(args.pdb_code, args.dest, args.cache_dir, args.max_bytes, args.offline, args.url)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Omit models (a structure without one nucleotide) for many purines at once.
+
+The refinement scripts build omit.pdb with `sed "/ $chain   $nt  /d"`, one
+pattern per residue-number length, which rescans the whole file for every
+pair and can match the wrong columns (or miss negative numbers).  Here the
+source file is read once, the records of every requested residue are found
+by their columns (chain in column 22, residue number in 23-26, blank
+insertion code in 27, as the sed patterns require), and each omit model is
+written as the runs of lines between them.
+
+ATOM, HETATM, ANISOU, SIGATM, SIGUIJ and TER records of the residue are
+dropped, which are the records the sed patterns also matched.
+
+Usage:
+    python3 omit_models.py <pdb_file> <chain> <resseq> <out.pdb> [<chain> <resseq> <out.pdb> ...]
+"""
+import os
+import sys
+
+# -------------------------
+# Config
+# -------------------------
+RESIDUE_RECORDS = ("ATOM  ", "HETATM", "ANISOU", "SIGATM", "SIGUIJ", "TER   ")
+
+# -------------------------
+# Helpers
+# -------------------------
+def residue_key(line):
+    """(chain, resseq) of a residue record with a blank insertion code, else None."""
+    if not line.startswith(RESIDUE_RECORDS) or len(line) < 27 or line[26] != " ":
+        return None
+    try:
+        return line[21], int(line[22:26])
+    except ValueError:
+        return None
+
+def keep_runs(n_lines, dropped):
+    """(start, stop) runs of line indices in range(n_lines) that are not in the sorted list dropped."""
+    runs = []
+    start = 0
+    for i in dropped:
+        if i > start:
+            runs.append((start, i))
+        start = i + 1
+    if start < n_lines:
+        runs.append((start, n_lines))
+    return runs
+
+def write_omit_models(pdb_file, targets):
+    """
+    Write one omit model per residue of targets, {(chain, resseq): [out_path, ...]},
+    from a single read of pdb_file.  Return {(chain, resseq): number of records dropped}.
+    """
+    with open(pdb_file) as f:
+        lines = f.readlines()
+
+    targets = {(chain, int(resseq)): paths for (chain, resseq), paths in targets.items()}
+    dropped = {key: [] for key in targets}
+    for n, line in enumerate(lines):
+        key = residue_key(line)
+        if key in dropped:
+            dropped[key].append(n)
+
+    for key, paths in targets.items():
+        runs = keep_runs(len(lines), dropped[key])
+        for path in paths:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as out:
+                for start, stop in runs:
+                    out.writelines(lines[start:stop])
+            os.replace(tmp, path)
+    return {key: len(found) for key, found in dropped.items()}
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    if len(sys.argv) < 5 or (len(sys.argv) - 2) % 3:
+        print("Usage: python3 omit_models.py <pdb_file> <chain> <resseq> <out.pdb> [...]", file=sys.stderr)
+        sys.exit(1)
+
+    targets = {}
+    for i in range(2, len(sys.argv), 3):
+        targets.setdefault((sys.argv[i], int(sys.argv[i + 1])), []).append(sys.argv[i + 2])
+    for (chain, resseq), n in write_omit_models(sys.argv[1], targets).items():
+        if n == 0:
+            print(f" Warning: no records of {chain} {resseq} in {sys.argv[1]}", file=sys.stderr)
+        print(f"{chain} {resseq}: {n} records omitted")
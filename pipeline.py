@@ -0,0 +1,685 @@
+#!/usr/bin/env python3
+"""
+Per-pair Hoogsteen pipeline as a sequence of journaled stages.
+
+The steps of read_PDB_MTZ_NT_AT_GT_AC.sh / read_PDB_MTZ_NT_GC.sh are split
+into stages (tuple set-up and occupancy check, omit refinement, WC refinement,
+HG flip and refinement, maps and figures per state), followed by the metric
+scripts that batch_run.sh runs after them.  The stages form a dependency
+graph: a stage starts as soon as the stages before it are finished, so the
+WC and HG branches run side by side (each refining on half of the pair's
+cores) and the metric scripts run concurrently, and when a stage fails the stages that need
+its outputs are skipped with a reason code (e.g. Occupancy_not_1,
+HG_refine_failed) that ends up in the classification instead of "Error".
+
+Each finished stage is written to the pair's journal (see journal.py); when a
+pair is run again, stages whose outputs are still valid are skipped, so an
+interrupted run resumes without redoing refinement or appending duplicate
+summary lines.
+
+The figures and EDIA are computed from the whole maps written by
+phenix.mtz2map.  Only when the pair is packed are the maps of each state
+cropped to a box around the base pair and its neighbours (--crop-padding, 0
+keeps the whole maps), to save space in the archive.  If the pair is run
+again after that, the changed maps no longer match the journal and are
+computed again before any stage that reads them.
+
+The wall time, CPU time and peak RSS of every stage and tool call are
+appended to timings.jsonl (see instrument.py).
+
+Once the report is written, the tuple directory is packed into one
+PDB_without_nt/<tuple>.zip (see tuple_archive.py), which the report and
+metric scripts read in place.  A pair that is run again before it is
+complete (e.g. with --retry-failed) gets its directory unpacked first.
+
+Usage:
+    python3 pipeline.py <pdb_code> <assembly> <reso> <chi_1> <chi_2> <chain_1> <nt_type_1> <nt_number_1>
+                        <chain_2> <nt_type_2> <nt_number_2> [xxxx] [--pdb-path DIR] [--no-pdf] [--retry-failed]
+                        [--stage-workers N] [--nproc N] [--crop-padding A] [--flip-engine] [--clash-engine] [--rscc-engine]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import ccp4_map
+import flip_engine
+import instrument
+import journal
+import mtz_cache
+import omit_models
+import render_server
+import rscc
+import structure_index
+import tuple_archive
+
+# -------------------------
+# Config
+# -------------------------
+PDB_PATH = "/mnt/hdd_04/ec3867/NAFinder/NAFinder_20260108/X-ray/pdb_dssr/"
+MTZ_URL = "https://pdb-redo.eu/db"
+PATH_TO_TUPLES = "PDB_without_nt"
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+REFINE_STRATEGY = "strategy=individual_sites+individual_adp+occupancies"
+
+# Cores of one pair; the omit refinement gets all of them, the WC and HG
+# branches (which run side by side) half each
+NPROC = os.cpu_count() or 1
+
+# Differences between the two refinement scripts, keyed by pair type
+VARIANTS = {
+    'AT': {
+        'script': "./read_PDB_MTZ_NT_AT_GT_AC.sh",
+        'omit_retry': True,          # retry the omit refinement with generated R-free flags
+        'protonate': False,          # protonate the flipped purine before refinement
+        'hg_sites_extra': " and not resname HOH",
+        'hg_extra_args': ["miller_array.labels.name=F-obs"],
+    },
+    'GC': {
+        'script': "./read_PDB_MTZ_NT_GC.sh",
+        'omit_retry': False,
+        'protonate': True,
+        'hg_sites_extra': "",
+        'hg_extra_args': [],
+    },
+}
+PAIR_VARIANTS = {
+    **dict.fromkeys(["AT", "TA", "TG", "GT", "AC", "CA", "AU", "UA", "GU", "UG"], 'AT'),
+    **dict.fromkeys(["GC", "CG"], 'GC'),
+}
+
+# Refined model of each state (file stem, inside <tuple>/<state>/)
+MODEL_STEMS = {
+    'WC': "{pdb}_final_refine_001",
+    'HG': "{pdb}_final_flipped_refine_001_refine_001",
+}
+
+# When the pair is packed, the maps of a state are cropped to the residues within CROP_NEIGHBOURS of
+# either base, plus CROP_PADDING (A) on every side; 0 keeps the whole maps
+CROP_NEIGHBOURS = 2
+CROP_PADDING = 5.0
+
+# In-process replacements of external tools, each used only with --<name>-engine
+# until it has been checked against the tool it replaces
+ENGINES = {
+    'flip': "flip the purine with flip_engine.py instead of PyMOL",
+    'clash': "compute the clashscores with clash_engine.py (on the Reduce-protonated models, the "
+             "global ones against a baseline of the deposited structure) instead of phenix.clashscore",
+    'rscc': "compute the purine RSCC with rscc.py (against an Fc map at the pair's resolution) "
+            "instead of phenix.real_space_correlation",
+}
+
+# Stages of one pair that may run at the same time (the metric stages are independent)
+STAGE_WORKERS = 5
+
+# Reason code recorded when a stage fails; dependent stages are skipped with it
+# and make_report.py reports it instead of "Error" for a pair without metrics
+REASON_CODES = {
+    'setup': "Setup_failed",
+    'omit': "Omit_refine_failed",
+    'wc_refine': "WC_refine_failed",
+    'wc_maps': "WC_maps_failed",
+    'wc_render': "WC_render_failed",
+    'hg_flip': "HG_flip_failed",
+    'hg_refine': "HG_refine_failed",
+    'hg_maps': "HG_maps_failed",
+    'hg_render': "HG_render_failed",
+    'rval': "Rval_failed",
+    'rscc': "RSCC_failed",
+    'edia': "EDIA_failed",
+    'clash': "Clashscore_failed",
+    'bfactor': "Bfactor_failed",
+    'combine': "Combine_failed",
+    'report': "Report_failed",
+    'archive': "Archive_failed",
+}
+
+# Summary tables written by the metric stages: {stage: {source: path}}
+STAGE_ROWS = {
+    'rval': {'rvalues': "classification_files/R_values_summary.txt"},
+    'rscc': {'rscc': "classification_files/RSCC_summary.txt"},
+    'edia': {'edia': "classification_files/EDIA_summary.txt"},
+    'clash': {'clashscore': "classification_files/clashscore_summary.txt"},
+    'bfactor': {'bfactor': "classification_files/Bfactor_summary.txt"},
+    'combine': {'combined': "classification_files/combined_metrics.txt"},
+}
+
+# -------------------------
+# Helpers
+# -------------------------
+class Pair:
+    """One CSV row plus the names derived from it (purine, tuple directory, variant)."""
+    def __init__(self, row, root=".", no_pdf=False, nproc=1, crop_padding=CROP_PADDING, engines=()):
+        self.row = row
+        self.root = root
+        self.no_pdf = no_pdf
+        self.crop_padding = crop_padding
+        self.engines = frozenset(engines)
+        self.nproc = max(1, nproc)
+        self.branch_nproc = max(1, self.nproc // 2)
+        self.pdb = row['pdb_code']
+        self.ids = [row['chain_1'], row['nt_type_1'], row['nt_number_1'],
+                    row['chain_2'], row['nt_type_2'], row['nt_number_2']]
+        self.label = journal.pair_id(self.pdb, *self.ids)
+        self.key = (self.pdb, row['chain_1'], row['nt_type_1'], int(row['nt_number_1']),
+                    row['chain_2'], row['nt_type_2'], int(row['nt_number_2']))
+        self.variant_name = PAIR_VARIANTS.get(f"{row['nt_type_1']}{row['nt_type_2']}")
+        self.variant = VARIANTS.get(self.variant_name)
+
+        # the purine is the residue that is deleted, flipped and scored
+        if row['nt_type_1'] in ("A", "G"):
+            self.chain_purine, self.nt_purine = row['chain_1'], int(row['nt_number_1'])
+        elif row['nt_type_2'] in ("A", "G"):
+            self.chain_purine, self.nt_purine = row['chain_2'], int(row['nt_number_2'])
+        else:
+            self.chain_purine, self.nt_purine = None, None
+
+    def runnable(self):
+        """True if the refinement stages apply (mapped pair type with a purine)."""
+        return self.variant is not None and self.chain_purine is not None
+
+    @property
+    def tuple_rel(self):
+        return os.path.join(PATH_TO_TUPLES, f"{self.pdb}_{self.chain_purine}_{self.nt_purine}")
+
+    def path(self, *parts):
+        """Path relative to the run directory."""
+        return os.path.join(self.tuple_rel, *parts)
+
+    def abspath(self, *parts):
+        return os.path.join(self.root, self.tuple_rel, *parts)
+
+    def model(self, state):
+        return MODEL_STEMS[state].format(pdb=self.pdb)
+
+    def refine_command(self):
+        """The read_PDB_MTZ_NT_*.sh command line that this pipeline replaces (for out.txt)."""
+        cmd = [self.variant['script'], self.pdb, self.pdb, *self.ids]
+        if self.row.get('xxxx'):
+            cmd.append(self.row['xxxx'])
+        return " ".join(cmd)
+
+def run_logged(cmd, cwd, log, stdout=None):
+    """Run cmd in cwd, streaming its output to the open log file. Return the exit code."""
+    log.write(f"Running: {' '.join(cmd)}\n")
+    log.flush()
+    try:
+        return instrument.run(cmd, cwd=cwd, stdout=stdout or log,
+                              stderr=log if stdout else subprocess.STDOUT).returncode
+    except OSError as e:
+        log.write(f" Error: {e}\n")
+        return 127
+
+def append_line(path, line):
+    with open(path, "a") as f:
+        f.write(line + "\n")
+
+def fetch_inputs(pdb_code, assembly, root, pdb_path, log):
+    """Copy the PDB and fetch the MTZ of a structure into root unless already there."""
+    pdb_dest = os.path.join(root, f"{pdb_code}_final.pdb")
+    mtz_dest = os.path.join(root, f"{pdb_code}_final.mtz")
+    if not os.path.exists(pdb_dest):
+        shutil.copyfile(os.path.join(pdb_path, f"{pdb_code}.pdb{assembly}"), pdb_dest)
+    if not os.path.exists(mtz_dest):
+        if not mtz_cache.fetch_mtz(pdb_code, mtz_dest, base_url=MTZ_URL):
+            log.write(f"Failed to download {mtz_cache.mtz_url(pdb_code, MTZ_URL)}\n")
+
+# -------------------------
+# Refinement stages
+# -------------------------
+# Each stage takes (pair, log) and returns (ok, [output paths relative to the run directory]).
+
+def stage_setup(pair, log):
+    """Create the tuple directory, copy the inputs and check the purine occupancy."""
+    pdb_file = os.path.join(pair.root, f"{pair.pdb}_final.pdb")
+    mtz_file = os.path.join(pair.root, f"{pair.pdb}_final.mtz")
+    append_line(os.path.join(pair.root, "delete.txt"), f"{pair.chain_purine} {pair.nt_purine}")
+    for state in ("HG", "WC"):
+        os.makedirs(pair.abspath(state), exist_ok=True)
+        if os.path.exists(pdb_file):
+            shutil.copyfile(pdb_file, pair.abspath(state, f"{pair.pdb}_final.pdb"))
+    if os.path.exists(mtz_file):
+        shutil.copyfile(mtz_file, pair.abspath(f"{pair.pdb}_final.mtz"))
+
+    occupancy = pair.abspath("WC", "occupancy")
+    with open(occupancy, "a") as out:
+        run_logged(["python3", os.path.join(REPO_DIR, "check_occupancy.py"), f"{pair.pdb}_final.pdb",
+                    pair.chain_purine, str(pair.nt_purine)], pair.abspath("WC"), log, stdout=out)
+    with open(occupancy) as f:
+        occ = "".join(f.read().split())
+    ok = occ == "1.000"
+    log.write("occupancy = 1\n" if ok else "occupancy not 1\n")
+    return ok, [pair.path(f"{pair.pdb}_final.mtz"), pair.path("WC", "occupancy")]
+
+def stage_omit(pair, log):
+    """Delete the purine and refine the omit model; copy the omit MTZ into WC/ and HG/."""
+    pdb_file = os.path.join(pair.root, f"{pair.pdb}_final.pdb")
+    omit_file = pair.abspath("omit.pdb")
+    # batch_run.py links in omit.pdb from one pass over the structure for all its pairs
+    prebuilt = os.path.exists(omit_file) and os.path.exists(pdb_file) \
+        and os.path.getmtime(omit_file) >= os.path.getmtime(pdb_file)
+    if not prebuilt and os.path.exists(pdb_file):
+        omit_models.write_omit_models(pdb_file, {(pair.chain_purine, pair.nt_purine): [omit_file]})
+
+    cwd = pair.abspath()
+    mtz = f"{pair.pdb}_final.mtz"
+    run_logged(["phenix.ready_set", "omit.pdb"], cwd, log)
+    if os.path.exists(os.path.join(cwd, "omit.ligands.cif")):
+        append_line(os.path.join(cwd, "phenix.refine.txt"),
+                    f"omit.updated.pdb {mtz} omit.ligands.cif main.number_of_macro_cycles=5")
+        cmd = ["phenix.refine", "omit.updated.pdb", mtz, "omit.ligands.cif", REFINE_STRATEGY,
+               "main.number_of_macro_cycles=5"]
+        products = ["omit.updated_refine_001.mtz", "omit.ligands.cif"]
+    else:
+        append_line(os.path.join(cwd, "phenix.refine.txt"), f"omit.pdb {mtz} main.number_of_macro_cycles=5")
+        cmd = ["phenix.refine", "omit.pdb", mtz, REFINE_STRATEGY, "main.number_of_macro_cycles=5"]
+        products = ["omit_refine_001.mtz"]
+
+    cmd.append(f"nproc={pair.nproc}")
+    ok = run_logged(cmd, cwd, log) == 0 and os.path.exists(os.path.join(cwd, products[0]))
+    if ok:
+        append_line(os.path.join(cwd, "Rfactor_report.txt"), "Refinement without nt")
+    elif pair.variant['omit_retry']:
+        ok = (run_logged(cmd + ["xray_data.r_free_flags.generate=True", "overwrite=true"], cwd, log) == 0
+              and os.path.exists(os.path.join(cwd, products[0])))
+        append_line(os.path.join(cwd, "Rfactor_report.txt"),
+                    "R-free generated" if ok else " Refinement failed")
+
+    outputs = []
+    for name in products:
+        if os.path.exists(os.path.join(cwd, name)):
+            for state in ("WC", "HG"):
+                shutil.copyfile(os.path.join(cwd, name), pair.abspath(state, name))
+                outputs.append(pair.path(state, name))
+    return ok, outputs
+
+def stage_wc_refine(pair, log):
+    """Refine the deposited (WC) model against the omit map."""
+    cwd = pair.abspath("WC")
+    model = f"{pair.pdb}_final"
+    run_logged(["phenix.ready_set", f"{model}.pdb"], cwd, log)
+    if os.path.exists(os.path.join(cwd, f"{model}.ligands.cif")):
+        cmd = ["phenix.refine", f"{model}.pdb", "omit.updated_refine_001.mtz", f"{model}.ligands.cif", REFINE_STRATEGY]
+    else:
+        cmd = ["phenix.refine", f"{model}.pdb", "omit_refine_001.mtz", REFINE_STRATEGY]
+    ok = run_logged(cmd + [f"nproc={pair.branch_nproc}"], cwd, log) == 0
+    stem = pair.model('WC')
+    outputs = [pair.path("WC", f"{stem}.pdb"), pair.path("WC", f"{stem}.mtz")]
+    return ok and os.path.exists(pair.abspath("WC", f"{stem}.pdb")), outputs
+
+def stage_hg_flip(pair, log):
+    """
+    Flip the purine to syn with PyMOL (flip.py / flip_negative.py), or with
+    flip_engine.py if the pair was run with --flip-engine, and protonate it
+    for the GC variant.
+    """
+    cwd = pair.abspath("HG")
+    model = f"{pair.pdb}_final"
+    if "flip" in pair.engines:
+        pdb_file = os.path.join(pair.root, f"{model}.pdb")
+        flipped = os.path.join(cwd, f"{model}_flipped.pdb")
+        # batch_run.py links in the flipped model from one pass over the structure for all its pairs
+        prebuilt = os.path.exists(flipped) and os.path.exists(pdb_file) \
+            and os.path.getmtime(flipped) >= os.path.getmtime(pdb_file)
+        if not prebuilt:
+            log.write(f"flip_engine.py {model} {pair.chain_purine} {pair.nt_purine}\n")
+            try:
+                flip_engine.write_flipped_models(os.path.join(cwd, f"{model}.pdb"),
+                                                 {(pair.chain_purine, pair.nt_purine): [flipped]})
+            except (OSError, ValueError) as e:
+                log.write(f" Error flipping {pair.chain_purine}/{pair.nt_purine}: {e}\n")
+    else:
+        flip = "flip_negative.py" if pair.nt_purine < 0 else "flip.py"
+        log.write(f"flip.py {model} {pair.chain_purine} {pair.nt_purine}\n")
+        run_logged(["python3", os.path.join(REPO_DIR, flip), model, pair.chain_purine, str(pair.nt_purine)],
+                   cwd, log)
+    outputs = [pair.path("HG", f"{model}_flipped.pdb")]
+    if pair.variant['protonate']:
+        run_logged(["python3", os.path.join(REPO_DIR, "protonate.py"), f"{model}_flipped",
+                    pair.chain_purine, str(pair.nt_purine)], cwd, log)
+        outputs.append(pair.path("HG", f"{model}_flipped_protonated.pdb"))
+    return all(os.path.exists(os.path.join(pair.root, p)) for p in outputs), outputs
+
+def stage_hg_refine(pair, log):
+    """Refine the flipped (HG) model: local sites around the purine, then the whole model."""
+    cwd = pair.abspath("HG")
+    v = pair.variant
+    flipped = f"{pair.pdb}_final_flipped"
+    model = f"{flipped}_protonated" if v['protonate'] else flipped
+    ligands = f"{flipped}.ligands.cif"
+    n = pair.nt_purine
+    sites = (f"refine.sites.individual=(chain {pair.chain_purine} and resseq {n - 2}:{n + 2}"
+             f"{v['hg_sites_extra']})")
+
+    run_logged(["phenix.ready_set", f"{flipped}.pdb"], cwd, log)
+    has_ligands = os.path.exists(os.path.join(cwd, ligands))
+    if has_ligands:
+        cmd = ["phenix.refine", f"{model}.pdb", "omit.updated_refine_001.mtz", ligands, sites]
+    else:
+        mtzs = sorted(name for name in os.listdir(cwd) if name.endswith(".mtz"))
+        cmd = ["phenix.refine", f"{model}.pdb", *mtzs, sites]
+    append_line(os.path.join(cwd, "phenix.refine.txt"), " ".join(cmd[1:]))
+    run_logged(cmd + v['hg_extra_args'] + [f"nproc={pair.branch_nproc}"], cwd, log)
+
+    if has_ligands:
+        cmd = ["phenix.refine", f"{model}_refine_001.pdb", "omit.updated_refine_001.mtz", ligands, REFINE_STRATEGY]
+    else:
+        cmd = ["phenix.refine", f"{model}_refine_001.pdb", "omit_refine_001.mtz", REFINE_STRATEGY]
+    append_line(os.path.join(cwd, "phenix.refine.txt"), " ".join(cmd[1:-1]))
+    ok = run_logged(cmd + [f"nproc={pair.branch_nproc}"], cwd, log) == 0
+
+    stem = pair.model('HG')
+    if model != flipped:
+        for ext in ("pdb", "mtz"):
+            src = os.path.join(cwd, f"{model}_refine_001_refine_001.{ext}")
+            if os.path.exists(src):
+                os.replace(src, os.path.join(cwd, f"{stem}.{ext}"))
+    outputs = [pair.path("HG", f"{stem}.pdb"), pair.path("HG", f"{stem}.mtz")]
+    return ok and os.path.exists(pair.abspath("HG", f"{stem}.pdb")), outputs
+
+def stage_maps(pair, state, log):
+    """Compute the 2mFo-DFc and mFo-DFc maps of a refined state."""
+    stem = pair.model(state)
+    ok = run_logged(["phenix.mtz2map", f"{stem}.mtz", f"{stem}.pdb"], pair.abspath(state), log) == 0
+    outputs = [pair.path(state, f"{stem}_2mFo-DFc.ccp4"), pair.path(state, f"{stem}_mFo-DFc.ccp4")]
+    ok = ok and all(os.path.exists(os.path.join(pair.root, p)) for p in outputs)
+    return ok, outputs
+
+def crop_maps(pair, state, maps, log):
+    """
+    Replace the maps of a state by the box around both bases and their
+    CROP_NEIGHBOURS neighbours on each side.  The maps are kept whole if the
+    residues are not found or a map cannot be read.
+    """
+    r = pair.row
+    try:
+        index = structure_index.load(pair.abspath(state, f"{pair.model(state)}.pdb"))
+        sel = np.zeros(len(index), dtype=bool)
+        for chain, nt in ((r['chain_1'], int(r['nt_number_1'])), (r['chain_2'], int(r['nt_number_2']))):
+            for resseq in range(nt - CROP_NEIGHBOURS, nt + CROP_NEIGHBOURS + 1):
+                sel[index.atoms(chain, resseq)] = True
+        if not sel.any():
+            log.write(f"Crop: base pair not found in the {state} model, keeping the whole maps\n")
+            return
+        for path in maps:
+            before = os.path.getsize(path)
+            shape = ccp4_map.crop(path, index.xyz[sel], pair.crop_padding)
+            if shape is None:
+                log.write(f"Crop: {os.path.basename(path)} is no larger than the box, kept whole\n")
+                continue
+            log.write(f"Cropped {os.path.basename(path)} to {'x'.join(map(str, shape))} grid points "
+                      f"({before} -> {os.path.getsize(path)} bytes)\n")
+    except (OSError, ValueError) as e:
+        log.write(f"Crop failed, keeping the whole maps: {e}\n")
+
+def stage_render(pair, state, log):
+    """Render the map/water figures of a refined state on the PyMOL workers of render_server.py."""
+    r = pair.row
+    stem = pair.model(state)
+    png = f"{pair.pdb}_{r['chain_1']}_{r['nt_number_1']}_{r['chain_2']}_{r['nt_number_2']}_{state}_map_water"
+    job = render_server.make_job(pair.abspath(state, f"{stem}.pdb"), pair.abspath(state, f"{stem}_2mFo-DFc.ccp4"),
+                                 pair.abspath(state, f"{stem}_mFo-DFc.ccp4"),
+                                 [(r['chain_1'], r['nt_number_1']), (r['chain_2'], r['nt_number_2'])],
+                                 pair.abspath(state, png), structure=pair.tuple_rel)
+    try:
+        render_server.pool().render(job)
+    except render_server.RenderError as e:
+        log.write(f" Error rendering {png}: {e}\n")
+    log.write("PLOTTING\n")
+    outputs = [pair.path(state, f"{png}.png"), pair.path(state, f"{png}_90.png")]
+    return all(os.path.exists(os.path.join(pair.root, p)) for p in outputs), outputs
+
+# -------------------------
+# Metric stages
+# -------------------------
+def metric_stage(script, per_state=(), options=None):
+    """
+    Stage running one of the metric scripts of batch_run.sh for the pair,
+    with the extra arguments options(pair) if given.
+    """
+    def run(pair, log):
+        interpreter = [] if script.endswith(".sh") else ["python3"]
+        extra = options(pair) if options else []
+        rc = run_logged([*interpreter, os.path.join(REPO_DIR, script), pair.pdb, *pair.ids, *extra], pair.root, log)
+        outputs = [pair.path(state, name) for state in ("WC", "HG") for name in per_state]
+        return rc == 0, outputs
+    return run
+
+def clash_options(pair):
+    return ["--engine-local", "--engine-global"] if "clash" in pair.engines else []
+
+def rscc_options(pair):
+    try:
+        return ["--resolution", str(float(pair.row['reso']))]
+    except (KeyError, ValueError):
+        return []
+
+def stage_rscc(pair, log):
+    """get_rscc.sh, or with the rscc engine rscc.py on the 2mFo-DFc maps of the maps stages."""
+    if "rscc" in pair.engines:
+        return metric_stage("rscc.py", [rscc.REPORT_NAME], rscc_options)(pair, log)
+    return metric_stage("get_rscc.sh", [rscc.PHENIX_REPORT_NAME])(pair, log)
+
+def stage_report(pair, log):
+    r = pair.row
+    cmd = ["python3", os.path.join(REPO_DIR, "make_report.py"), pair.pdb, r['reso'], *pair.ids, r['chi_1'], r['chi_2']]
+    if pair.no_pdf:
+        cmd.append("--no-pdf")
+    rc = run_logged(cmd, pair.root, log)
+    return rc == 0, [] if pair.no_pdf else [os.path.join("reports", f"{pair.label}.pdf")]
+
+def stage_archive(pair, log):
+    """
+    Pack the tuple directory into one archive (tuple_archive.py) in place of
+    its files, with the maps of both states cropped first.
+    """
+    if pair.crop_padding > 0:
+        for state in ("WC", "HG"):
+            stem = pair.model(state)
+            maps = [pair.abspath(state, f"{stem}{suffix}") for suffix in ("_2mFo-DFc.ccp4", "_mFo-DFc.ccp4")]
+            if all(os.path.isfile(path) for path in maps):
+                crop_maps(pair, state, maps, log)
+    try:
+        packed = tuple_archive.pack(pair.abspath())
+    except OSError as e:
+        log.write(f" Error: {e}\n")
+        return False, []
+    # No outputs are fingerprinted: the archive changes when another pair of the same purine is packed into it
+    if packed is None:
+        log.write(f"Archive: no {pair.tuple_rel} to pack\n")
+        return True, []
+    archive, n_files, before, after = packed
+    log.write(f"Packed {n_files} files of {pair.tuple_rel} into {os.path.relpath(archive, pair.root)} "
+              f"({before} -> {after} bytes)\n")
+    return True, []
+
+# (name, function, stages that must have succeeded, stages only waited for).
+# A stage starts once all of them are finished; it is skipped if one it needs
+# did not succeed.  The WC and HG branches only share the omit refinement and
+# run side by side.
+STAGES = [
+    ("setup", stage_setup, [], []),
+    ("omit", stage_omit, ["setup"], []),
+    ("wc_refine", stage_wc_refine, ["omit"], []),
+    ("wc_maps", lambda p, log: stage_maps(p, "WC", log), ["wc_refine"], []),
+    ("wc_render", lambda p, log: stage_render(p, "WC", log), ["wc_maps"], []),
+    ("hg_flip", stage_hg_flip, ["setup"], []),
+    ("hg_refine", stage_hg_refine, ["omit", "hg_flip"], []),
+    ("hg_maps", lambda p, log: stage_maps(p, "HG", log), ["hg_refine"], []),
+    ("hg_render", lambda p, log: stage_render(p, "HG", log), ["hg_maps"], []),
+    ("rval", metric_stage("get_rval.sh"), ["wc_refine", "hg_refine"], []),
+    # rscc.py reads the maps; get_rscc.sh only the refinement outputs
+    ("rscc", stage_rscc, ["wc_refine", "hg_refine"], ["wc_maps", "hg_maps"]),
+    ("edia", metric_stage("edia_runner.py"), ["wc_maps", "hg_maps"], []),
+    ("clash", metric_stage("Clashes.py", options=clash_options), ["wc_refine", "hg_refine"], []),
+    ("bfactor", metric_stage("Bfactor.py"), ["wc_refine", "hg_refine"], []),
+    # combine and report always run, so every pair gets a classification line
+    ("combine", metric_stage("combine_metrics.py"), [], ["rval", "rscc", "edia", "clash", "bfactor"]),
+    ("report", stage_report, [], ["combine", "wc_render", "hg_render"]),
+    ("archive", stage_archive, [], ["report"]),
+]
+
+def is_fatal(pair, stage):
+    """True if a failure of stage ends the refinement script early (its `exit 1`)."""
+    return stage == "setup" or (stage == "omit" and pair.variant['omit_retry'])
+
+def failure_reason(pair, stage):
+    """Reason code of a failed stage; a failed setup is usually an occupancy below 1."""
+    if stage == "setup":
+        try:
+            with open(pair.abspath("WC", "occupancy")) as f:
+                if abs(float(f.read().split()[0]) - 1.0) > 0.001:
+                    return "Occupancy_not_1"
+        except (OSError, ValueError, IndexError):
+            pass
+    return REASON_CODES[stage]
+
+def pair_reason(pair, stage):
+    """Reason code if stage cannot run for this pair at all (no purine, unmapped pair type), or None."""
+    if stage == "setup" and pair.chain_purine is None:
+        return "No_purine"
+    if stage == "setup" and pair.variant is None:
+        return "Unmapped_pair_type"
+    if stage in ("report", "archive") and pair.chain_purine is None:
+        return "No_purine"
+    return None
+
+def run_stage(func, pair, name):
+    """
+    Run one stage with its output collected separately, so concurrent stages do not interleave,
+    and its timings (and those of the tools it runs) recorded by instrument.py.
+    """
+    sizes = instrument.input_sizes([f"{pair.pdb}_final.pdb", f"{pair.pdb}_final.mtz"], pair.root)
+    with tempfile.TemporaryFile("a+") as buf, instrument.stage(pair.label, name, pair.root, sizes) as timing:
+        start = time.time()
+        ok, outputs = func(pair, buf)
+        seconds = time.time() - start
+        timing['exit'] = 0 if ok else 1
+        buf.seek(0)
+        return ok, outputs, seconds, buf.read()
+
+# -------------------------
+# Runner
+# -------------------------
+def run_pair(row, root=".", log=None, no_pdf=False, retry_failed=False, workers=STAGE_WORKERS, nproc=1,
+             crop_padding=CROP_PADDING, engines=()):
+    """
+    Run the stage graph of one pair in the run directory `root`, up to `workers`
+    stages at a time, with `nproc` cores for its refinements.  A stage is skipped if the journal shows it done with its
+    outputs intact and none of its dependencies reran, or, with the reason code
+    of the root failure, if a stage it needs failed or was skipped.
+    Return True if the refinement stages succeeded (the refinement script's exit status).
+    """
+    log = log or sys.stdout
+    pair = Pair(row, root, no_pdf, nproc, crop_padding, engines)
+    jr = journal.Journal(pair.label, pair.key, root=root)
+    try:
+        if jr.complete(retry_failed):
+            log.write(f"Journal: {pair.label} already complete, skipping\n")
+            return pair.runnable() and not any(jr.status(name) == "failed" and is_fatal(pair, name)
+                                               for name, _, _, _ in STAGES)
+
+        if pair.variant is None:
+            log.write(f"Other bp: {row['nt_type_1']}{row['nt_type_2']} — no script mapped\n")
+        elif pair.chain_purine is None:
+            log.write("mismatch or modification\n")
+        if pair.chain_purine is not None and tuple_archive.unpack(pair.abspath()):
+            log.write(f"Unpacked {pair.tuple_rel}{tuple_archive.ARCHIVE_SUFFIX} to resume the pair\n")
+
+        # the metric scripts append to classification_files/ without creating it
+        os.makedirs(os.path.join(root, "classification_files"), exist_ok=True)
+        status = {}
+        changed = set()          # stages run or newly skipped in this run
+        pending = list(STAGES)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            while pending or running:
+                for stage in list(pending):
+                    name, func, requires, after = stage
+                    if any(dep not in status for dep in requires + after):
+                        continue
+                    pending.remove(stage)
+                    if name == journal.FINAL_STAGE:
+                        jr.set_reason(next((jr.reason(n) for n, _, _, _ in STAGES
+                                            if status.get(n, "ok") != "ok"), None))
+
+                    blocked = [dep for dep in requires if status[dep] != "ok"]
+                    reason = pair_reason(pair, name) or (jr.reason(blocked[0]) if blocked else None)
+                    if reason:
+                        status[name] = "skipped"
+                        if jr.status(name) != "skipped" or jr.reason(name) != reason:
+                            jr.skip(name, reason)
+                            changed.add(name)
+                        log.write(f"Skipping {name}: {reason}\n")
+                    elif not changed.intersection(requires + after) and jr.valid(name, retry_failed):
+                        status[name] = jr.status(name)
+                        log.write(f"Journal: skipping {name} ({status[name]})\n")
+                    else:
+                        running[pool.submit(run_stage, func, pair, name)] = name
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name = running.pop(fut)
+                    ok, outputs, seconds, text = fut.result()
+                    log.write(text)
+                    log.flush()
+                    jr.record(name, ok, outputs, STAGE_ROWS.get(name), seconds,
+                              reason=None if ok else failure_reason(pair, name))
+                    status[name] = "ok" if ok else "failed"
+                    changed.add(name)
+
+        refine_ok = pair.runnable() and not any(status[name] == "failed" and is_fatal(pair, name)
+                                                for name, _, _, _ in STAGES)
+        if pair.variant is not None:
+            append_line(os.path.join(root, "out.txt" if refine_ok else "out_error.txt"),
+                        f"{'OK' if refine_ok else 'ERROR'}: {pair.refine_command()}")
+        return refine_ok
+    finally:
+        jr.close()
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the journaled Hoogsteen pipeline for one base pair.")
+    for name in ["pdb_code", "assembly", "reso", "chi_1", "chi_2",
+                 "chain_1", "nt_type_1", "nt_number_1", "chain_2", "nt_type_2", "nt_number_2"]:
+        parser.add_argument(name)
+    parser.add_argument("xxxx", nargs="?", default="")
+    parser.add_argument("--pdb-path", default=PDB_PATH, help="directory with <pdb>.pdb<assembly> files")
+    parser.add_argument("--no-pdf", action="store_true", help="classify only; render later with render_reports.py")
+    parser.add_argument("--retry-failed", action="store_true", help="rerun stages recorded as failed")
+    parser.add_argument("--stage-workers", type=int, default=STAGE_WORKERS,
+                        help=f"stages of the pair run at the same time (default: {STAGE_WORKERS})")
+    parser.add_argument("--nproc", type=int, default=NPROC,
+                        help="cores for the refinements, split between the WC and HG branches (default: all)")
+    parser.add_argument("--crop-padding", type=float, default=CROP_PADDING,
+                        help=f"crop the packed maps to the base pair and its neighbours plus this margin (A); "
+                             f"0 keeps the whole maps (default: {CROP_PADDING})")
+    for name, text in ENGINES.items():
+        parser.add_argument(f"--{name}-engine", action="store_true", help=f"{text} (not yet calibrated)")
+    args = parser.parse_args()
+
+    engines = [name for name in ENGINES if getattr(args, f"{name}_engine")]
+    row = {k: v for k, v in vars(args).items()
+           if k not in ("pdb_path", "no_pdf", "retry_failed", "stage_workers", "nproc", "crop_padding")
+           and not k.endswith("_engine")}
+    pair = Pair(row)
+    if not journal.Journal(pair.label, pair.key).complete(args.retry_failed):
+        try:
+            fetch_inputs(args.pdb_code, args.assembly, ".", args.pdb_path, sys.stdout)
+        except OSError as e:
+            print(f" Error staging inputs: {e}", file=sys.stderr)
+    ok = run_pair(row, ".", sys.stdout, args.no_pdf, args.retry_failed, args.stage_workers, args.nproc,
+                 args.crop_padding, engines)
+    sys.exit(0 if ok else 1)
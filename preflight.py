@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Pre-flight screening of a pair table before any Phenix work.
+
+Every structure of the pair table is read once (structure_index.py), on a
+pool of worker processes, and each of its rows is checked for what the
+pipeline needs: a purine in a mapped pair type, both residues present in the
+model, the glycosidic torsion atoms (O4', C1', N9, C4) of the purine and a
+purine occupancy of 1 (the check_occupancy.py test of the setup stage).  Rows that
+pass are written to a filtered work list in the input CSV format, the others
+to a rejection table with a reason code (the codes used by pipeline.py where
+one exists).
+
+Usage:
+    python3 preflight.py [PairTable_X_ray.csv] [-j WORKERS] [--pdb-path DIR] [--out CSV] [--rejected FILE]
+"""
+import os
+import sys
+import csv
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import pipeline
+import structure_index
+
+# -------------------------
+# Config
+# -------------------------
+REJECTED_FILE = "classification_files/preflight_rejected.txt"
+TORSION_ATOMS = ["O4'", "C1'", "N9", "C4"]
+
+REJECTED_HEADER = "pdb_id assembly chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 reason detail\n"
+
+# -------------------------
+# Helpers
+# -------------------------
+def purine_of(row):
+    """(chain, residue number) of the purine of a row, or None."""
+    if row['nt_type_1'] in ("A", "G"):
+        return row['chain_1'], int(row['nt_number_1'])
+    if row['nt_type_2'] in ("A", "G"):
+        return row['chain_2'], int(row['nt_number_2'])
+    return None
+
+def occupancy_text(summary):
+    """What check_occupancy.py prints for a residue, with whitespace removed."""
+    return "".join(f"{q:.3f}" for _, q in summary['occupancy'])
+
+def check_row(row, residues):
+    """Return (reason, detail) if the row cannot run, else None; residues is a StructureIndex.summarize() result."""
+    chains = [(row['chain_1'], int(row['nt_number_1'])), (row['chain_2'], int(row['nt_number_2']))]
+    missing = [f"{c}{n}" for c, n in chains if residues.get((c, n)) is None]
+    if missing:
+        return "Residue_missing", ",".join(missing)
+
+    purine = residues[purine_of(row)]
+    absent = [a for a in TORSION_ATOMS if a not in purine['atoms']]
+    if absent:
+        return "Missing_atoms", ",".join(absent)
+
+    occ = occupancy_text(purine)
+    if occ != "1.000":
+        return "Occupancy_not_1", occ or "-"
+    return None
+
+def screen_structure(pdb_file, indexed_rows):
+    """Screen the (index, row) pairs of one structure. Return [(index, reason, detail)]."""
+    rejected = []
+    runnable = []
+    for i, row in indexed_rows:
+        try:
+            purine = purine_of(row)
+            int(row['nt_number_1']), int(row['nt_number_2'])
+        except ValueError:
+            rejected.append((i, "Bad_row", "-"))
+            continue
+        if purine is None:
+            rejected.append((i, "No_purine", "-"))
+        elif f"{row['nt_type_1']}{row['nt_type_2']}" not in pipeline.PAIR_VARIANTS:
+            rejected.append((i, "Unmapped_pair_type", f"{row['nt_type_1']}{row['nt_type_2']}"))
+        else:
+            runnable.append((i, row))
+    if not runnable:
+        return rejected
+
+    if not os.path.exists(pdb_file):
+        return rejected + [(i, "Structure_missing", os.path.basename(pdb_file)) for i, _ in runnable]
+
+    wanted = set()
+    for _, row in runnable:
+        wanted.add((row['chain_1'], int(row['nt_number_1'])))
+        wanted.add((row['chain_2'], int(row['nt_number_2'])))
+    try:
+        residues = structure_index.load(pdb_file).summarize(wanted)
+    except (OSError, UnicodeDecodeError) as e:
+        return rejected + [(i, "Structure_unreadable", type(e).__name__) for i, _ in runnable]
+
+    for i, row in runnable:
+        result = check_row(row, residues)
+        if result is not None:
+            rejected.append((i, *result))
+    return rejected
+
+def screen(rows, pdb_path, workers=1):
+    """
+    Screen rows (dicts over batch_run.PAIR_COLUMNS), one task per structure.
+    Return {row index: (reason, detail)} for the rows that cannot run.
+    """
+    groups = defaultdict(list)
+    for i, row in enumerate(rows):
+        groups[(row['pdb_code'], row['assembly'])].append((i, row))
+    tasks = [(os.path.join(pdb_path, f"{pdb_code}.pdb{assembly}"), indexed)
+             for (pdb_code, assembly), indexed in groups.items()]
+
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(screen_structure, *zip(*tasks)))
+    else:
+        results = [screen_structure(*task) for task in tasks]
+
+    rejected = {}
+    for found in results:
+        for i, reason, detail in found:
+            rejected[i] = (reason, detail)
+    return rejected
+
+def write_rejected(path, rows, rejected):
+    """Write the rejection table (space separated, like the summary files)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        f.write(REJECTED_HEADER)
+        for i in sorted(rejected):
+            r = rows[i]
+            reason, detail = rejected[i]
+            f.write(f"{r['pdb_code']} {r['assembly']} {r['chain_1']} {r['nt_type_1']} {r['nt_number_1']} "
+                    f"{r['chain_2']} {r['nt_type_2']} {r['nt_number_2']} {reason} {detail}\n")
+
+def write_work_list(path, rows, columns):
+    """Write rows back in the pair table's CSV format (no header; xxxx only if set)."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        for r in rows:
+            fields = [r[c] for c in columns[:-1]]
+            if r.get(columns[-1]):
+                fields.append(r[columns[-1]])
+            writer.writerow(fields)
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    import batch_run
+
+    parser = argparse.ArgumentParser(description="Reject pairs that cannot run before any refinement.")
+    parser.add_argument("csv_file", nargs="?", default=batch_run.CSV_FILE)
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pdb-path", default=batch_run.PDB_PATH, help="directory with <pdb>.pdb<assembly> files")
+    parser.add_argument("--out", help="filtered work list (default: <csv_file stem>_preflight.csv)")
+    parser.add_argument("--rejected", default=REJECTED_FILE, help="rejection table")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.csv_file):
+        print(f" Error: CSV file not found: {args.csv_file}", file=sys.stderr)
+        sys.exit(1)
+
+    rows = list(batch_run.read_pair_table(args.csv_file))
+    rejected = screen(rows, args.pdb_path, max(1, args.workers))
+    out = args.out or f"{os.path.splitext(args.csv_file)[0]}_preflight.csv"
+    write_work_list(out, [r for i, r in enumerate(rows) if i not in rejected], batch_run.PAIR_COLUMNS)
+    write_rejected(args.rejected, rows, rejected)
+
+    counts = defaultdict(int)
+    for reason, _ in rejected.values():
+        counts[reason] += 1
+    print(f" {len(rows) - len(rejected)} of {len(rows)} pairs pass; work list written to {out}")
+    for reason, n in sorted(counts.items(), key=lambda kv: -kv[1]):
+        print(f"   {reason}: {n}")
+    print(f" Rejections written to {args.rejected}")
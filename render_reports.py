@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Render the PDF reports of classified pairs, separately from classification.
+
+Pairs are classified from the combined metrics table (same rules as
+make_report.py) and rendered on a process pool with the Agg backend.  Each
+worker builds the 14x16 figure and its grid once and reuses it for every pair
+it draws.  Reports are written one PDF per pair, or --pages-per-pdf pairs per
+multi-page PDF.  The figures are read from the tuple directories, or from
+their archives once pipeline.py has packed them (see tuple_archive.py).
+
+Usage:
+    python3 render_reports.py [PairTable_X_ray.csv] [-j WORKERS] [--pages-per-pdf N]
+"""
+import io
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+import make_report
+import tuple_archive
+from make_report import format_value
+
+# -------------------------
+# Config
+# -------------------------
+OUTPUT_FOLDER = make_report.OUTPUT_FOLDER
+PATH_TO_IMAGES = make_report.PATH_TO_IMAGES
+
+# Per-worker figure, created once by init_worker()
+_FIGURE = None
+
+# -------------------------
+# Drawing
+# -------------------------
+def new_figure():
+    """Create the report figure: 2x2 image grid plus space for the metrics text."""
+    fig = plt.figure(figsize=(14, 16))
+
+    # Create grid: 2 rows for images, space at bottom for text
+    gs = fig.add_gridspec(3, 2, height_ratios=[1, 1, 0.5], hspace=0.15, wspace=0.1)
+
+    # Top row - 90 degree rotated views, bottom row - original views
+    axes = {
+        'hg_90': fig.add_subplot(gs[0, 0]),
+        'wc_90': fig.add_subplot(gs[0, 1]),
+        'hg': fig.add_subplot(gs[1, 0]),
+        'wc': fig.add_subplot(gs[1, 1]),
+    }
+    return fig, axes
+
+def report_paths(pdb_code, chain_1, nt_number_1, chain_2, nt_number_2, chain_purine, nt_purine, conformation):
+    """
+    Return (base_path, {panel: png_path}) for a pair.
+    If the deposited purine is syn, the WC/HG state directories are swapped.
+    """
+    if conformation == 'syn':
+        hg_prefix, wc_prefix = 'WC', 'HG'
+        hg_img_suffix, wc_img_suffix = 'WC_map_water', 'HG_map_water'
+    else:
+        hg_prefix, wc_prefix = 'HG', 'WC'
+        hg_img_suffix, wc_img_suffix = 'HG_map_water', 'WC_map_water'
+
+    base_path = os.path.join(PATH_TO_IMAGES, f'{pdb_code}_{chain_purine}_{nt_purine}')
+    stem = f'{pdb_code}_{chain_1}_{nt_number_1}_{chain_2}_{nt_number_2}'
+    images = {
+        'hg': os.path.join(base_path, hg_prefix, f'{stem}_{hg_img_suffix}.png'),
+        'wc': os.path.join(base_path, wc_prefix, f'{stem}_{wc_img_suffix}.png'),
+        'hg_90': os.path.join(base_path, hg_prefix, f'{stem}_{hg_img_suffix}_90.png'),
+        'wc_90': os.path.join(base_path, wc_prefix, f'{stem}_{wc_img_suffix}_90.png'),
+    }
+    return base_path, images
+
+def draw_report(fig, axes, rec):
+    """Draw one pair's report into an existing figure (clearing what was there)."""
+    for ax in axes.values():
+        ax.clear()
+    for text in list(fig.texts):
+        text.remove()
+
+    purine = rec['purine']
+    titles = {
+        'hg_90': (f'{purine}(syn) Model - HG (90° rotation)', f'{purine}(syn) 90° image not found'),
+        'wc_90': (f'{purine}(anti) Model - WC (90° rotation)', f'{purine}(anti) 90° image not found'),
+        'hg': (f'{purine}(syn) Model - HG', f'{purine}(syn) image not found'),
+        'wc': (f'{purine}(anti) Model - WC', f'{purine}(anti) image not found'),
+    }
+    for panel, ax in axes.items():
+        image = rec['images'][panel]
+        title, missing = titles[panel]
+        if tuple_archive.exists(image):
+            ax.imshow(plt.imread(io.BytesIO(tuple_archive.read_bytes(image)), format="png"))
+            ax.set_title(title)
+        else:
+            ax.text(0.5, 0.5, missing, ha='center', va='center')
+        ax.axis('off')
+
+    interp = rec['interpretations']
+    v = rec
+    # Format metrics text
+    metric_text = f"""
+PDB ID: {v['pdb_code']} | Resolution: {v['resolution']} Å
+Chains: {v['chain_1']}, {v['chain_2']} | Nucleotides: {v['nt_type_1']}.{v['nt_number_1']} : {v['nt_type_2']}.{v['nt_number_2']}
+Original conformation: {purine}({v['conformation']}) - {v['conformation_bp']}
+
+Metric                      HG        WC        Δ(WC - HG)  Favours
+------------------------------------------------------------------
+RSCC                        {format_value(v['rscc_hg']):>9} {format_value(v['rscc_wc']):>9} {format_value(v['rscc_diff']):>10} {interp['RSCC'] or 'N/A'}
+EDIA                        {format_value(v['edia_hg']):>9} {format_value(v['edia_wc']):>9} {format_value(v['edia_diff']):>10} {interp['EDIA'] or 'N/A'}
+Clashscore bp               {format_value(v['clash_bp_hg'], 1):>9} {format_value(v['clash_bp_wc'], 1):>9} {format_value(v['clash_bp_diff'], 1):>10} {interp['Clashscore bp'] or 'N/A'}
+Clashscore neighbour        {format_value(v['clash_neigh_hg'], 1):>9} {format_value(v['clash_neigh_wc'], 1):>9} {format_value(v['clash_neigh_diff'], 1):>10} {interp['Clashscore neighbour'] or 'N/A'}
+Clashscore global           {format_value(v['clash_global_hg'], 1):>9} {format_value(v['clash_global_wc'], 1):>9}
+R-work                      {format_value(v['rwork_hg']):>9} {format_value(v['rwork_wc']):>9} {format_value(v['rwork_diff']):>10} {interp['R-work'] or 'N/A'}
+R-free                      {format_value(v['rfree_hg']):>9} {format_value(v['rfree_wc']):>9} {format_value(v['rfree_diff']):>10} {interp['R-free'] or 'N/A'}
+B-factor (purine avg)       {format_value(v['b_hg'], 1):>9} {format_value(v['b_wc'], 1):>9}
+"""
+    fig.text(0.05, 0.12, metric_text, fontsize=10, family='monospace')
+    fig.text(0.05, 0.08, f"Overall Result: {rec['overall_result']}",
+             fontsize=12, family='monospace', weight='bold')
+
+def render_pdf(pdf_path, records, fig=None, axes=None):
+    """Write records as pages of pdf_path, reusing fig/axes when given."""
+    own = fig is None
+    if own:
+        fig, axes = new_figure()
+    try:
+        with PdfPages(pdf_path) as pdf:
+            for rec in records:
+                draw_report(fig, axes, rec)
+                pdf.savefig(fig)
+    finally:
+        if own:
+            plt.close(fig)
+
+def report_pdf_path(rec, output_folder=OUTPUT_FOLDER):
+    return (f"{output_folder}/{rec['pdb_code']}_{rec['chain_1']}_{rec['nt_type_1']}_{rec['nt_number_1']}_"
+            f"{rec['chain_2']}_{rec['nt_type_2']}_{rec['nt_number_2']}.pdf")
+
+# -------------------------
+# Worker pool
+# -------------------------
+def init_worker():
+    global _FIGURE
+    _FIGURE = new_figure()
+
+def render_task(pdf_path, records):
+    """Pool task: render records into pdf_path with this worker's figure."""
+    fig, axes = _FIGURE
+    render_pdf(pdf_path, records, fig, axes)
+    return pdf_path, records
+
+def plan_tasks(records, pages_per_pdf=0, output_folder=OUTPUT_FOLDER):
+    """Split records into (pdf_path, [records]) tasks: one per pair, or pages_per_pdf per file."""
+    if pages_per_pdf <= 0:
+        return [(report_pdf_path(rec, output_folder), [rec]) for rec in records]
+    return [(f"{output_folder}/reports_{i // pages_per_pdf + 1:05d}.pdf", records[i:i + pages_per_pdf])
+            for i in range(0, len(records), pages_per_pdf)]
+
+def render_all(records, workers, pages_per_pdf=0, output_folder=OUTPUT_FOLDER):
+    """Render records on a pool of `workers` processes."""
+    os.makedirs(output_folder, exist_ok=True)
+    tasks = plan_tasks(records, pages_per_pdf, output_folder)
+    n_pages = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        futures = [pool.submit(render_task, path, recs) for path, recs in tasks]
+        for fut in as_completed(futures):
+            try:
+                pdf_path, done = fut.result()
+            except Exception as e:
+                print(f" Error rendering report: {e}", file=sys.stderr)
+                continue
+            n_pages += len(done)
+    print(f" Rendered {n_pages} reports into {len(tasks)} PDF files in {output_folder}/")
+    return n_pages
+
+def load_records(pair_table):
+    """Classify every pair of pair_table from the combined table and return report records."""
+    data = make_report.load_combined_table()
+    if data is None:
+        print(f" Error: Combined metrics table not found: {make_report.COMBINED_TABLE}", file=sys.stderr)
+        return None
+    classified = make_report.classify_table(data, make_report.load_pair_table(pair_table))
+    return make_report.classified_records(classified)
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render PDF reports for classified base pairs.")
+    parser.add_argument("pair_table", nargs="?", default=make_report.PAIR_TABLE)
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pages-per-pdf", type=int, default=0,
+                        help="write N pairs per multi-page PDF (default: one PDF per pair)")
+    args = parser.parse_args()
+
+    records = load_records(args.pair_table)
+    if records is None:
+        sys.exit(1)
+    render_all(records, max(1, args.workers), args.pages_per_pdf)
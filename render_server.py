@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Map/water figures of the refined models, rendered by long-lived PyMOL workers.
+
+The pipeline used to write the PyMOL script of each state to plot.py and run
+it with a fresh python3, which imported PyMOL and pymolprobity, loaded the
+model and both maps and ray-traced two PNGs; on small structures the start-up
+cost most of the time.  Here a few worker processes (HG_RENDER_WORKERS) import
+PyMOL once and take render jobs: a model, its 2mFo-DFc and mFo-DFc maps, the
+residues of the base pair and the views to save.  Residue numbers are escaped
+for PyMOL selections here (negative numbers need a backslash).
+
+Each worker keeps the last CACHED_STATES loaded (model, maps) sets, keyed by
+file and mtime, and builds every scene on copies of them, so a state that is
+rendered again is not reloaded.  Jobs of one tuple directory always go to the
+same worker, so the WC and HG states of a pair share its warm session.
+
+Usage:
+    python3 render_server.py <model.pdb> <2mFo-DFc.ccp4> <mFo-DFc.ccp4> <png_prefix> <chain>:<resseq> [...]
+"""
+import os
+import sys
+import time
+import zlib
+import atexit
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import instrument
+
+# -------------------------
+# Config
+# -------------------------
+PYMOLPROBITY_PATH = "/mnt/hdd_04/sg4213/Hoog-finder-2025/pymolprobity"
+WORKERS = int(os.environ.get("HG_RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Loaded (model, 2mFo-DFc, mFo-DFc) sets kept by a worker: both states of a pair
+CACHED_STATES = 2
+
+# (suffix of the PNG, rotation about x before it is saved); rotations add up
+VIEWS = [("", 0.0), ("_90", 90.0)]
+
+MAP_LEVEL = 2.0
+DIFF_LEVEL = 3.0
+
+class RenderError(RuntimeError):
+    """A render job failed in its worker, or the worker died."""
+
+# -------------------------
+# Jobs
+# -------------------------
+def resi_sel(nt):
+    """PyMOL resi value; negative numbers need a backslash so '-' is not read as a range."""
+    return f"\\{nt}" if int(nt) < 0 else str(nt)
+
+def selection(residues):
+    """PyMOL selection of [(chain, resseq)]."""
+    return " or ".join(f"(chain {chain} and resi {resi_sel(nt)})" for chain, nt in residues)
+
+def make_job(model, map_file, diffmap_file, residues, png, views=VIEWS, structure=None):
+    """
+    A render job: the model and maps (paths), the residues [(chain, resseq)]
+    shown with their density, the PNG path prefix and the views to save.
+    Jobs with the same structure key go to the same worker.
+    """
+    return {
+        'model': os.path.abspath(model),
+        'maps': [os.path.abspath(map_file), os.path.abspath(diffmap_file)],
+        'selection': selection(residues),
+        'png': os.path.abspath(png),
+        'views': list(views),
+        'structure': structure or os.path.dirname(os.path.abspath(model)),
+    }
+
+# -------------------------
+# Worker (runs in the worker processes)
+# -------------------------
+_loaded = OrderedDict()     # ((path, mtime) of model and maps) -> (model, map, diffmap) object names
+_counter = [0]
+
+def init_worker():
+    """Import PyMOL and pymolprobity once and set the scene options shared by all jobs."""
+    from pymol import cmd
+    sys.path.append(PYMOLPROBITY_PATH)
+    import pymolprobity  # noqa: F401  (imported up front so jobs do not pay for it)
+    cmd.set("cartoon_ring_mode", 1)
+    cmd.set("mesh_negative_visible", "on")
+    cmd.set("mesh_negative_color", "bohrium")
+    cmd.set("mesh_width", 0.4)
+    cmd.set("ray_trace_fog", 0)
+    cmd.set("depth_cue", 0)
+    cmd.set("ray_shadows", "off")
+
+def load_state(cmd, job):
+    """Object names of the job's model and maps, loaded unless cached; older sets are deleted."""
+    paths = [job['model'], *job['maps']]
+    key = tuple((p, os.stat(p).st_mtime_ns) for p in paths)
+    if key in _loaded:
+        _loaded.move_to_end(key)
+        return _loaded[key]
+    _counter[0] += 1
+    names = tuple(f"cached_{kind}_{_counter[0]}" for kind in ("model", "map", "diffmap"))
+    for path, name in zip(paths, names):
+        cmd.load(path, name)
+        cmd.disable(name)
+    _loaded[key] = names
+    while len(_loaded) > CACHED_STATES:
+        _, old = _loaded.popitem(last=False)
+        for name in old:
+            cmd.delete(name)
+    return names
+
+def render_job(job):
+    """Build the map/water scene of a job on copies of the cached objects and save its views."""
+    from pymol import cmd
+    from pymolprobity import main
+
+    model, density, diffmap = load_state(cmd, job)
+    cached = {name for names in _loaded.values() for name in names}
+    for name in cmd.get_names("all"):
+        if name not in cached:
+            cmd.delete(name)
+    cmd.create("pdb", model)
+    cmd.disable(model)
+
+    cmd.extract("sol", "pdb and solvent")
+    cmd.bg_color("white")
+    cmd.color("lightblue", "pdb or sol")
+
+    cmd.select("DNA", "pdb and polymer.nucleic")
+    cmd.color("gray50", "DNA")
+
+    cmd.select("HG_pair", f"pdb and ({job['selection']})")
+    cmd.extract("HG", "HG_pair")
+    cmd.show("sticks", "HG")
+
+    cmd.isomesh("2mmFo-DFc", density, MAP_LEVEL, "HG", carve=2)
+    cmd.isomesh("mmFo-DFc", diffmap, DIFF_LEVEL, "HG", carve=3)
+    cmd.color("actinium", "2mmFo-DFc")
+    cmd.color("barium", "mmFo-DFc")
+    cmd.set("mesh_negative_visible", "off", "2mmFo-DFc")
+
+    cmd.color("blue", "(pdb or sol or HG) and name N*")
+    cmd.color("gold", "(pdb or sol or HG) and name O*")
+
+    cmd.h_add("HG")
+    main.reduce_object("HG")
+    main.probe_object("HG")
+
+    cmd.select("view", "name C4'+C5+N3 and HG")
+    cmd.orient("view")
+    cmd.zoom("view")
+    cmd.center("view")
+    cmd.delete("pdb")
+
+    written = []
+    for suffix, angle in job['views']:
+        if angle:
+            cmd.turn("x", angle)
+        cmd.png(f"{job['png']}{suffix}.png")
+        written.append(f"{job['png']}{suffix}.png")
+    return written
+
+def measured_render_job(job):
+    """render_job() plus the CPU seconds it took and the worker's peak RSS (kB), for instrument.py."""
+    cpu_start, _ = instrument.self_usage()
+    written = render_job(job)
+    cpu_end, max_rss_kb = instrument.self_usage()
+    return written, cpu_end - cpu_start, max_rss_kb
+
+# -------------------------
+# Pool
+# -------------------------
+class RenderPool:
+    """Single-process executors with PyMOL loaded, one per worker, started on first use."""
+    def __init__(self, workers=WORKERS):
+        self.executors = [None] * max(1, workers)
+        self.lock = threading.Lock()
+
+    def executor(self, k):
+        with self.lock:
+            if self.executors[k] is None:
+                self.executors[k] = ProcessPoolExecutor(max_workers=1, initializer=init_worker,
+                                                        mp_context=multiprocessing.get_context("spawn"))
+            return self.executors[k]
+
+    def reset(self, k, executor):
+        """Drop a broken executor so the next job on its slot starts a new worker."""
+        with self.lock:
+            if self.executors[k] is executor:
+                self.executors[k] = None
+        executor.shutdown(wait=False)
+
+    def render(self, job):
+        """Render a job on its worker; return the PNGs written or raise RenderError."""
+        k = zlib.crc32(job['structure'].encode()) % len(self.executors)
+        executor = self.executor(k)
+        start = time.monotonic()
+        sizes = instrument.input_sizes([job['model']])
+        try:
+            written, cpu, max_rss_kb = executor.submit(measured_render_job, job).result()
+        except BrokenProcessPool as e:
+            self.reset(k, executor)
+            instrument.record_call("pymol", time.monotonic() - start, exit_code=1, sizes=sizes)
+            raise RenderError(f"render worker died: {e}") from e
+        except Exception as e:
+            instrument.record_call("pymol", time.monotonic() - start, exit_code=1, sizes=sizes)
+            raise RenderError(f"{type(e).__name__}: {e}") from e
+        instrument.record_call("pymol", time.monotonic() - start, cpu, max_rss_kb, 0, sizes)
+        return written
+
+    def close(self):
+        with self.lock:
+            executors, self.executors = self.executors, [None] * len(self.executors)
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def pool():
+    """The render pool of this process, created on first use and shut down at exit."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool()
+            atexit.register(_pool.close)
+        return _pool
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    if len(sys.argv) < 6:
+        print("Usage: python3 render_server.py <model.pdb> <2mFo-DFc.ccp4> <mFo-DFc.ccp4> <png_prefix> "
+              "<chain>:<resseq> [...]", file=sys.stderr)
+        sys.exit(1)
+    residues = [tuple(arg.rsplit(":", 1)) for arg in sys.argv[5:]]
+    job = make_job(*sys.argv[1:5], residues)
+    try:
+        for png in pool().render(job):
+            print(f"Written {png}")
+    except RenderError as e:
+        print(f" Error: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Real-space correlation of the purine in the WC and HG models, in process.
+
+An alternative to the phenix.real_space_correlation run of get_rscc.sh, used
+as the pipeline's rscc stage with pipeline.py/batch_run.py --rscc-engine until
+it has been validated against phenix's reports (--calibrate).  For each state
+the refined model and the 2mFo-DFc map written by phenix.mtz2map are read,
+and only the grid points within ATOM_RADIUS of the purine's atoms are used (a
+box of the memory-mapped map, see ccp4_map.py).  As phenix does, the map is
+correlated with an Fc map of the model at the resolution of the data
+(--resolution, otherwise the model's REMARK records, otherwise what the map's
+grid was sampled for): the structure factors of the atoms in a box MODEL_PAD
+wider than the scored points (and of their symmetry mates) are computed from
+their scattering factors, B-factors and occupancies, cut at that resolution
+and transformed back onto the map's grid points (model_map()).
+The per-atom CCs are averaged, as the awk script averaged phenix's per-atom
+column, and written to REPORT_NAME in the state directory; phenix's
+RSCC_report.txt is left alone.
+
+--calibrate scores every state under the given roots (default
+PDB_without_nt) that has a phenix RSCC_report.txt, and prints the mean and
+maximum difference of the purine RSCC and of the WC-HG delta, and how many
+pairs change class at make_report.py's 0.007 tolerance.
+
+Usage:
+    python3 rscc.py pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 [--resolution D]
+    python3 rscc.py --calibrate [TUPLE_ROOT ...]
+"""
+import os
+import re
+import sys
+import tempfile
+
+import numpy as np
+
+import ccp4_map
+import metrics_store
+import structure_index
+import tuple_archive
+
+# -------------------------
+# Config
+# -------------------------
+ROOT_GLOBS = [
+    "PDB_without_nt",
+    "../PDB_without_nt",
+]
+HG_STEM = "{pdbid}_final_flipped_refine_001_refine_001"
+WC_STEM = "{pdbid}_final_refine_001"
+MAP_SUFFIX = "_2mFo-DFc.ccp4"
+REPORT_NAME = "RSCC_inprocess_report.txt"
+PHENIX_REPORT_NAME = "RSCC_report.txt"    # written by get_rscc.sh
+
+ATOM_RADIUS = 2.0       # grid points within this distance of an atom are scored (A)
+MODEL_PAD = 5.0         # atoms within this distance of the scored points are in the model map (A)
+GRID_FACTOR = 3         # phenix.mtz2map samples maps at resolution / 3
+DEFAULT_B = 20.0        # for atoms without a B-factor (A^2)
+ATOM_CHUNK = 256        # atoms per block of the structure factor sum
+DELTA_TOL = 0.007       # make_report.py's RSCC tolerance on WC - HG
+
+# Cromer-Mann coefficients (International Tables C, Table 6.1.1.4):
+# f(s) = sum a_i exp(-b_i s^2 / 4) + c, with s = 1/d
+SCATTERING = {
+    'H': ((0.489918, 0.262003, 0.196767, 0.049879), (20.6593, 7.74039, 49.5519, 2.20159), 0.001305),
+    'C': ((2.31000, 1.02000, 1.58860, 0.865000), (20.8439, 10.2075, 0.568700, 51.6512), 0.215600),
+    'N': ((12.2126, 3.13220, 2.01250, 1.16630), (0.005700, 9.89330, 28.9975, 0.582600), -11.529),
+    'O': ((3.04850, 2.28680, 1.54630, 0.867000), (13.2771, 5.70110, 0.323900, 32.9089), 0.250800),
+    'NA': ((4.76260, 3.17360, 1.26740, 1.11280), (3.28500, 8.84220, 0.313600, 129.424), 0.676000),
+    'MG': ((5.42040, 2.17350, 1.22690, 2.30730), (2.82750, 79.2611, 0.380800, 7.19370), 0.858400),
+    'P': ((6.43450, 4.17910, 1.78000, 1.49080), (1.90670, 27.1570, 0.526000, 68.1645), 1.11490),
+    'S': ((6.90530, 5.20340, 1.43790, 1.58630), (1.46790, 22.2151, 0.253600, 56.1720), 0.866900),
+    'CL': ((11.4604, 7.19640, 6.25560, 1.64550), (0.010400, 1.16620, 18.5194, 47.7784), -9.5574),
+    'K': ((8.21860, 7.43980, 1.05190, 0.865900), (12.7949, 0.774800, 213.187, 41.6841), 1.42280),
+    'CA': ((8.62660, 7.38730, 1.58990, 1.02110), (10.4421, 0.659900, 85.7484, 178.437), 1.37510),
+    'MN': ((11.2819, 7.35730, 3.01930, 2.24410), (5.34090, 0.343200, 17.8674, 83.7543), 1.08960),
+    'FE': ((11.7695, 7.35730, 3.52220, 2.30450), (4.76110, 0.307200, 15.3535, 76.8805), 1.03690),
+    'ZN': ((14.0743, 7.03180, 5.16520, 2.41000), (3.26550, 0.233300, 10.3163, 58.7097), 1.30410),
+}
+# elements without coefficients are scattered as carbon, scaled by atomic number
+ATOMIC_NUMBER = {'H': 1, 'C': 6, 'N': 7, 'O': 8, 'F': 9, 'NA': 11, 'MG': 12, 'P': 15, 'S': 16,
+                 'CL': 17, 'K': 19, 'CA': 20, 'MN': 25, 'FE': 26, 'CO': 27, 'NI': 28, 'CU': 29,
+                 'ZN': 30, 'SE': 34, 'BR': 35, 'SR': 38, 'CD': 48, 'I': 53, 'BA': 56}
+
+# -------------------------
+# Helpers
+# -------------------------
+def get_purine_info(chain1, nt_type1, nt1, chain2, nt_type2, nt2):
+    """
+    Decide which side is purine; return (chain_purine, nt_purine).
+    """
+    if nt_type1 in ["A", "G"]:
+        return chain1, nt1
+    if nt_type2 in ["A", "G"]:
+        return chain2, nt2
+    return None, None
+
+def locate_tuple_dir(pdbid, chain_purine, nt_purine):
+    """
+    Return the first tuple directory matching any ROOT_GLOBS:
+      <root>/{pdbid}_{chain_purine}_{nt_purine}, unpacked or archived
+    """
+    for root in ROOT_GLOBS:
+        tup = os.path.join(root, f"{pdbid}_{chain_purine}_{nt_purine}")
+        if tuple_archive.isdir(tup):
+            return tup
+    return None
+
+def model_resolution(pdb_file):
+    """High-resolution limit from the model's REMARK 2 or REMARK 3 records, or None."""
+    try:
+        with tuple_archive.open_file(pdb_file) as f:
+            for line in f:
+                if not line.startswith("REMARK"):
+                    if line.startswith(("ATOM", "HETATM")):
+                        break
+                    continue
+                m = (re.match(r"REMARK   2 RESOLUTION\.\s+([0-9.]+)\s+ANGSTROMS", line)
+                     or re.match(r"REMARK   3\s+RESOLUTION RANGE HIGH \(ANGSTROMS\)\s*:\s*([0-9.]+)", line))
+                if m:
+                    return float(m.group(1))
+    except (OSError, ValueError):
+        pass
+    return None
+
+def map_resolution(density_map):
+    """Resolution (A) the grid of a CCP4Map was sampled for: GRID_FACTOR times its widest grid step."""
+    step = np.linalg.norm(density_map.frac_to_cart, axis=0) / density_map.grid
+    return GRID_FACTOR * float(step.max())
+
+def form_factor(element, s2):
+    """Scattering factor of element at s^2 = 1/d^2 (A^-2)."""
+    if element not in SCATTERING:
+        return form_factor('C', s2) * ATOMIC_NUMBER.get(element, 6) / 6
+    a, b, c = SCATTERING[element]
+    return sum(ai * np.exp(-bi * s2 / 4) for ai, bi in zip(a, b)) + c
+
+def box_atoms(box, xyz):
+    """
+    Coordinates of the atoms xyz and of their symmetry mates (the map's
+    operators and lattice translations) that fall inside box, in fractions
+    of the box, with the index of the atom each one is a copy of.
+    """
+    parent = box.parent
+    lo, hi = box.origin / parent.grid, (box.origin + box.shape) / parent.grid
+    frac = xyz @ parent.cart_to_frac.T
+    coords, atoms = [], []
+    for R, t in parent.symops:
+        f = frac @ R.T + t
+        shifts = [range(int(np.ceil(lo[k] - f[:, k].max())), int(np.floor(hi[k] - f[:, k].min())) + 1)
+                  for k in range(3)]
+        for shift in np.stack(np.meshgrid(*shifts, indexing="ij"), axis=-1).reshape(-1, 3):
+            u = ((f + shift) * parent.grid - box.origin) / box.shape
+            inside = np.flatnonzero(np.all((u >= 0) & (u < 1), axis=1))
+            coords.append(u[inside])
+            atoms.append(inside)
+    return np.concatenate(coords), np.concatenate(atoms)
+
+def model_map(box, xyz, b, occupancy, element, resolution):
+    """
+    Fc map of the atoms on the grid points of box (a MapBox): the box is taken
+    as a periodic cell, the structure factors of the atoms inside it (and of
+    their symmetry mates) are summed to resolution (A) and transformed back.
+    Returns a MapBox on the same grid points.
+    """
+    parent = box.parent
+    n = box.shape
+    edges = parent.frac_to_cart * (n / parent.grid)    # box cell vectors as columns
+    u, atom = box_atoms(box, xyz)
+
+    # Miller indices of the box cell in FFT order, within the resolution sphere
+    hkl = np.stack(np.meshgrid(*[np.fft.fftfreq(k, 1.0 / k) for k in n], indexing="ij"), axis=-1).reshape(-1, 3)
+    s2 = np.sum((hkl @ np.linalg.inv(edges)) ** 2, axis=1)
+    keep = np.flatnonzero(s2 <= 1.0 / resolution ** 2)
+    hkl, s2 = hkl[keep], s2[keep]
+
+    fc = np.zeros(len(keep), dtype=complex)
+    for el in np.unique(element[atom]):
+        of = np.flatnonzero(element[atom] == el)
+        f = form_factor(el, s2)
+        for c in range(0, len(of), ATOM_CHUNK):
+            j = of[c:c + ATOM_CHUNK]
+            weight = occupancy[atom[j], None] * f * np.exp(-np.outer(b[atom[j]], s2) / 4)
+            fc += np.sum(weight * np.exp(-2j * np.pi * (u[j] @ hkl.T)), axis=0)
+
+    coefficients = np.zeros(int(np.prod(n)), dtype=complex)
+    coefficients[keep] = fc
+    rho = np.fft.ifftn(coefficients.reshape(n)).real * np.prod(n) / abs(np.linalg.det(edges))
+    return ccp4_map.MapBox(parent, box.origin, rho)
+
+def correlation(a, b):
+    a = a - a.mean()
+    b = b - b.mean()
+    denom = np.sqrt(np.sum(a * a) * np.sum(b * b))
+    return float(np.sum(a * b) / denom) if denom > 0 else None
+
+def residue_rscc(pdb_file, map_file, chain, resseq, resolution=None):
+    """
+    Per-atom real-space CCs of one residue: [(atom label, CC or None)], scored
+    on the grid points around its atoms only, against the model map at
+    resolution (A): by default the model's own resolution, else the map's.
+    """
+    index = structure_index.load(pdb_file)
+    sel = np.arange(len(index))[index.atoms(chain, resseq)]
+    if len(sel) == 0:
+        return []
+    density_map = ccp4_map.CCP4Map(map_file)
+    resolution = resolution or model_resolution(pdb_file) or map_resolution(density_map)
+    # only the map box around the residue is read (see ccp4_map.py)
+    density = density_map.box_around(index.xyz[sel], ATOM_RADIUS + MODEL_PAD)
+    occupancy = np.nan_to_num(index.occupancy, nan=1.0)
+    model = model_map(density, index.xyz, np.nan_to_num(index.b, nan=DEFAULT_B), occupancy,
+                      index.element, resolution)
+
+    scores = []
+    for i in sel.tolist():
+        points, _ = density.points_near(index.xyz[i], ATOM_RADIUS)
+        observed = density.values(points)
+        ok = ~np.isnan(observed)
+        label = f"{index.name[i]}{index.altloc[i]}"
+        if ok.sum() < 2:
+            scores.append((label, None))
+            continue
+        scores.append((label, correlation(observed[ok], model.values(points[ok]))))
+    return scores
+
+def read_report(path):
+    """Mean per-atom CC of an RSCC_report.txt (from its rounded values), or None."""
+    try:
+        with tuple_archive.open_file(path) as f:
+            rows = [line.split() for line in f][1:]
+        ccs = [float(row[3]) for row in rows if len(row) == 4 and row[3] != "NA"]
+    except (OSError, ValueError):
+        return None
+    return sum(ccs) / len(ccs) if ccs else None
+
+def phenix_report_cc(path, chain, resseq):
+    """
+    Purine CC from a phenix.real_space_correlation report, as get_rscc.sh's
+    awk reads it (mean over the matching rows of the short or long table), or None.
+    """
+    header, started, ccs = None, False, []
+    try:
+        with tuple_archive.open_file(path) as f:
+            for line in f:
+                if "<----id string---->" in line:
+                    header, started = "long", False
+                    continue
+                if "<id string>" in line and "----" not in line:
+                    header, started = "short", False
+                    continue
+                if header is None:
+                    continue
+                if not started:
+                    started = True
+                    continue
+                row = line.split()
+                # (chain, id, CC) fields of the rows with and without an altloc column
+                fields = {'short': {9: (0, 3, 6), 8: (0, 2, 5)},
+                          'long': {10: (0, 3, 7), 9: (0, 2, 6)}}[header].get(len(row))
+                if fields and row[fields[0]] == chain and row[fields[1]] == str(resseq):
+                    ccs.append(float(row[fields[2]]))
+    except (OSError, ValueError):
+        return None
+    return sum(ccs) / len(ccs) if ccs else None
+
+def state_rscc(state_dir, stem, chain, resseq, resolution=None):
+    """Mean per-atom CC of the residue in one state, with REPORT_NAME written; None if unavailable."""
+    if not os.path.isdir(state_dir):
+        # an archived tuple (tuple_archive.py) is finished: its report is only read back
+        return read_report(os.path.join(state_dir, REPORT_NAME))
+    pdb_file = os.path.join(state_dir, f"{stem}.pdb")
+    map_file = os.path.join(state_dir, f"{stem}{MAP_SUFFIX}")
+    if not (os.path.exists(pdb_file) and os.path.exists(map_file)):
+        return None
+    try:
+        scores = residue_rscc(pdb_file, map_file, chain, resseq, resolution)
+    except (OSError, ValueError) as e:
+        print(f" Error scoring {map_file}: {e}", file=sys.stderr)
+        return None
+
+    with open(os.path.join(state_dir, REPORT_NAME), "w") as f:
+        f.write("chain resseq atom CC\n")
+        for label, cc in scores:
+            f.write(f"{chain} {resseq} {label} {'NA' if cc is None else f'{cc:.4f}'}\n")
+    ccs = [cc for _, cc in scores if cc is not None]
+    return sum(ccs) / len(ccs) if ccs else None
+
+def fmt(value):
+    return "NA" if value is None else f"{value:.4f}"
+
+def write_summary(fields):
+    """Record the pair's row in the results store (and its line in the text summary)."""
+    metrics_store.record_result("rscc", fields)
+
+def delta_class(delta):
+    """WC (1), HG (-1) or ambiguous (0), as make_report.py reads an RSCC delta."""
+    if abs(delta) <= DELTA_TOL:
+        return 0
+    return 1 if delta > 0 else -1
+
+def calibrated_state(state_dir, stem, chain, resseq):
+    """(phenix CC, in-process CC) of one state with a phenix report, or None."""
+    phenix = phenix_report_cc(os.path.join(state_dir, PHENIX_REPORT_NAME), chain, resseq)
+    if phenix is None:
+        return None
+    if os.path.isdir(state_dir):
+        return phenix, state_rscc(state_dir, stem, chain, resseq)
+    # archived tuple: score a copy of the model and map, the archive is not touched
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in (f"{stem}.pdb", f"{stem}{MAP_SUFFIX}"):
+            path = os.path.join(state_dir, name)
+            if not tuple_archive.exists(path):
+                return phenix, None
+            with open(os.path.join(tmp, name), "wb") as f:
+                f.write(tuple_archive.read_bytes(path))
+        return phenix, state_rscc(tmp, stem, chain, resseq)
+
+def calibrate(roots):
+    """
+    Compare the in-process RSCC with phenix's RSCC_report.txt for every state
+    that has one under roots; print the per-state values and the agreement.
+    Return the list of (tuple, state, phenix, in-process).
+    """
+    results = []
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        names = sorted({n[:-len(tuple_archive.ARCHIVE_SUFFIX)] if n.endswith(tuple_archive.ARCHIVE_SUFFIX) else n
+                        for n in os.listdir(root)})
+        for name in names:
+            tup = os.path.join(root, name)
+            parts = name.rsplit("_", 2)
+            if len(parts) != 3 or not tuple_archive.isdir(tup):
+                continue
+            pdbid, chain, resseq = parts
+            try:
+                resseq = int(resseq)
+            except ValueError:
+                continue
+            for state, stem in (("WC", WC_STEM), ("HG", HG_STEM)):
+                pair = calibrated_state(os.path.join(tup, state), stem.format(pdbid=pdbid), chain, resseq)
+                if pair is not None:
+                    results.append((name, state, *pair))
+
+    for name, state, phenix, ours in results:
+        print(f"{name:20s} {state} {phenix:7.4f} {fmt(ours):>7s}")
+    diff = np.array([o - p for _, _, p, o in results if o is not None])
+    if len(diff):
+        print(f" states: {len(diff)}, mean difference {diff.mean():+.4f}, "
+              f"mean |difference| {np.abs(diff).mean():.4f}, max |difference| {np.abs(diff).max():.4f}")
+    by_tuple = {}
+    for name, state, phenix, ours in results:
+        by_tuple.setdefault(name, {})[state] = (phenix, ours)
+    deltas = [(s['WC'][0] - s['HG'][0], s['WC'][1] - s['HG'][1]) for s in by_tuple.values()
+              if set(s) == {"WC", "HG"} and s['WC'][1] is not None and s['HG'][1] is not None]
+    if deltas:
+        d = np.array([o - p for p, o in deltas])
+        changed = sum(delta_class(p) != delta_class(o) for p, o in deltas)
+        print(f" WC-HG delta: {len(d)} tuples, mean |difference| {np.abs(d).mean():.4f}, "
+              f"max |difference| {np.abs(d).max():.4f}, class changed at {DELTA_TOL} in {changed}")
+    if not results:
+        print(f" No phenix {PHENIX_REPORT_NAME} found to calibrate against", file=sys.stderr)
+    return results
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--calibrate":
+        calibrate(sys.argv[2:] or ROOT_GLOBS[:1])
+        sys.exit(0)
+
+    resolution = None
+    if "--resolution" in sys.argv:
+        i = sys.argv.index("--resolution")
+        try:
+            resolution = float(sys.argv[i + 1])
+        except (IndexError, ValueError):
+            print(" Error: --resolution needs a number (A)", file=sys.stderr)
+            sys.exit(1)
+        del sys.argv[i:i + 2]
+
+    if len(sys.argv) != 8:
+        print("Usage: python3 rscc.py pdb_id chain_1 nt_type_1 nt_number_1 chain_2 nt_type_2 nt_number_2 "
+              "[--resolution D]", file=sys.stderr)
+        sys.exit(1)
+
+    pdbid = sys.argv[1]
+    chain1, nt_type1, nt1 = sys.argv[2], sys.argv[3], int(sys.argv[4])
+    chain2, nt_type2, nt2 = sys.argv[5], sys.argv[6], int(sys.argv[7])
+
+    chain_purine, nt_purine = get_purine_info(chain1, nt_type1, nt1, chain2, nt_type2, nt2)
+    if chain_purine is None:
+        print(f" No purine found for {pdbid} {chain1}:{nt_type1}{nt1} - {chain2}:{nt_type2}{nt2}", file=sys.stderr)
+        sys.exit(1)
+
+    tup_dir = locate_tuple_dir(pdbid, chain_purine, nt_purine)
+    if not tup_dir:
+        print(f" Missing tuple dir for {pdbid}_{chain_purine}_{nt_purine}", file=sys.stderr)
+        sys.exit(1)
+
+    rscc_wc = state_rscc(os.path.join(tup_dir, "WC"), WC_STEM.format(pdbid=pdbid), chain_purine, nt_purine,
+                         resolution)
+    rscc_hg = state_rscc(os.path.join(tup_dir, "HG"), HG_STEM.format(pdbid=pdbid), chain_purine, nt_purine,
+                         resolution)
+
+    write_summary([pdbid, chain1, nt_type1, nt1, chain2, nt_type2, nt2, fmt(rscc_wc), fmt(rscc_hg)])
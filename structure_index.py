@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Column-oriented atom table of a PDB file with a residue index.
+
+A file is parsed once into numpy arrays (chain, resseq, icode, altloc, name,
+resname, element, xyz, occupancy, B and the line number of each atom record), and the
+atoms of every residue are indexed as ranges of that table, so per-residue
+B-factor, occupancy and atom-name lookups are slices instead of re-reads of
+the file.  load() keeps the last few tables of a process, keyed on the file's
+size and mtime.  Files of an archived tuple directory are read from the
+archive (see tuple_archive.py).
+
+Like Bfactor.py and check_occupancy.py, residues are looked up by chain and
+residue number; an insertion code narrows the selection only when given.
+
+Usage:
+    python3 structure_index.py <pdb_file> <chain> <resseq> [...]    # per-residue summary
+"""
+import os
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+import tuple_archive
+
+# -------------------------
+# Config
+# -------------------------
+CACHE_SIZE = 8
+
+_CACHE = OrderedDict()
+
+# -------------------------
+# Atom table
+# -------------------------
+class StructureIndex:
+    """Atom records of one PDB file as numpy columns, plus {(chain, resseq): [(start, stop), ...]}."""
+    def __init__(self, columns):
+        self.chain = columns['chain']
+        self.resseq = columns['resseq']
+        self.icode = columns['icode']
+        self.altloc = columns['altloc']
+        self.name = columns['name']
+        self.resname = columns['resname']
+        self.element = columns['element']
+        self.xyz = columns['xyz']
+        self.occupancy = columns['occupancy']
+        self.b = columns['b']
+        self.line = columns['line']
+        self.hetero = columns['hetero']
+        self.residues = self._index()
+
+    def __len__(self):
+        return len(self.chain)
+
+    def _index(self):
+        """Map (chain, resseq) to the (start, stop) runs of its atoms, in file order."""
+        n = len(self.chain)
+        residues = {}
+        if n == 0:
+            return residues
+        change = np.ones(n, dtype=bool)
+        change[1:] = (self.chain[1:] != self.chain[:-1]) | (self.resseq[1:] != self.resseq[:-1])
+        starts = np.flatnonzero(change)
+        stops = np.append(starts[1:], n)
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            key = (str(self.chain[start]), int(self.resseq[start]))
+            residues.setdefault(key, []).append((start, stop))
+        return residues
+
+    def atoms(self, chain, resseq, icode=None):
+        """Indices of the atoms of a residue: a slice if contiguous, an index array otherwise."""
+        runs = self.residues.get((chain, int(resseq)))
+        if not runs:
+            return np.empty(0, dtype=np.intp)
+        if len(runs) == 1:
+            idx = slice(*runs[0])
+        else:
+            idx = np.concatenate([np.arange(start, stop) for start, stop in runs])
+        if icode is not None and icode != " ":
+            sel = np.arange(len(self))[idx]
+            idx = sel[self.icode[sel] == icode]
+        return idx
+
+    def has_residue(self, chain, resseq):
+        return (chain, int(resseq)) in self.residues
+
+    def atom_names(self, chain, resseq):
+        return set(self.name[self.atoms(chain, resseq)].tolist())
+
+    def mean_b(self, chain, resseq):
+        """Mean B-factor of all atoms of a residue (unreadable values skipped), or None."""
+        b = self.b[self.atoms(chain, resseq)]
+        b = b[~np.isnan(b)]
+        return float(np.mean(b)) if len(b) else None
+
+    def occupancy_by_alt(self, chain, resseq, icode=None):
+        """[(altloc, mean occupancy)] of a residue in order of first appearance ('.' = no altloc)."""
+        idx = self.atoms(chain, resseq, icode)
+        alts = self.altloc[idx]
+        occ = self.occupancy[idx]
+        _, first = np.unique(alts, return_index=True)
+        return [(str(alts[i]) or ".", float(np.mean(occ[alts == alts[i]]))) for i in sorted(first)]
+
+    def summarize(self, keys):
+        """
+        Answer many residues in one call: {(chain, resseq): summary or None}, where a
+        summary holds 'atoms' (set of names), 'occupancy' ([(altloc, mean)]) and 'mean_b'.
+        """
+        out = {}
+        for chain, resseq in keys:
+            if not self.has_residue(chain, resseq):
+                out[(chain, resseq)] = None
+                continue
+            out[(chain, resseq)] = {
+                'atoms': self.atom_names(chain, resseq),
+                'occupancy': self.occupancy_by_alt(chain, resseq),
+                'mean_b': self.mean_b(chain, resseq),
+            }
+        return out
+
+# -------------------------
+# Loader
+# -------------------------
+def parse_float(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+def element_of(ln):
+    """Element symbol of an atom record: columns 77-78, else guessed from the atom name."""
+    element = ln[76:78].strip()
+    if element:
+        return element.upper()
+    name = ln[12:16]
+    if name[0] in " 0123456789" or name[0] == "H" and len(name.strip()) == 4:
+        return name[1]
+    return name[:2].strip()
+
+def parse(pdb_file):
+    """Parse the ATOM/HETATM records of pdb_file into a StructureIndex."""
+    cols = {k: [] for k in ['chain', 'resseq', 'icode', 'altloc', 'name', 'resname', 'element',
+                            'x', 'y', 'z', 'occupancy', 'b', 'line', 'hetero']}
+    with tuple_archive.open_file(pdb_file) as fh:
+        for n, ln in enumerate(fh):
+            if not (ln.startswith("ATOM") or ln.startswith("HETATM")):
+                continue
+            try:
+                resseq = int(ln[22:26])
+            except ValueError:
+                continue
+            ln = ln.rstrip("\n").ljust(78)
+            cols['chain'].append(ln[21])
+            cols['resseq'].append(resseq)
+            cols['icode'].append(ln[26])
+            cols['altloc'].append(ln[16].strip())
+            cols['name'].append(ln[12:16].strip())
+            cols['resname'].append(ln[17:20].strip())
+            cols['element'].append(element_of(ln))
+            cols['x'].append(parse_float(ln[30:38]))
+            cols['y'].append(parse_float(ln[38:46]))
+            cols['z'].append(parse_float(ln[46:54]))
+            cols['occupancy'].append(parse_float(ln[54:60]))
+            cols['b'].append(parse_float(ln[60:66]))
+            cols['line'].append(n)
+            cols['hetero'].append(ln.startswith("HETATM"))
+
+    columns = {
+        'chain': np.array(cols['chain'], dtype="U1"),
+        'resseq': np.array(cols['resseq'], dtype=np.int32),
+        'icode': np.array(cols['icode'], dtype="U1"),
+        'altloc': np.array(cols['altloc'], dtype="U1"),
+        'name': np.array(cols['name'], dtype="U4"),
+        'resname': np.array(cols['resname'], dtype="U3"),
+        'element': np.array(cols['element'], dtype="U2"),
+        'xyz': np.column_stack([cols['x'], cols['y'], cols['z']]).astype(float) if cols['x']
+               else np.empty((0, 3)),
+        'occupancy': np.array(cols['occupancy'], dtype=float),
+        'b': np.array(cols['b'], dtype=float),
+        'line': np.array(cols['line'], dtype=np.int64),
+        'hetero': np.array(cols['hetero'], dtype=bool),
+    }
+    return StructureIndex(columns)
+
+def load(pdb_file):
+    """Return the StructureIndex of pdb_file, parsing it only if it changed since the last call."""
+    size, mtime_ns = tuple_archive.stat(pdb_file)
+    key = (os.path.realpath(pdb_file), size, mtime_ns)
+    index = _CACHE.get(key)
+    if index is None:
+        index = parse(pdb_file)
+        _CACHE[key] = index
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+    else:
+        _CACHE.move_to_end(key)
+    return index
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or len(sys.argv) % 2:
+        print("Usage: python3 structure_index.py <pdb_file> <chain> <resseq> [<chain> <resseq> ...]", file=sys.stderr)
+        sys.exit(1)
+
+    index = load(sys.argv[1])
+    keys = [(sys.argv[i], int(sys.argv[i + 1])) for i in range(2, len(sys.argv), 2)]
+    print(f"{len(index)} atoms, {len(index.residues)} residues")
+    for (chain, resseq), summary in index.summarize(keys).items():
+        if summary is None:
+            print(f"{chain} {resseq} missing")
+            continue
+        occ = " ".join(f"{alt}:{q:.3f}" for alt, q in summary['occupancy'])
+        mean_b = "None" if summary['mean_b'] is None else f"{summary['mean_b']:.1f}"
+        print(f"{chain} {resseq} atoms={len(summary['atoms'])} occupancy={occ} mean_B={mean_b}")
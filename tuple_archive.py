@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Packed archives of finished tuple directories.
+
+A finished pair leaves a few dozen files (models, MTZs, maps, logs, figures,
+score files) in PDB_without_nt/<pdb>_<chain>_<nt>/.  pipeline.py packs that
+directory into one PDB_without_nt/<pdb>_<chain>_<nt>.zip once the pair's
+report is written, instead of keeping every file or deleting the folder.
+Maps, MTZs, models and text are deflated; figures and other files that are
+already compressed are stored as they are.  The zip central directory is the
+index: any member can be read without unpacking the others.
+
+The readers (make_report.py, render_reports.py and the metric scripts) go
+through exists() / isdir() / open_file() / glob_files() / stat(), which use
+the file on disk if there is one and else the member of the archive of the
+nearest enclosing directory.  Each member keeps the mtime of its file (in
+nanoseconds, in the member comment), so unpack() restores a directory whose
+files still match the fingerprints in the pair's journal.
+
+Pairs that share a purine share a tuple directory, so packing a directory
+keeps the members of an existing archive that the directory does not hold,
+and batch_run.py merges the archive of a task into the one of the run
+directory (merge()) instead of replacing it.
+
+Usage:
+    python3 tuple_archive.py [PDB_without_nt]        # pack every tuple directory still unpacked
+    python3 tuple_archive.py --list <tuple_dir>
+    python3 tuple_archive.py --unpack <tuple_dir>
+    python3 tuple_archive.py --cat <path>
+"""
+import io
+import os
+import sys
+import glob
+import time
+import shutil
+import fnmatch
+import zipfile
+import argparse
+
+# -------------------------
+# Config
+# -------------------------
+ROOT = "PDB_without_nt"
+ARCHIVE_SUFFIX = ".zip"
+TMP_SUFFIX = ".tmp"
+CHUNK = 1 << 20
+
+# Already compressed: deflating them again costs time and saves nothing
+STORED_SUFFIXES = (".png", ".jpg", ".pdf", ".gz", ".bz2", ".zip", ".npz")
+
+# -------------------------
+# Helpers
+# -------------------------
+def archive_path(tuple_dir):
+    return os.path.normpath(tuple_dir) + ARCHIVE_SUFFIX
+
+def compression(name):
+    return zipfile.ZIP_STORED if name.lower().endswith(STORED_SUFFIXES) else zipfile.ZIP_DEFLATED
+
+def member_mtime(info):
+    """mtime (ns) of the file a member was packed from."""
+    try:
+        return int(info.comment)
+    except ValueError:
+        return int(time.mktime(info.date_time + (0, 0, -1)) * 1e9)
+
+def locate(path):
+    """
+    (archive, member name) holding path, or None: path is looked up in the
+    archive of each enclosing directory, nearest first.
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    for i in range(len(parts) - 1, 0, -1):
+        head = os.sep.join(parts[:i])
+        if head and os.path.isfile(head + ARCHIVE_SUFFIX):
+            return head + ARCHIVE_SUFFIX, "/".join(parts[i:])
+    return None
+
+def _info(path):
+    """(archive, ZipInfo) of an archived file, or None."""
+    found = locate(path)
+    if found is None:
+        return None
+    archive, member = found
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            return archive, zf.getinfo(member)
+    except (KeyError, OSError, zipfile.BadZipFile):
+        return None
+
+# -------------------------
+# Reading
+# -------------------------
+def exists(path):
+    """True if path is a file on disk or in an archive."""
+    return os.path.exists(path) or _info(path) is not None
+
+def isdir(path):
+    """True if path is a directory on disk or an archived one (or a directory inside one)."""
+    if os.path.isdir(path):
+        return True
+    if os.path.isfile(archive_path(path)):
+        return True
+    found = locate(path)
+    if found is None:
+        return False
+    archive, member = found
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            return any(name.startswith(member + "/") for name in zf.namelist())
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+def stat(path):
+    """(size, mtime_ns) of a file on disk or in an archive; FileNotFoundError if neither."""
+    if os.path.exists(path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    found = _info(path)
+    if found is None:
+        raise FileNotFoundError(path)
+    return found[1].file_size, member_mtime(found[1])
+
+def open_file(path, mode="r", newline=None):
+    """Open a file for reading ("r" or "rb") from disk or, without unpacking, from its archive."""
+    if os.path.exists(path):
+        return open(path, mode, newline=newline)
+    found = locate(path)
+    if found is None:
+        raise FileNotFoundError(path)
+    archive, member = found
+    try:
+        # the member keeps the archive file open after zf is closed
+        with zipfile.ZipFile(archive) as zf:
+            fh = zf.open(member)
+    except KeyError:
+        raise FileNotFoundError(path) from None
+    except zipfile.BadZipFile as e:
+        raise OSError(f"{archive}: {e}") from None
+    return fh if "b" in mode else io.TextIOWrapper(fh, newline=newline)
+
+def read_bytes(path):
+    with open_file(path, "rb") as f:
+        return f.read()
+
+def glob_files(pattern):
+    """Sorted files matching a glob pattern, on disk and in the archives of its directories."""
+    found = set(glob.glob(pattern))
+    head = os.path.dirname(pattern)
+    while head and head != os.path.dirname(head) and not os.path.isfile(head + ARCHIVE_SUFFIX):
+        head = os.path.dirname(head)
+    if head and os.path.isfile(head + ARCHIVE_SUFFIX):
+        prefix = os.path.relpath(pattern, head).replace(os.sep, "/")
+        try:
+            with zipfile.ZipFile(head + ARCHIVE_SUFFIX) as zf:
+                names = [n for n in zf.namelist() if not n.endswith("/")]
+        except (OSError, zipfile.BadZipFile):
+            names = []
+        found.update(os.path.join(head, *n.split("/")) for n in fnmatch.filter(names, prefix))
+    return sorted(found)
+
+# -------------------------
+# Packing
+# -------------------------
+def copy_members(zf, archive, skip=()):
+    """Copy the members of archive whose names are not in skip into the open ZipFile zf; return their names."""
+    copied = []
+    with zipfile.ZipFile(archive) as src:
+        for info in src.infolist():
+            if info.filename in skip:
+                continue
+            clone = zipfile.ZipInfo(info.filename, info.date_time)
+            clone.compress_type = info.compress_type
+            clone.comment = info.comment
+            clone.external_attr = info.external_attr
+            if info.is_dir():
+                zf.writestr(clone, b"")
+            else:
+                with src.open(info) as fin, zf.open(clone, "w") as fout:
+                    shutil.copyfileobj(fin, fout, CHUNK)
+            copied.append(info.filename)
+    return copied
+
+def finish(tmp, archive):
+    """Check every member of tmp against its CRC and rename it to archive."""
+    with zipfile.ZipFile(tmp) as zf:
+        bad = zf.testzip()
+    if bad is not None:
+        raise OSError(f"CRC mismatch on {bad} in {tmp}")
+    os.replace(tmp, archive)
+
+def merge(src, dst):
+    """
+    Merge archive src into archive dst, src's member winning when both have
+    one, and delete src.  If dst does not exist src is just moved.
+    """
+    if not os.path.isfile(dst):
+        shutil.move(src, dst)
+        return
+    tmp = dst + TMP_SUFFIX
+    try:
+        with zipfile.ZipFile(tmp, "w", allowZip64=True) as zf:
+            names = copy_members(zf, src)
+            copy_members(zf, dst, set(names))
+        finish(tmp, dst)
+    except (OSError, zipfile.BadZipFile) as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise OSError(f"cannot merge {src} into {dst}: {e}") from None
+    os.remove(src)
+
+def pack(tuple_dir, remove=True):
+    """
+    Pack tuple_dir into tuple_dir.zip, check every member against its CRC
+    and (with remove) delete the directory.  Members of an existing archive
+    that are not in the directory (e.g. written by another pair of the same
+    purine) are kept.  Return (archive, files, bytes before, bytes after),
+    or None if there is no directory.
+    The archive is written under a temporary name and renamed, so an
+    interrupted pack leaves the directory as it was.
+    """
+    if not os.path.isdir(tuple_dir):
+        return None
+    archive = archive_path(tuple_dir)
+    tmp = archive + TMP_SUFFIX
+    n_files, n_bytes = 0, 0
+    names = set()
+    try:
+        with zipfile.ZipFile(tmp, "w", allowZip64=True) as zf:
+            for dirpath, dirnames, filenames in os.walk(tuple_dir):
+                dirnames.sort()
+                rel_dir = os.path.relpath(dirpath, tuple_dir)
+                if not filenames and not dirnames and rel_dir != ".":
+                    names.add(rel_dir.replace(os.sep, "/") + "/")
+                    zf.writestr(rel_dir.replace(os.sep, "/") + "/", b"")
+                for name in sorted(filenames):
+                    path = os.path.join(dirpath, name)
+                    rel = os.path.normpath(os.path.join(rel_dir, name)).replace(os.sep, "/")
+                    info = zipfile.ZipInfo.from_file(path, rel)
+                    info.compress_type = compression(name)
+                    info.comment = str(os.stat(path).st_mtime_ns).encode()
+                    with open(path, "rb") as src, zf.open(info, "w") as dst:
+                        shutil.copyfileobj(src, dst, CHUNK)
+                    names.add(rel)
+                    n_files += 1
+                    n_bytes += info.file_size
+            if os.path.isfile(archive):
+                copy_members(zf, archive, names)
+        finish(tmp, archive)
+    except (OSError, zipfile.BadZipFile) as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise OSError(f"cannot pack {tuple_dir}: {e}") from None
+    if remove:
+        shutil.rmtree(tuple_dir)
+    return archive, n_files, n_bytes, os.path.getsize(archive)
+
+def unpack(tuple_dir):
+    """
+    Restore tuple_dir from its archive, with the files' mtimes, and delete
+    the archive.  Return True if it was unpacked; a directory that exists
+    is left as it is.
+    """
+    archive = archive_path(tuple_dir)
+    if os.path.isdir(tuple_dir) or not os.path.isfile(archive):
+        return False
+    tmp = os.path.normpath(tuple_dir) + TMP_SUFFIX
+    shutil.rmtree(tmp, ignore_errors=True)
+    with zipfile.ZipFile(archive) as zf:
+        zf.extractall(tmp)
+        for info in zf.infolist():
+            if not info.is_dir():
+                mtime = member_mtime(info)
+                os.utime(os.path.join(tmp, *info.filename.split("/")), ns=(mtime, mtime))
+    os.replace(tmp, tuple_dir)
+    os.remove(archive)
+    return True
+
+def pack_all(root=ROOT):
+    """Pack every tuple directory under root; return (directories packed, files, bytes before, bytes after)."""
+    totals = [0, 0, 0, 0]
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path) or name.endswith(TMP_SUFFIX):
+            continue
+        try:
+            _, n_files, before, after = pack(path)
+        except OSError as e:
+            print(f" Error: {e}", file=sys.stderr)
+            continue
+        for i, v in enumerate((1, n_files, before, after)):
+            totals[i] += v
+    return tuple(totals)
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack, list and read archived tuple directories.")
+    parser.add_argument("root", nargs="?", default=ROOT, help=f"directory of tuple directories (default: {ROOT})")
+    parser.add_argument("--list", metavar="TUPLE_DIR", help="list the members of a tuple archive")
+    parser.add_argument("--unpack", metavar="TUPLE_DIR", help="restore a tuple directory from its archive")
+    parser.add_argument("--cat", metavar="PATH", help="write a file, archived or not, to stdout")
+    args = parser.parse_args()
+
+    try:
+        if args.cat:
+            sys.stdout.buffer.write(read_bytes(args.cat))
+        elif args.list:
+            with zipfile.ZipFile(archive_path(args.list)) as zf:
+                for info in zf.infolist():
+                    print(f"{info.file_size:>12} {info.compress_size:>12} {info.filename}")
+        elif args.unpack:
+            if not unpack(args.unpack):
+                print(f" Error: no archive to unpack, or {args.unpack} already exists", file=sys.stderr)
+                sys.exit(1)
+        else:
+            if not os.path.isdir(args.root):
+                print(f" Error: directory not found: {args.root}", file=sys.stderr)
+                sys.exit(1)
+            n_dirs, n_files, before, after = pack_all(args.root)
+            print(f"Packed {n_dirs} tuple directories ({n_files} files, {before} -> {after} bytes)")
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f" Error: {e}", file=sys.stderr)
+        sys.exit(1)